@@ -0,0 +1,1982 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" Replay benchmark for lambda_handler.
+
+Replays recorded-style Alexa sessions (launch, search, pick, a run of
+next/previous/repeat steps, stop) through skinnytaste.lambda_handler against
+local stand-ins: a fixture HTTP server serving generated search and recipe
+pages, a recipe index of the same recipes, and an in-memory DynamoDB. Each
+worker process plays the part of one Lambda container.
+
+    python benchmark.py --sessions 200 --concurrency 4 --steps 8
+    python benchmark.py --json-output baseline.json
+    python benchmark.py --baseline baseline.json
+    python benchmark.py --no-index
+    python benchmark.py --dynamodb-latency 5 --handler overlapped_lambda_handler --compare-handler lambda_handler
+    python benchmark.py --recipe-encoding
+    python benchmark.py --metrics-overhead
+    python benchmark.py --step-latency
+    python benchmark.py --startup
+    python benchmark.py --search-log queries.txt --no-index
+    python benchmark.py --page-streaming
+    python benchmark.py --parser-backends
+    python benchmark.py --fault-injection
+    python benchmark.py --query-rewriting --vocabulary-size 30000
+    python benchmark.py --migration
+
+Reports p50/p95/p99 latency, DynamoDB capacity units and bytes written per
+intent, calls made to the site and to DynamoDB, and peak memory and objects
+left allocated per worker.
+"""
+
+import argparse
+import BaseHTTPServer
+import copy
+import gc
+import hashlib
+import json
+import multiprocessing
+import os
+import random
+import re
+import resource
+import socket
+import SocketServer
+import sys
+import tempfile
+import threading
+import time
+import urlparse
+
+
+# ----------------------- Fixture pages -----------------------------
+
+INGREDIENTS = [
+    'chicken breast', 'zucchini', 'broccoli', 'ground turkey', 'tomatoes',
+    'garlic', 'onion', 'olive oil', 'parmesan cheese', 'spinach', 'quinoa',
+    'black beans', 'sweet potato', 'shrimp', 'cauliflower', 'bell pepper',
+    'lime', 'cilantro', 'brown rice', 'mushrooms', 'eggs', 'salmon'
+]
+
+DISHES = [
+    'Stir Fry', 'Casserole', 'Chili', 'Soup', 'Salad', 'Tacos', 'Skillet',
+    'Sheet Pan Dinner', 'Enchiladas', 'Burrito Bowls', 'Frittata', 'Stew'
+]
+
+# Padding standing in for the ads, comments and related posts that make up
+# most of a real page.
+PAGE_PADDING = '<div class="comment"><p>' + 'Delicious, made this twice already! ' * 40 + '</p></div>\n'
+
+
+def recipe_title(recipe_id):
+    rng = random.Random(recipe_id)
+    return '{first} and {second} {dish}'.format(
+        first=rng.choice(INGREDIENTS).title(),
+        second=rng.choice(INGREDIENTS).title(),
+        dish=rng.choice(DISHES)
+    )
+
+
+def recipe_contents(recipe_id, number_of_steps):
+    rng = random.Random(recipe_id)
+    ingredients = rng.sample(INGREDIENTS, 8)
+    steps = [
+        'Step text for {ingredient}, cook about {minutes} minutes until done . '.format(
+            ingredient=rng.choice(ingredients), minutes=rng.randint(2, 30))
+        for _ in range(number_of_steps)
+    ]
+    return ingredients, steps
+
+
+def recipe_page(recipe_id, number_of_steps=12):
+    """ A recipe page. Even ids use the current recipe card layout, odd ids
+    the legacy "Directions:" layout.
+    """
+    ingredients, steps = recipe_contents(recipe_id, number_of_steps)
+
+    page = ['<html><head><title>{title}</title></head><body><div class="post">'.format(title=recipe_title(recipe_id))]
+    page.append('<h1>{title}</h1>'.format(title=recipe_title(recipe_id)))
+    page.append(PAGE_PADDING * 20)
+    if recipe_id % 2 == 0:
+        page.append('<div class="ingredients"><ul>')
+        page.extend('<li class="ingredient">1 cup {0}</li>'.format(ingredient) for ingredient in ingredients)
+        page.append('</ul></div><div class="instructions"><ol>')
+        page.extend('<li>{0}<a href="/tip/">see tip</a></li>'.format(step) if i % 4 == 0 else '<li>{0}</li>'.format(step)
+                    for i, step in enumerate(steps))
+        page.append('</ol></div>')
+    else:
+        page.append('<p>Ingredients:</p><ul>')
+        page.extend('<li>1 cup {0}</li>'.format(ingredient) for ingredient in ingredients)
+        page.append('</ul><p>Directions:</p>')
+        page.extend('<p>{0}</p>'.format(step) for step in steps)
+        page.append('<p>Get new free recipes and exclusive content delivered right to your inbox:</p>')
+    page.append(PAGE_PADDING * 40)
+    page.append('</div></body></html>')
+    return ''.join(page)
+
+
+def redesigned_recipe_page(recipe_id, number_of_steps=12, with_json_ld=True):
+    """ A recipe page in a layout the scraper doesn't know, optionally with
+    the recipe in schema.org JSON-LD as well.
+    """
+    ingredients, steps = recipe_contents(recipe_id, number_of_steps)
+
+    page = ['<html><head><title>{title}</title>'.format(title=recipe_title(recipe_id))]
+    if with_json_ld:
+        page.append('<script type="application/ld+json">{0}</script>'.format(json.dumps({
+            '@context': 'https://schema.org',
+            '@graph': [
+                {'@type': 'WebPage', 'name': recipe_title(recipe_id)},
+                {
+                    '@type': 'Recipe',
+                    'name': recipe_title(recipe_id),
+                    'recipeIngredient': ['1 cup ' + ingredient for ingredient in ingredients],
+                    'recipeInstructions': [{'@type': 'HowToStep', 'text': step} for step in steps]
+                }
+            ]
+        })))
+    page.append('</head><body><main><h1>{title}</h1>'.format(title=recipe_title(recipe_id)))
+    page.append('<section class="recipe-card-v2">')
+    page.extend('<span class="recipe-ingredient-v2">1 cup {0}</span>'.format(ingredient) for ingredient in ingredients)
+    page.extend('<span class="recipe-step-v2">{0}</span>'.format(step) for step in steps)
+    page.append('</section>')
+    page.append(PAGE_PADDING * 40)
+    page.append('</main></body></html>')
+    return ''.join(page)
+
+
+def fixture_documents(base_url='', number_of_recipes=1000):
+    """ The recipe index documents for the fixture recipes. """
+    documents = []
+    for recipe_id in range(number_of_recipes):
+        ingredients, _ = recipe_contents(recipe_id, 1)
+        documents.append({
+            'title': recipe_title(recipe_id),
+            'url': '{0}/recipe-{1}/'.format(base_url, recipe_id),
+            'lastmod': None,
+            'ingredients': ['1 cup ' + ingredient for ingredient in ingredients]
+        })
+    return documents
+
+
+def search_page(base_url, query, number_of_results=10):
+    rng = random.Random(query)
+    page = ['<html><body>', PAGE_PADDING * 10]
+    for recipe_id in rng.sample(range(1000), number_of_results):
+        page.append('<article><a rel="bookmark" href="{base_url}/recipe-{recipe_id}/"><h2>{title}</h2></a></article>'.format(
+            base_url=base_url, recipe_id=recipe_id, title=recipe_title(recipe_id)))
+    page.append(PAGE_PADDING * 10)
+    page.append('</body></html>')
+    return ''.join(page)
+
+
+# How long the fixture server stalls with its "slow" fault
+FAULT_DELAY = 2.0
+
+# Last-Modified of every fixture recipe page
+FIXTURE_LAST_MODIFIED = 'Mon, 01 Jan 2018 00:00:00 GMT'
+
+
+class FixtureRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """ Serves the fixture pages, with the server's current fault injected:
+    "slow" stalls every response, "error" answers 503, an HTTP status code
+    answers with that status, "layout" serves recipes in an unknown layout
+    with JSON-LD, and "broken" without it. Recipe pages have an ETag and
+    Last-Modified, and conditional requests for unchanged pages get a 304.
+    """
+
+    # Keep connections alive, as the site does
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        fault = self.server.take_fault()
+        if fault == 'slow':
+            time.sleep(FAULT_DELAY)
+        elif fault == 'error':
+            self.send_error(503)
+            return
+        elif isinstance(fault, int):
+            self.send_error(fault)
+            return
+
+        parts = urlparse.urlsplit(self.path)
+        base_url = 'http://{0}:{1}'.format(*self.server.server_address)
+        if parts.path.startswith('/recipe-'):
+            # /recipe-<id>/, or /recipe-<id>-steps-<n>/ for one with n steps
+            kind = 'recipe'
+            path_parts = parts.path.strip('/').split('-')
+            recipe_id = int(path_parts[1])
+            number_of_steps = int(path_parts[3]) if len(path_parts) == 4 else 12
+            if fault in ('layout', 'broken'):
+                body = redesigned_recipe_page(recipe_id, number_of_steps, with_json_ld=fault == 'layout')
+            else:
+                body = recipe_page(recipe_id, number_of_steps)
+        elif parts.path == '/' and 's' in urlparse.parse_qs(parts.query):
+            kind = 'search'
+            body = search_page(base_url, urlparse.parse_qs(parts.query)['s'][0])
+        else:
+            self.send_error(404)
+            return
+
+        # Recipe pages can be revalidated, like the site's
+        validators = {}
+        if kind == 'recipe':
+            validators = {'ETag': '"{0}"'.format(hashlib.md5(body).hexdigest()), 'Last-Modified': FIXTURE_LAST_MODIFIED}
+            if_none_match = self.headers.get('If-None-Match')
+            if ((if_none_match or self.headers.get('If-Modified-Since')) and
+                    if_none_match in (None, validators['ETag']) and
+                    self.headers.get('If-Modified-Since') in (None, FIXTURE_LAST_MODIFIED)):
+                kind = 'not_modified'
+
+        with self.server.counter_lock:
+            self.server.request_counts[kind] = self.server.request_counts.get(kind, 0) + 1
+
+        if kind == 'not_modified':
+            self.send_response(304)
+            for name, value in validators.items():
+                self.send_header(name, value)
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in validators.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FixtureServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """ The fixture HTTP server. Set fault to inject one (see
+    FixtureRequestHandler) into every request, or only into the next
+    faults_left requests. Counts the requests served per kind of page, the
+    requests received (attempts) and the connections accepted.
+    """
+    daemon_threads = True
+
+    def __init__(self):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', 0), FixtureRequestHandler)
+        self.counter_lock = threading.Lock()
+        self.request_counts = {}
+        self.attempts = 0
+        self.connection_count = 0
+        self.fault = None
+        self.faults_left = None
+        self.open_connections = {}
+
+    def take_fault(self):
+        with self.counter_lock:
+            self.attempts += 1
+            if self.faults_left is None:
+                return self.fault
+            if self.faults_left == 0:
+                return None
+            self.faults_left -= 1
+            return self.fault
+
+    def process_request(self, request, client_address):
+        # ThreadingMixIn.process_request, keeping track of connections and
+        # marking the threads as the server's own
+        connection_thread = threading.Thread(target=self.process_request_thread, args=(request, client_address))
+        connection_thread.daemon = True
+        connection_thread.fixture_connection = True
+        with self.counter_lock:
+            self.connection_count += 1
+            self.open_connections[request] = connection_thread
+        connection_thread.start()
+
+    def shutdown_request(self, request):
+        with self.counter_lock:
+            self.open_connections.pop(request, None)
+        BaseHTTPServer.HTTPServer.shutdown_request(self, request)
+
+    def shutdown(self):
+        # Also hang up on kept-alive connections and wait for their threads,
+        # or they're still waiting for another request, or stalling a
+        # response, when the interpreter exits
+        BaseHTTPServer.HTTPServer.shutdown(self)
+        with self.counter_lock:
+            open_connections = self.open_connections.items()
+        for request, connection_thread in open_connections:
+            try:
+                request.shutdown(socket.SHUT_RD)
+            except socket.error:
+                pass
+            connection_thread.join(FAULT_DELAY + 1)
+
+    def handle_error(self, request, client_address):
+        # Streamed recipe pages are closed before they've been sent in full
+        if not isinstance(sys.exc_info()[1], socket.error):
+            BaseHTTPServer.HTTPServer.handle_error(self, request, client_address)
+
+
+def wait_for_background_threads(server, timeout=10):
+    """ Wait for the skill's background threads (prefetches, refreshes,
+    writes) to finish. The fixture server's own threads are left alone.
+    """
+    for thread in threading.enumerate():
+        if (thread.daemon and thread not in (threading.current_thread(), server.serving_thread)
+                and not getattr(thread, 'fixture_connection', False)):
+            thread.join(timeout)
+
+
+def start_fixture_server():
+    server = FixtureServer()
+    server_thread = threading.Thread(target=server.serve_forever)
+    server_thread.daemon = True
+    server_thread.start()
+    server.serving_thread = server_thread
+    server.base_url = 'http://{0}:{1}'.format(*server.server_address)
+    return server
+
+
+# ----------------------- In-memory DynamoDB -----------------------------
+
+def attribute_size(value):
+    """ Approximate stored size in bytes of a DynamoDB attribute value. """
+    if 'S' in value:
+        return len(value['S'].encode('utf-8'))
+    if 'B' in value:
+        return len(value['B'])
+    if 'N' in value:
+        return len(value['N'])
+    if 'L' in value:
+        return 3 + sum(1 + attribute_size(element) for element in value['L'])
+    if 'M' in value:
+        return 3 + sum(1 + len(name) + attribute_size(element) for name, element in value['M'].items())
+    return 1
+
+
+def item_size(item):
+    return sum(len(name) + attribute_size(value) for name, value in item.items())
+
+
+def read_capacity_units(size, consistent_read):
+    """ Reads are charged per 4 KB of the whole item, projection or not, and
+    eventually consistent reads cost half.
+    """
+    units = max(1, -(-size // 4096))
+    return units if consistent_read else units / 2.0
+
+
+def write_capacity_units(size):
+    return max(1, -(-size // 1024))
+
+
+CONDITION_COMPARISONS = {
+    '=': lambda left, right: left == right,
+    '<>': lambda left, right: left != right,
+    '<': lambda left, right: left < right,
+    '<=': lambda left, right: left <= right,
+    '>': lambda left, right: left > right,
+    '>=': lambda left, right: left >= right
+}
+
+
+class FakeDynamoDB(object):
+    """ Stand-in for the low-level DynamoDB client, supporting the calls the
+    skill makes. Counts calls (in total and per table), bytes written and the
+    read and write capacity units DynamoDB would charge (in total, and per
+    table in table_units as [read units, write units]), and can add a fixed
+    latency to each call to stand in for the network round trip, recording
+    when each call started and finished in call_times. Condition
+    expressions are evaluated as a series of AND'd comparisons and
+    attribute_exists/attribute_not_exists checks; when one fails the call
+    raises ConditionalCheckFailedException, like DynamoDB.
+    """
+
+    def __init__(self, latency=0.0):
+        self.tables = {}
+        self.call_counts = {}
+        self.table_call_counts = {}
+        self.bytes_written = 0
+        self.read_units = 0.0
+        self.write_units = 0
+        self.table_units = {}
+        self.failed_conditions = 0
+        self.latency = latency
+        self.call_times = []
+
+    def count(self, operation, table_name):
+        self.call_counts[operation] = self.call_counts.get(operation, 0) + 1
+        table_call = (operation, table_name)
+        self.table_call_counts[table_call] = self.table_call_counts.get(table_call, 0) + 1
+        started_at = time.time()
+        if self.latency:
+            time.sleep(self.latency)
+        self.call_times.append((operation, table_name, started_at, time.time()))
+
+    def table(self, table_name):
+        return self.tables.setdefault(table_name, {})
+
+    def charge(self, table_name, read_units=0.0, write_units=0):
+        self.read_units += read_units
+        self.write_units += write_units
+        units = self.table_units.setdefault(table_name, [0.0, 0])
+        units[0] += read_units
+        units[1] += write_units
+
+    @staticmethod
+    def key_of(key):
+        return json.dumps(key, sort_keys=True)
+
+    def check_condition(self, operation, item, kwargs):
+        """ Raise ConditionalCheckFailedException if the call's
+        ConditionExpression doesn't hold for item (None if there's none).
+        """
+        if 'ConditionExpression' not in kwargs:
+            return
+        import botocore.exceptions
+
+        item = item or {}
+        names = kwargs.get('ExpressionAttributeNames', {})
+        values = kwargs.get('ExpressionAttributeValues', {})
+
+        def operand(token):
+            if token.startswith(':'):
+                value = values[token]
+            else:
+                value = item.get(names.get(token, token))
+            if value is None:
+                return None
+            return float(value['N']) if 'N' in value else value.values()[0]
+
+        for clause in kwargs['ConditionExpression'].split(' AND '):
+            clause = clause.strip()
+            if clause.startswith('attribute_exists('):
+                holds = names.get(clause[17:-1], clause[17:-1]) in item
+            elif clause.startswith('attribute_not_exists('):
+                holds = names.get(clause[21:-1], clause[21:-1]) not in item
+            else:
+                left, comparison, right = clause.split()
+                left, right = operand(left), operand(right)
+                holds = left is not None and right is not None and CONDITION_COMPARISONS[comparison](left, right)
+            if not holds:
+                self.failed_conditions += 1
+                raise botocore.exceptions.ClientError(
+                    {'Error': {'Code': 'ConditionalCheckFailedException', 'Message': 'The conditional request failed'}},
+                    operation
+                )
+
+    def get_item(self, TableName, Key, **kwargs):
+        self.count('get_item', TableName)
+        item = self.table(TableName).get(self.key_of(Key))
+        self.charge(TableName, read_units=read_capacity_units(item_size(item) if item else 0,
+                                                             kwargs.get('ConsistentRead', False)))
+        if item is None:
+            return {}
+        item = copy.deepcopy(item)
+        if 'ProjectionExpression' in kwargs:
+            names = kwargs.get('ExpressionAttributeNames', {})
+            projected = [names.get(name.strip(), name.strip()) for name in kwargs['ProjectionExpression'].split(',')]
+            item = dict((name, value) for name, value in item.items() if name in projected)
+        return {'Item': item}
+
+    def put_item(self, TableName, Item, **kwargs):
+        self.count('put_item', TableName)
+        self.bytes_written += item_size(Item)
+        key_names = [name for name in Item if name in ('user_id', 'cache_key', 'recipe_key')]
+        key = dict((name, Item[name]) for name in key_names)
+        previous_item = self.table(TableName).get(self.key_of(key))
+        self.check_condition('PutItem', previous_item, kwargs)
+        self.charge(TableName, write_units=write_capacity_units(
+            max(item_size(Item), item_size(previous_item) if previous_item else 0)))
+        self.table(TableName)[self.key_of(key)] = copy.deepcopy(Item)
+        return {}
+
+    def update_item(self, TableName, Key, UpdateExpression, ExpressionAttributeValues, **kwargs):
+        """ Only supports "SET a = :a, b = :b" expressions. """
+        self.count('update_item', TableName)
+        kwargs['ExpressionAttributeValues'] = ExpressionAttributeValues
+        self.check_condition('UpdateItem', self.table(TableName).get(self.key_of(Key)), kwargs)
+        item = self.table(TableName).setdefault(self.key_of(Key), copy.deepcopy(Key))
+        size_before = item_size(item)
+        names = kwargs.get('ExpressionAttributeNames', {})
+        assignments = UpdateExpression.strip()[len('SET '):].split(',')
+        for assignment in assignments:
+            name, value_name = [part.strip() for part in assignment.split('=')]
+            item[names.get(name, name)] = copy.deepcopy(ExpressionAttributeValues[value_name])
+            self.bytes_written += attribute_size(ExpressionAttributeValues[value_name])
+        self.charge(TableName, write_units=write_capacity_units(max(size_before, item_size(item))))
+        return {}
+
+    def batch_write_item(self, RequestItems, **kwargs):
+        for table_name, requests in RequestItems.items():
+            self.count('batch_write_item', table_name)
+            for request in requests:
+                self.put_item(table_name, request['PutRequest']['Item'])
+                self.call_counts['put_item'] -= 1
+                self.table_call_counts[('put_item', table_name)] -= 1
+        return {'UnprocessedItems': {}}
+
+
+# ----------------------- Replaying sessions -----------------------------
+
+QUERIES = [
+    'chicken', 'Chicken recipes', 'zucchini', 'turkey chili', 'broccoli',
+    'sweet potato', 'shrimp tacos', 'cauliflower', 'salmon', 'quinoa salad',
+    'black bean soup', 'egg frittata', 'spinach', 'mushroom skillet'
+]
+
+
+def make_event(session, request_type, intent_name=None, slots=None):
+    request = {
+        'type': request_type,
+        'requestId': 'request-{0}'.format(random.randint(0, 10 ** 9)),
+        'locale': 'en-US'
+    }
+    if intent_name is not None:
+        request['intent'] = {'name': intent_name, 'slots': slots or {}}
+    return {
+        'version': '1.0',
+        'session': copy.deepcopy(session),
+        'request': request
+    }
+
+
+def session_script(rng, number_of_steps):
+    """ The intents of one session, after the launch request. Some searches
+    are misheard, and some are by ingredients.
+    """
+    search = rng.random()
+    if search < 0.15:
+        ingredients = ' and '.join(rng.sample(INGREDIENTS, 2))
+        script = [('SearchByIngredients', {'IngredientList': {'name': 'IngredientList', 'value': ingredients}})]
+    else:
+        query = rng.choice(MISHEARD_QUERIES)[0] if search < 0.3 else rng.choice(QUERIES)
+        script = [('SearchForRecipe', {'RecipeSearchString': {'name': 'RecipeSearchString', 'value': query}})]
+    script.append(('PickRecipeNumber', {'RecipeNumber': {'name': 'RecipeNumber', 'value': str(rng.randint(1, 3))}}))
+    for _ in range(number_of_steps):
+        script.append((rng.choice(['NextStep', 'NextStep', 'NextStep', 'PreviousStep', 'RepeatStep']), {}))
+    resume = rng.random()
+    if resume < 0.2:
+        script.append(('ResumeRecipe', {}))
+    elif resume < 0.3:
+        script.append(('ResumePreviousRecipe', {}))
+    script.append(('AMAZON.StopIntent', {}))
+    return script
+
+
+def replay_session(handler, user_id, rng, number_of_steps, latencies, capacity, fake_dynamodb, responses):
+    session = {
+        'new': True,
+        'sessionId': 'session-' + user_id,
+        'application': {'applicationId': 'benchmark'},
+        'user': {'userId': user_id}
+    }
+
+    events = [make_event(session, 'LaunchRequest')]
+    events.extend(make_event(session, 'IntentRequest', intent_name, slots)
+                  for intent_name, slots in session_script(rng, number_of_steps))
+
+    for event in events:
+        event['session'] = copy.deepcopy(session)
+        if 'intent' in event['request']:
+            intent_name = event['request']['intent']['name']
+        else:
+            intent_name = event['request']['type']
+
+        started_at = time.time()
+        units_before = (fake_dynamodb.read_units, fake_dynamodb.write_units, fake_dynamodb.bytes_written)
+        response = handler(event, None)
+        latencies.setdefault(intent_name, []).append(time.time() - started_at)
+        intent_capacity = capacity.setdefault(intent_name, [0.0, 0, 0])
+        intent_capacity[0] += fake_dynamodb.read_units - units_before[0]
+        intent_capacity[1] += fake_dynamodb.write_units - units_before[1]
+        intent_capacity[2] += fake_dynamodb.bytes_written - units_before[2]
+
+        session['new'] = False
+        session['attributes'] = response.get('sessionAttributes', {})
+        responses.append([user_id, intent_name, json.dumps(response, sort_keys=True)])
+
+
+def run_worker(worker_args):
+    """ Replay sessions in a fresh process, the way one Lambda container would
+    see them.
+    """
+    worker_id, number_of_sessions, number_of_steps, handler_name, seed, dynamodb_latency = worker_args
+    import skinnytaste
+
+    fake_dynamodb = FakeDynamoDB(dynamodb_latency)
+    skinnytaste.dynamodb_client = fake_dynamodb
+    handler = getattr(skinnytaste, handler_name)
+    rng = random.Random(seed + worker_id)
+
+    latencies = {}
+    capacity = {}
+    responses = []
+    gc_objects_before = len(gc.get_objects())
+
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        for session_number in range(number_of_sessions):
+            user_id = 'user-{0}-{1}'.format(worker_id, session_number % 25)
+            replay_session(handler, user_id, rng, number_of_steps, latencies, capacity, fake_dynamodb, responses)
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+
+    # Each replay has its own fixture server, so the recipe URLs and the
+    # recipe keys made from them differ between replays
+    base_url = skinnytaste.SKINNYTASTE_BASE_URL
+    recipe_keys = dict((skinnytaste.recipe_key_for_url('{0}/recipe-{1}/'.format(base_url, recipe_id)),
+                        'recipe-key-{0}'.format(recipe_id))
+                       for recipe_id in range(1000))
+    for response in responses:
+        response[2] = re.sub(r'\b[0-9a-f]{40}\b', lambda match: recipe_keys.get(match.group(0), match.group(0)),
+                             response[2].replace(base_url, 'http://fixture-server'))
+
+    return {
+        'latencies': latencies,
+        'capacity': capacity,
+        'responses': responses,
+        'dynamodb_calls': fake_dynamodb.call_counts,
+        'dynamodb_bytes_written': fake_dynamodb.bytes_written,
+        'recipe_page_bytes_read': skinnytaste.recipe_page_stats['bytes_read'],
+        'prefetch': dict(skinnytaste.prefetch_stats),
+        'search_cache': dict(skinnytaste.search_cache_stats),
+        'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        'gc_objects_retained': len(gc.get_objects()) - gc_objects_before
+    }
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def summarize(worker_results, http_request_counts, wall_time):
+    latencies = {}
+    capacity = {}
+    dynamodb_calls = {}
+    for worker_result in worker_results:
+        for intent_name, values in worker_result['latencies'].items():
+            latencies.setdefault(intent_name, []).extend(values)
+        for intent_name, (read_units, write_units, bytes_written) in worker_result['capacity'].items():
+            intent_capacity = capacity.setdefault(intent_name, [0.0, 0, 0])
+            intent_capacity[0] += read_units
+            intent_capacity[1] += write_units
+            intent_capacity[2] += bytes_written
+        for operation, count in worker_result['dynamodb_calls'].items():
+            dynamodb_calls[operation] = dynamodb_calls.get(operation, 0) + count
+
+    intents = {}
+    total_requests = 0
+    for intent_name, values in latencies.items():
+        values.sort()
+        total_requests += len(values)
+        intents[intent_name] = {
+            'count': len(values),
+            'p50_ms': percentile(values, 0.50) * 1000,
+            'p95_ms': percentile(values, 0.95) * 1000,
+            'p99_ms': percentile(values, 0.99) * 1000,
+            'mean_ms': sum(values) / len(values) * 1000,
+            'rcu': capacity[intent_name][0] / len(values),
+            'wcu': float(capacity[intent_name][1]) / len(values),
+            'bytes_written': float(capacity[intent_name][2]) / len(values)
+        }
+
+    return {
+        'intents': intents,
+        'requests': total_requests,
+        'wall_time_s': wall_time,
+        'throughput_rps': total_requests / wall_time if wall_time else 0.0,
+        'http_requests': http_request_counts,
+        'dynamodb_calls': dynamodb_calls,
+        'dynamodb_bytes_written': sum(result['dynamodb_bytes_written'] for result in worker_results),
+        'recipe_page_bytes_read': sum(result['recipe_page_bytes_read'] for result in worker_results),
+        'prefetch': dict((counter, sum(result['prefetch'][counter] for result in worker_results))
+                         for counter in worker_results[0]['prefetch']),
+        'search_cache': dict((counter, sum(result['search_cache'][counter] for result in worker_results))
+                             for counter in worker_results[0]['search_cache']),
+        'peak_rss_kb': max(result['peak_rss_kb'] for result in worker_results),
+        'gc_objects_retained': max(result['gc_objects_retained'] for result in worker_results),
+        'responses': [response for result in worker_results for response in result['responses']]
+    }
+
+
+def compare_responses(baseline, summary):
+    """ Check that two replays of the same sessions got the same responses,
+    and report the first difference. Returns False if any differ.
+    """
+    differences = [(expected, actual) for expected, actual in zip(baseline['responses'], summary['responses'])
+                   if expected != actual]
+    if len(baseline['responses']) != len(summary['responses']):
+        print('responses: {0} vs {1} requests replayed'.format(len(baseline['responses']), len(summary['responses'])))
+        return False
+    print('responses: {0} identical, {1} differ'.format(len(summary['responses']) - len(differences), len(differences)))
+    if differences:
+        expected, actual = differences[0]
+        print('first difference, {0} {1}:'.format(expected[0], expected[1]))
+        print('  expected: ' + expected[2])
+        print('  got:      ' + actual[2])
+    return not differences
+
+
+def print_report(summary, baseline=None):
+    print('{0:<20} {1:>7} {2:>10} {3:>10} {4:>10} {5:>10} {6:>6} {7:>6} {8:>9}'.format(
+        'intent', 'count', 'p50 ms', 'p95 ms', 'p99 ms', 'mean ms', 'RCU', 'WCU', 'B written'))
+    for intent_name in sorted(summary['intents']):
+        stats = summary['intents'][intent_name]
+        line = '{0:<20} {1:>7} {2:>10.2f} {3:>10.2f} {4:>10.2f} {5:>10.2f} {6:>6.2f} {7:>6.2f} {8:>9.0f}'.format(
+            intent_name, stats['count'], stats['p50_ms'], stats['p95_ms'], stats['p99_ms'], stats['mean_ms'],
+            stats.get('rcu', 0.0), stats.get('wcu', 0.0), stats.get('bytes_written', 0.0))
+        if baseline is not None and intent_name in baseline['intents']:
+            baseline_p50 = baseline['intents'][intent_name]['p50_ms']
+            if baseline_p50:
+                line += '  p50 {0:+.1f}% vs baseline'.format((stats['p50_ms'] - baseline_p50) / baseline_p50 * 100)
+        print(line)
+
+    print('')
+    print('requests: {0} in {1:.2f}s ({2:.1f}/s)'.format(summary['requests'], summary['wall_time_s'], summary['throughput_rps']))
+    print('site requests: ' + json.dumps(summary['http_requests'], sort_keys=True))
+    print('dynamodb calls: ' + json.dumps(summary['dynamodb_calls'], sort_keys=True))
+    print('dynamodb bytes written: {0}'.format(summary['dynamodb_bytes_written']))
+    print('recipe page bytes read: {0}'.format(summary.get('recipe_page_bytes_read', 0)))
+    if 'search_cache' in summary:
+        search_cache = summary['search_cache']
+        lookups = search_cache['hits'] + search_cache['misses']
+        print('searches answered from the index: {index_hits}, search cache hits: {hits} ({stale_hits} stale), '
+              'misses: {misses}, hit rate: {hit_rate}'.format(
+                  hit_rate='{0:.1f}%'.format(100.0 * search_cache['hits'] / lookups) if lookups else 'n/a',
+                  **search_cache))
+    if 'prefetch' in summary:
+        print('recipes prefetched: {completed}/{started}, picks served by the prefetch: '
+              '{picks_served_by_prefetch}/{picks}'.format(**summary['prefetch']))
+    print('peak rss per worker: {0} KB, objects retained: {1}'.format(summary['peak_rss_kb'], summary['gc_objects_retained']))
+
+
+def run_benchmark(number_of_sessions, concurrency, number_of_steps, handler_name='lambda_handler', seed=0,
+                  dynamodb_latency=0.0, use_index=True):
+    """ Replay sessions against the fixture server. Searches are answered from
+    a recipe index of the fixture recipes, or from the site without use_index.
+    """
+    import recipe_index
+
+    server = start_fixture_server()
+
+    # Configure the skill before the workers import it
+    os.environ['SKINNYTASTE_BASE_URL'] = server.base_url
+    os.environ['METRICS_SAMPLE_RATE'] = '0'
+    index_file, os.environ['RECIPE_INDEX_PATH'] = tempfile.mkstemp(suffix='.json.gz')
+    os.close(index_file)
+    if use_index:
+        recipe_index.save_index(recipe_index.build_index(fixture_documents(server.base_url)), os.environ['RECIPE_INDEX_PATH'])
+    else:
+        os.remove(os.environ['RECIPE_INDEX_PATH'])
+
+    sessions_per_worker = [number_of_sessions // concurrency + (1 if i < number_of_sessions % concurrency else 0)
+                           for i in range(concurrency)]
+    worker_args = [(worker_id, sessions, number_of_steps, handler_name, seed, dynamodb_latency)
+                   for worker_id, sessions in enumerate(sessions_per_worker) if sessions]
+
+    started_at = time.time()
+    pool = multiprocessing.Pool(len(worker_args))
+    try:
+        worker_results = pool.map(run_worker, worker_args)
+    finally:
+        pool.close()
+        pool.join()
+    wall_time = time.time() - started_at
+
+    server.shutdown()
+    if use_index:
+        os.remove(os.environ['RECIPE_INDEX_PATH'])
+    return summarize(worker_results, server.request_counts, wall_time)
+
+
+# ----------------------- Search log -----------------------------
+
+def zipf_query_log(rng, number_of_queries, exponent=1.1):
+    """ A query log where a few queries are asked for most of the time and
+    many only once or twice, like a real one.
+    """
+    vocabulary = list(QUERIES) + [misheard for misheard, _ in MISHEARD_QUERIES]
+    vocabulary += ['{0} {1}'.format(ingredient, dish.lower()) for ingredient in INGREDIENTS for dish in DISHES]
+    rng.shuffle(vocabulary)
+    weights = [1.0 / rank ** exponent for rank in range(1, len(vocabulary) + 1)]
+    cumulative_weights = []
+    total = 0.0
+    for weight in weights:
+        total += weight
+        cumulative_weights.append(total)
+
+    import bisect
+    return [vocabulary[bisect.bisect_left(cumulative_weights, rng.random() * total)] for _ in range(number_of_queries)]
+
+
+def run_search_log_benchmark(query_log_path=None, number_of_queries=2000, seed=0, use_index=True):
+    """ Replay a query log (one query per line, or a generated Zipf one)
+    through SearchForRecipe in one container, and report latency by how each
+    search was answered: from the index, the search cache, a stale cache
+    entry, or the site. The recipes aren't prefetched, so only the search is
+    timed. Returns the cache hit rate.
+    """
+    import recipe_index
+
+    if query_log_path:
+        with open(query_log_path) as query_log:
+            queries = [line.strip() for line in query_log if line.strip()]
+    else:
+        queries = zipf_query_log(random.Random(seed), number_of_queries)
+
+    server = start_fixture_server()
+    os.environ['SKINNYTASTE_BASE_URL'] = server.base_url
+    os.environ['METRICS_SAMPLE_RATE'] = '0'
+    index_file, os.environ['RECIPE_INDEX_PATH'] = tempfile.mkstemp(suffix='.json.gz')
+    os.close(index_file)
+    if use_index:
+        recipe_index.save_index(recipe_index.build_index(fixture_documents(server.base_url)), os.environ['RECIPE_INDEX_PATH'])
+    else:
+        os.remove(os.environ['RECIPE_INDEX_PATH'])
+    import skinnytaste
+
+    skinnytaste.dynamodb_client = FakeDynamoDB()
+    skinnytaste.PREFETCH_COUNT = 0
+    stats = skinnytaste.search_cache_stats
+    outcomes = [('index', 'index_hits'), ('stale hit', 'stale_hits'), ('cache hit', 'hits'), ('miss', 'misses')]
+    latencies = dict((outcome, []) for outcome, _ in outcomes)
+    session = {
+        'new': True,
+        'sessionId': 'search-log',
+        'application': {'applicationId': 'benchmark'},
+        'user': {'userId': 'search-log'}
+    }
+
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        for query in queries:
+            event = make_event(session, 'IntentRequest', 'SearchForRecipe',
+                               {'RecipeSearchString': {'name': 'RecipeSearchString', 'value': query}})
+            stats_before = dict(stats)
+            started_at = time.time()
+            skinnytaste.lambda_handler(event, None)
+            latency = time.time() - started_at
+            for outcome, counter in outcomes:
+                if stats[counter] > stats_before[counter]:
+                    latencies[outcome].append(latency)
+                    break
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+        server.shutdown()
+        if use_index:
+            os.remove(os.environ['RECIPE_INDEX_PATH'])
+
+    print('{0} searches, {1} distinct queries'.format(len(queries), len(set(queries))))
+    print('{0:<10} {1:>7} {2:>10} {3:>10} {4:>10}'.format('answered', 'count', 'p50 ms', 'p95 ms', 'p99 ms'))
+    all_latencies = []
+    for outcome, _ in outcomes:
+        values = sorted(latencies[outcome])
+        all_latencies.extend(values)
+        print('{0:<10} {1:>7} {2:>10.2f} {3:>10.2f} {4:>10.2f}'.format(
+            outcome, len(values), percentile(values, 0.50) * 1000, percentile(values, 0.95) * 1000,
+            percentile(values, 0.99) * 1000))
+    all_latencies.sort()
+    print('{0:<10} {1:>7} {2:>10.2f} {3:>10.2f} {4:>10.2f}'.format(
+        'all', len(all_latencies), percentile(all_latencies, 0.50) * 1000, percentile(all_latencies, 0.95) * 1000,
+        percentile(all_latencies, 0.99) * 1000))
+    print('search cache hit rate: {0:.1f}%, site searches: {1}'.format(
+        skinnytaste.search_cache_hit_rate() * 100, server.request_counts.get('search', 0)))
+    return skinnytaste.search_cache_hit_rate()
+
+
+# ----------------------- Recipe encoding -----------------------------
+
+def recipe_as_lists(recipe):
+    """ The user item attributes as they were stored before the compact
+    format: one list of strings per field.
+    """
+    return {
+        'RecipeSteps': {'L': [{'S': step_ssml} for step_ssml in recipe.steps_ssml]},
+        'RecipeIngredients': {'L': [{'S': ingredient} for ingredient in recipe.ingredients]}
+    }
+
+
+def time_per_call(function, repeat):
+    started_at = time.time()
+    for _ in range(repeat):
+        function()
+    return (time.time() - started_at) / repeat * 1000000
+
+
+def run_encoding_benchmark(number_of_steps=(4, 8, 16, 32), repeat=5000):
+    """ Compare the stored size and encode/decode time of the compact recipe
+    blob against the old list-of-strings attributes, and against the blob as
+    it was first written, always compressed at zlib level 6.
+    """
+    import zlib
+
+    import recipe_model
+    import skinnytaste
+
+    def level_6_blob(recipe):
+        fields = [recipe.ingredients, recipe.instructions, recipe.steps_ssml, recipe.card_text]
+        return chr(recipe_model.RECIPE_FORMAT_VERSION) + zlib.compress(json.dumps(fields, separators=(',', ':')), 6)
+
+    print('{0:>6} {1:<8} {2:>8} {3:>10} {4:>10}'.format('steps', 'encoding', 'B', 'encode us', 'decode us'))
+    for steps in number_of_steps:
+        recipe = skinnytaste.normalize_recipe_details(skinnytaste.parse_recipe_details(recipe_page(0, steps)))
+        lists_item = recipe_as_lists(recipe)
+        level_6_item = {'Recipe': {'B': level_6_blob(recipe)}, 'NumberOfSteps': {'N': str(len(recipe.steps_ssml))}}
+        blob_item = {'Recipe': {'B': recipe.encode()}, 'NumberOfSteps': {'N': str(len(recipe.steps_ssml))}}
+        assert skinnytaste.decode_user_recipe(level_6_item) == recipe
+
+        encodings = [
+            ('lists', lists_item, lambda: recipe_as_lists(recipe)),
+            ('level 6', level_6_item, lambda: level_6_blob(recipe)),
+            ('blob', blob_item, recipe.encode)
+        ]
+        for encoding, item, encode in encodings:
+            print('{0:>6} {1:<8} {2:>8} {3:>10.1f} {4:>10.1f}'.format(
+                steps, encoding, item_size(item), time_per_call(encode, repeat),
+                time_per_call(lambda: skinnytaste.decode_user_recipe(item), repeat)))
+
+
+# ----------------------- Step latency -----------------------------
+
+def run_step_latency_benchmark(number_of_steps=(12, 50, 200, 900), repeat=200, number_of_requests=300):
+    """ For recipes of growing size, time normalizing the scraped recipe at
+    ingest (per recipe and per step), and NextStep, PreviousStep and
+    RepeatStep requests once it's picked.
+    """
+    server = start_fixture_server()
+    base_url = 'http://{0}:{1}'.format(*server.server_address)
+    os.environ['SKINNYTASTE_BASE_URL'] = base_url
+    os.environ['METRICS_SAMPLE_RATE'] = '0'
+    os.environ['RECIPE_INDEX_PATH'] = ''
+    import skinnytaste
+
+    skinnytaste.dynamodb_client = FakeDynamoDB()
+    skinnytaste.PREFETCH_COUNT = 0
+    navigation_intents = ['NextStep', 'PreviousStep', 'RepeatStep']
+
+    print('{0:>6} {1:>14} {2:>14} {3}'.format(
+        'steps', 'ingest us', 'us per step', ' '.join('{0:>16}'.format(intent + ' us') for intent in navigation_intents)))
+    real_stdout = sys.stdout
+    for steps in number_of_steps:
+        recipe_details = skinnytaste.parse_recipe_details(recipe_page(0, steps))
+        ingest_time = time_per_call(lambda: skinnytaste.normalize_recipe_details(recipe_details), repeat)
+
+        session = {
+            'new': False,
+            'sessionId': 'step-latency',
+            'application': {'applicationId': 'benchmark'},
+            'user': {'userId': 'step-latency-{0}'.format(steps)},
+            'attributes': {'search_results': [[recipe_title(0), '{0}/recipe-0-steps-{1}/'.format(base_url, steps)]]}
+        }
+        sys.stdout = open(os.devnull, 'w')
+        try:
+            response = skinnytaste.lambda_handler(make_event(
+                session, 'IntentRequest', 'PickRecipeNumber',
+                {'RecipeNumber': {'name': 'RecipeNumber', 'value': '1'}}), None)
+            session['attributes'] = response['sessionAttributes']
+
+            # Step back and forth near the start of the recipe, so every Next
+            # and Previous moves and is written
+            navigation_latencies = dict((intent_name, []) for intent_name in navigation_intents)
+            requests = [['NextStep', 'PreviousStep'][request_number % 2] for request_number in range(number_of_requests)]
+            requests += ['RepeatStep'] * (number_of_requests // 2)
+            for intent_name in requests:
+                event = make_event(session, 'IntentRequest', intent_name)
+                started_at = time.time()
+                response = skinnytaste.lambda_handler(event, None)
+                navigation_latencies[intent_name].append(time.time() - started_at)
+                session['attributes'] = response['sessionAttributes']
+                assert 'of {0}:'.format(steps) in response['response']['outputSpeech']['ssml']
+        finally:
+            sys.stdout.close()
+            sys.stdout = real_stdout
+
+        print('{0:>6} {1:>14.1f} {2:>14.2f} {3}'.format(
+            steps, ingest_time, ingest_time / steps,
+            ' '.join('{0:>16.1f}'.format(percentile(sorted(navigation_latencies[intent]), 0.50) * 1000000)
+                     for intent in navigation_intents)))
+
+    server.shutdown()
+
+
+# ----------------------- Step writes -----------------------------
+
+def whole_item_write(user_id, recipe_step, recipe_details):
+    """ The item the skill used to put on every pick and every step: the
+    step, and the whole scraped recipe.
+    """
+    return {
+        'user_id': {'S': user_id},
+        'CurrentStep': {'N': str(recipe_step)},
+        'RecipeInstructions': {'L': [{'S': instruction} for instruction in recipe_details['instructions']]},
+        'RecipeIngredients': {'L': [{'S': ingredient} for ingredient in recipe_details['ingredients']]}
+    }
+
+
+def run_step_write_benchmark(number_of_steps=(8, 16, 32, 64), number_of_requests=20):
+    """ For recipes of growing size, compare the bytes and write capacity units
+    of PickRecipeNumber, NextStep and PreviousStep with the skill's writes,
+    against the whole item put the skill sent for each of them before steps
+    were written with an update of CurrentStep alone.
+    """
+    server = start_fixture_server()
+    base_url = 'http://{0}:{1}'.format(*server.server_address)
+    os.environ['SKINNYTASTE_BASE_URL'] = base_url
+    os.environ['METRICS_SAMPLE_RATE'] = '0'
+    os.environ['RECIPE_INDEX_PATH'] = ''
+    import skinnytaste
+
+    fake_dynamodb = FakeDynamoDB()
+    skinnytaste.dynamodb_client = fake_dynamodb
+    skinnytaste.PREFETCH_COUNT = 0
+
+    print('{0:>6} {1:<16} {2:>10} {3:>10} {4:>11} {5:>11}'.format(
+        'steps', 'intent', 'B before', 'B after', 'WCU before', 'WCU after'))
+    real_stdout = sys.stdout
+    for steps in number_of_steps:
+        session = {
+            'new': False,
+            'sessionId': 'step-writes',
+            'application': {'applicationId': 'benchmark'},
+            'user': {'userId': 'step-writes-{0}'.format(steps)},
+            'attributes': {'search_results': [[recipe_title(0), '{0}/recipe-0-steps-{1}/'.format(base_url, steps)]]}
+        }
+        requests = [('PickRecipeNumber', {'RecipeNumber': {'name': 'RecipeNumber', 'value': '1'}})]
+        requests += [(['NextStep', 'PreviousStep'][request_number % 2], None)
+                     for request_number in range(number_of_requests)]
+
+        # Requests, bytes written and write units of each intent
+        writes = {}
+        sys.stdout = open(os.devnull, 'w')
+        try:
+            for intent_name, slots in requests:
+                before = (fake_dynamodb.bytes_written, fake_dynamodb.write_units)
+                response = skinnytaste.lambda_handler(make_event(session, 'IntentRequest', intent_name, slots), None)
+                session['attributes'] = response['sessionAttributes']
+                intent_writes = writes.setdefault(intent_name, [0, 0, 0])
+                intent_writes[0] += 1
+                intent_writes[1] += fake_dynamodb.bytes_written - before[0]
+                intent_writes[2] += fake_dynamodb.write_units - before[1]
+        finally:
+            sys.stdout.close()
+            sys.stdout = real_stdout
+
+        recipe_details = skinnytaste.parse_recipe_details(recipe_page(0, steps))
+        whole_item_size = item_size(whole_item_write(session['user']['userId'], 1, recipe_details))
+        for intent_name in ['PickRecipeNumber', 'NextStep', 'PreviousStep']:
+            count, bytes_written, write_units = writes[intent_name]
+            print('{0:>6} {1:<16} {2:>10} {3:>10.0f} {4:>11} {5:>11.1f}'.format(
+                steps, intent_name, whole_item_size, float(bytes_written) / count,
+                write_capacity_units(whole_item_size), float(write_units) / count))
+
+    server.shutdown()
+
+
+# ----------------------- Startup -----------------------------
+
+STARTUP_INTENTS = ['LaunchRequest', 'AMAZON.HelpIntent', 'SearchForRecipe', 'SearchByIngredients',
+                   'PickRecipeNumber', 'NextStep', 'ResumeRecipe']
+
+# Run by run_startup_benchmark in a new interpreter for every case, so nothing
+# is imported before skinnytaste. Arguments: the case file (the event, and the
+# DynamoDB tables as the user's earlier requests left them) and the file to
+# write the timings to.
+STARTUP_CASE_SCRIPT = '''
+import sys
+import time
+
+started_at = time.time()
+import skinnytaste
+import_time = time.time() - started_at
+
+import cPickle
+import os
+import benchmark
+
+with open(sys.argv[1], 'rb') as case_file:
+    event, tables = cPickle.load(case_file)
+skinnytaste.dynamodb_client = benchmark.FakeDynamoDB()
+skinnytaste.dynamodb_client.tables = tables
+
+modules_before = set(name for name, module in sys.modules.items() if module is not None)
+timings = {'import_s': import_time}
+for call in ('first_call_s', 'second_call_s'):
+    started_at = time.time()
+    skinnytaste.lambda_handler(event, None)
+    timings[call] = time.time() - started_at
+    if call == 'first_call_s':
+        modules_loaded = [module for name, module in sys.modules.items()
+                          if module is not None and name not in modules_before]
+        timings['modules_loaded'] = len(modules_loaded)
+        # Packages from outside the standard library, and the skill's own modules
+        stdlib_dir = os.path.dirname(os.__file__)
+        timings['packages_loaded'] = sorted(set(
+            module.__name__.split('.')[0] for module in modules_loaded
+            if getattr(module, '__file__', None) and
+            (not module.__file__.startswith(stdlib_dir) or 'site-packages' in module.__file__)))
+
+with open(sys.argv[2], 'wb') as timings_file:
+    cPickle.dump(timings, timings_file)
+'''
+
+
+def startup_cases(base_url):
+    """ The first request of each kind a new container could get, as
+    {intent: (event, DynamoDB tables)}. The tables are as the user's earlier
+    requests in the session left them.
+    """
+    import skinnytaste
+
+    fake_dynamodb = FakeDynamoDB()
+    skinnytaste.dynamodb_client = fake_dynamodb
+    skinnytaste.PREFETCH_COUNT = 0
+    session = {
+        'new': True,
+        'sessionId': 'startup',
+        'application': {'applicationId': 'benchmark'},
+        'user': {'userId': 'startup'},
+        'attributes': {}
+    }
+    script = [
+        ('LaunchRequest', None),
+        ('AMAZON.HelpIntent', None),
+        ('SearchByIngredients', {'IngredientList': {'name': 'IngredientList', 'value': 'shrimp and lime'}}),
+        ('SearchForRecipe', {'RecipeSearchString': {'name': 'RecipeSearchString', 'value': 'chicken'}}),
+        ('PickRecipeNumber', {'RecipeNumber': {'name': 'RecipeNumber', 'value': '1'}}),
+        ('NextStep', None)
+    ]
+
+    cases = {}
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        for intent_name, slots in script:
+            if intent_name == 'LaunchRequest':
+                event = make_event(session, 'LaunchRequest')
+            else:
+                event = make_event(session, 'IntentRequest', intent_name, slots)
+            cases[intent_name] = (copy.deepcopy(event), copy.deepcopy(fake_dynamodb.tables))
+            response = skinnytaste.lambda_handler(event, None)
+            session['new'] = False
+            session['attributes'] = response.get('sessionAttributes', {})
+
+        # Coming back to the recipe in a new session
+        session['new'] = True
+        session['attributes'] = {}
+        cases['ResumeRecipe'] = (make_event(session, 'IntentRequest', 'ResumeRecipe'), copy.deepcopy(fake_dynamodb.tables))
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+    return cases
+
+
+def run_startup_benchmark(repeat=3):
+    """ Time importing skinnytaste and its first and second request in a new
+    interpreter for each kind of first request, with and without
+    WARM_UP_ON_INIT. -X importtime needs Python 3.7, so imports are timed as a
+    whole, and the modules the first request loads are listed instead.
+    """
+    import cPickle
+    import subprocess
+    import recipe_index
+
+    server = start_fixture_server()
+    index_file, index_path = tempfile.mkstemp(suffix='.json.gz')
+    os.close(index_file)
+    recipe_index.save_index(recipe_index.build_index(fixture_documents(server.base_url)), index_path)
+    os.environ['SKINNYTASTE_BASE_URL'] = server.base_url
+    os.environ['METRICS_SAMPLE_RATE'] = '0'
+    os.environ['RECIPE_INDEX_PATH'] = index_path
+    cases = startup_cases(server.base_url)
+
+    case_file, case_path = tempfile.mkstemp(suffix='.pickle')
+    os.close(case_file)
+    timings_file, timings_path = tempfile.mkstemp(suffix='.pickle')
+    os.close(timings_file)
+    environment = dict(os.environ)
+    environment.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+    # boto3 warns about Python 2.7 on import
+    environment['PYTHONWARNINGS'] = 'ignore'
+    devnull = open(os.devnull, 'w')
+    try:
+        for warm_up_on_init in ('0', '1'):
+            environment['WARM_UP_ON_INIT'] = warm_up_on_init
+            print('WARM_UP_ON_INIT={0}'.format(warm_up_on_init))
+            print('{0:<20} {1:>10} {2:>14} {3:>15} {4:>8}  {5}'.format(
+                'first request', 'import ms', 'first call ms', 'second call ms', 'modules',
+                'packages the first call loaded'))
+            for intent_name in STARTUP_INTENTS:
+                with open(case_path, 'wb') as case_output:
+                    cPickle.dump(cases[intent_name], case_output, cPickle.HIGHEST_PROTOCOL)
+
+                runs = []
+                for _ in range(repeat):
+                    subprocess.check_call([sys.executable, '-c', STARTUP_CASE_SCRIPT, case_path, timings_path],
+                                          cwd=os.path.dirname(os.path.abspath(__file__)), env=environment,
+                                          stdout=devnull)
+                    with open(timings_path, 'rb') as timings_input:
+                        runs.append(cPickle.load(timings_input))
+
+                def median(timing):
+                    return sorted(run[timing] for run in runs)[len(runs) // 2] * 1000
+                print('{0:<20} {1:>10.1f} {2:>14.1f} {3:>15.1f} {4:>8}  {5}'.format(
+                    intent_name, median('import_s'), median('first_call_s'), median('second_call_s'),
+                    runs[0]['modules_loaded'], ', '.join(runs[0]['packages_loaded']) or '-'))
+            print('')
+    finally:
+        devnull.close()
+        server.shutdown()
+        for path in (index_path, case_path, timings_path):
+            os.remove(path)
+
+
+# ----------------------- Metrics overhead -----------------------------
+
+class untimed(object):
+    """ Stand-in for skinnytaste.timed that records nothing. """
+    __slots__ = ('phase',)
+
+    def __init__(self, phase):
+        self.phase = phase
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+def run_metrics_overhead_benchmark(repeat=20000, number_of_requests=100, rounds=40):
+    """ Time the instrumentation hooks on their own, then RepeatStep
+    requests with the hooks replaced by no-ops, with metrics collected but not
+    sampled, and with every record emitted.
+    """
+    server = start_fixture_server()
+    base_url = 'http://{0}:{1}'.format(*server.server_address)
+    os.environ['SKINNYTASTE_BASE_URL'] = base_url
+    os.environ['METRICS_SAMPLE_RATE'] = '0'
+    os.environ['RECIPE_INDEX_PATH'] = ''
+    import skinnytaste
+
+    skinnytaste.dynamodb_client = FakeDynamoDB()
+    skinnytaste.PREFETCH_COUNT = 0
+    hooks = (skinnytaste.timed, skinnytaste.start_invocation_metrics, skinnytaste.emit_invocation_metrics)
+    session = {
+        'new': False,
+        'sessionId': 'metrics-overhead',
+        'application': {'applicationId': 'benchmark'},
+        'user': {'userId': 'metrics-overhead'},
+        'attributes': {}
+    }
+
+    def ask(intent_name, slots=None):
+        response = skinnytaste.lambda_handler(make_event(session, 'IntentRequest', intent_name, slots), None)
+        session['attributes'] = response.get('sessionAttributes', {})
+        return response
+
+    ask('SearchForRecipe', {'RecipeSearchString': {'name': 'RecipeSearchString', 'value': 'chicken'}})
+    ask('PickRecipeNumber', {'RecipeNumber': {'name': 'RecipeNumber', 'value': '1'}})
+    repeat_step_event = make_event(session, 'IntentRequest', 'RepeatStep')
+    response = ask('RepeatStep')
+
+    def timed_block():
+        with skinnytaste.timed('Benchmark'):
+            pass
+
+    def invocation_hooks():
+        skinnytaste.start_invocation_metrics()
+        skinnytaste.emit_invocation_metrics(repeat_step_event, response)
+
+    def repeat_step():
+        skinnytaste.lambda_handler(repeat_step_event, None)
+
+    real_stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        hook_times = {'timed block': time_per_call(timed_block, repeat)}
+        for sample_rate in (0.0, 1.0):
+            skinnytaste.METRICS_SAMPLE_RATE = sample_rate
+            hook_times['start + emit, sample rate {0:g}'.format(sample_rate)] = time_per_call(invocation_hooks, repeat)
+
+        # Interleave the variants over several rounds and keep each one's best
+        # round, so drift in the machine's speed doesn't favour one of them
+        variants = [('hooks as no-ops', None), ('sample rate 0', 0.0), ('sample rate 1', 1.0)]
+        request_times = {}
+        for _ in range(rounds):
+            for variant, sample_rate in variants:
+                if sample_rate is None:
+                    skinnytaste.timed = untimed
+                    skinnytaste.start_invocation_metrics = lambda: None
+                    skinnytaste.emit_invocation_metrics = lambda event, response, failed=False: None
+                else:
+                    skinnytaste.timed, skinnytaste.start_invocation_metrics, skinnytaste.emit_invocation_metrics = hooks
+                    skinnytaste.METRICS_SAMPLE_RATE = sample_rate
+                request_time = time_per_call(repeat_step, number_of_requests)
+                request_times[variant] = min(request_times.get(variant, request_time), request_time)
+    finally:
+        sys.stdout.close()
+        sys.stdout = real_stdout
+        skinnytaste.timed, skinnytaste.start_invocation_metrics, skinnytaste.emit_invocation_metrics = hooks
+        server.shutdown()
+
+    for hook, microseconds in sorted(hook_times.items()):
+        print('{0:<34} {1:8.2f} us'.format(hook, microseconds))
+    baseline_time = request_times['hooks as no-ops']
+    for variant, _ in variants:
+        print('RepeatStep, {0:<22} {1:8.2f} us  {2:+.1f}%'.format(
+            variant, request_times[variant], (request_times[variant] / baseline_time - 1) * 100))
+
+
+# ----------------------- Parser backends -----------------------------
+
+def parse_fixture_corpus(backend_name, number_of_recipes, number_of_searches):
+    """ Parse the fixture recipe and search pages with one parser backend.
+    Runs in a fresh worker process, so its peak memory is the backend's own.
+    Returns a digest of what was read from each page, the wall time, and the
+    peak RSS before and after parsing.
+    """
+    os.environ['METRICS_SAMPLE_RATE'] = '0'
+    os.environ['RECIPE_INDEX_PATH'] = ''
+    import skinnytaste
+
+    backend = skinnytaste.resolve_parser_backend(backend_name)
+    skinnytaste.html_parser_backend = backend
+    recipe_pages = [recipe_page(recipe_id) for recipe_id in range(number_of_recipes)]
+    search_pages = [search_page('http://fixture-server', 'query {0}'.format(query_number))
+                    for query_number in range(number_of_searches)]
+    rss_before_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    started_at = time.time()
+    results = [skinnytaste.parse_recipe_details(page) for page in recipe_pages]
+    results.extend(skinnytaste.parse_search_results(page) for page in search_pages)
+    wall_time = time.time() - started_at
+    results[number_of_recipes:] = [[[search_result.title, search_result.url] for search_result in search_results]
+                                   for search_results in results[number_of_recipes:]]
+
+    return {
+        'tree_builder': backend[0],
+        'digests': [hashlib.md5(json.dumps(result, sort_keys=True)).hexdigest() for result in results],
+        'wall_time_s': wall_time,
+        'rss_before_kb': rss_before_kb,
+        'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    }
+
+
+def run_parser_backend_benchmark(number_of_recipes=100, number_of_searches=50):
+    """ Parse the fixture corpus with every HTML_PARSER_BACKENDS backend,
+    each in its own process. Check each reads the same as html.parser, and
+    report wall time and peak RSS. Returns whether all of them agreed.
+    """
+    backend_names = ['html.parser', 'lxml', 'strainer', 'lxml-strainer', 'lxml-xpath']
+    results = {}
+    for backend_name in backend_names:
+        pool = multiprocessing.Pool(1)
+        try:
+            results[backend_name] = pool.apply(parse_fixture_corpus, (backend_name, number_of_recipes, number_of_searches))
+        finally:
+            pool.close()
+            pool.join()
+
+    expected_digests = results['html.parser']['digests']
+    number_of_pages = len(expected_digests)
+    all_agree = True
+    print('{0:<14} {1:>10} {2:>12} {3:>14} {4:>14}  {5}'.format(
+        'backend', 'wall s', 'ms per page', 'peak RSS KB', 'RSS growth KB', 'same as html.parser'))
+    for backend_name in backend_names:
+        result = results[backend_name]
+        differing_pages = [page_number for page_number in range(number_of_pages)
+                           if result['digests'][page_number] != expected_digests[page_number]]
+        all_agree = all_agree and not differing_pages
+        if differing_pages:
+            agreement = '{0} of {1} pages differ, first page {2}'.format(len(differing_pages), number_of_pages,
+                                                                         differing_pages[0])
+        else:
+            agreement = 'yes'
+        if backend_name.startswith('lxml') and not result['tree_builder'].startswith('lxml'):
+            agreement += ' (lxml not installed, ran html.parser)'
+        print('{0:<14} {1:>10.2f} {2:>12.2f} {3:>14} {4:>14}  {5}'.format(
+            backend_name, result['wall_time_s'], result['wall_time_s'] / number_of_pages * 1000,
+            result['peak_rss_kb'], result['peak_rss_kb'] - result['rss_before_kb'], agreement))
+    return all_agree
+
+
+# ----------------------- Page streaming -----------------------------
+
+def run_streaming_benchmark(number_of_recipes=200):
+    """ Fetch the fixture recipes as whole pages and streamed, check both give
+    the same recipes, and compare the bytes read and time taken.
+    """
+    server = start_fixture_server()
+    base_url = 'http://{0}:{1}'.format(*server.server_address)
+    os.environ['METRICS_SAMPLE_RATE'] = '0'
+    import skinnytaste
+
+    recipes = {}
+    for streaming in (False, True):
+        skinnytaste.STREAM_RECIPE_PAGES = streaming
+        bytes_read_before = skinnytaste.recipe_page_stats['bytes_read']
+        started_at = time.time()
+        recipes[streaming] = [
+            skinnytaste.fetch_recipe_entry('{0}/recipe-{1}/'.format(base_url, recipe_id))['value']
+            for recipe_id in range(number_of_recipes)
+        ]
+        elapsed = time.time() - started_at
+        print('{mode:<8} {bytes_read:>10} bytes read, {ms:.2f} ms per recipe'.format(
+            mode='streamed' if streaming else 'whole',
+            bytes_read=skinnytaste.recipe_page_stats['bytes_read'] - bytes_read_before,
+            ms=elapsed / number_of_recipes * 1000))
+
+    server.shutdown()
+    mismatches = [recipe_id for recipe_id in range(number_of_recipes) if recipes[False][recipe_id] != recipes[True][recipe_id]]
+    print('pages cut short: {0}, recipes that differ: {1}'.format(skinnytaste.recipe_page_stats['cut_short'], mismatches or 'none'))
+    return not mismatches
+
+
+# ----------------------- Fault injection -----------------------------
+
+def run_fault_injection(number_of_recipes=6):
+    """ Check the degraded mode against the fixture server with faults
+    injected. Returns whether every check passed.
+    """
+    server = start_fixture_server()
+    base_url = 'http://{0}:{1}'.format(*server.server_address)
+    os.environ['SKINNYTASTE_BASE_URL'] = base_url
+    os.environ['METRICS_SAMPLE_RATE'] = '0'
+    os.environ['RECIPE_INDEX_PATH'] = ''
+    import skinnytaste
+
+    skinnytaste.dynamodb_client = FakeDynamoDB()
+    skinnytaste.STALE_FALLBACK_DEADLINE = 0.5
+    degraded_stats = skinnytaste.degraded_stats
+    results = []
+
+    def check(description, passed):
+        print('{0:<60} {1}'.format(description, 'ok' if passed else 'FAILED'))
+        results.append(passed)
+
+    def recipe_url(recipe_id):
+        return '{0}/recipe-{1}/'.format(base_url, recipe_id)
+
+    def expire_cached_recipes():
+        for entry in skinnytaste.recipe_cache.values():
+            entry['fresh_until'] = 0
+
+    def reset_circuit_breaker():
+        skinnytaste.record_fetch_result(True)
+
+    def answered_with(response, speech):
+        return speech in response['response']['outputSpeech']['ssml']
+
+    urls = [recipe_url(recipe_id) for recipe_id in range(number_of_recipes)]
+    healthy_recipes = [skinnytaste.get_recipe_details('', url) for url in urls]
+
+    # Slow site: stale copies are served at the deadline, and the refreshes
+    # that carry on in the background repair the cache.
+    expire_cached_recipes()
+    server.fault = 'slow'
+    stale_before = degraded_stats['stale_recipes_served']
+    started_at = time.time()
+    served_recipes = [skinnytaste.get_recipe_details('', url) for url in urls]
+    seconds_per_recipe = (time.time() - started_at) / len(urls)
+    check('slow site: stale recipes served',
+          served_recipes == healthy_recipes and degraded_stats['stale_recipes_served'] - stale_before == len(urls))
+    check('slow site: answered at the deadline ({0:.2f}s per recipe)'.format(seconds_per_recipe),
+          seconds_per_recipe < skinnytaste.STALE_FALLBACK_DEADLINE + 0.25)
+    server.fault = None
+    time.sleep(FAULT_DELAY + 1)
+    check('slow site: cache repaired in the background',
+          all(entry['fresh_until'] > time.time() for entry in skinnytaste.recipe_cache.values()))
+
+    # Site down: stale copies are served, and requests with nothing cached
+    # get an apology instead of an error.
+    expire_cached_recipes()
+    server.fault = 'error'
+    served_recipes = [skinnytaste.get_recipe_details('', url) for url in urls]
+    check('site down: stale recipes served', served_recipes == healthy_recipes)
+
+    session = {
+        'new': False,
+        'sessionId': 'fault-injection',
+        'application': {'applicationId': 'benchmark'},
+        'user': {'userId': 'fault-injection'},
+        'attributes': {'search_results': [['Uncached recipe', recipe_url(100)]]}
+    }
+    response = skinnytaste.lambda_handler(make_event(session, 'IntentRequest', 'SearchForRecipe', {
+        'RecipeSearchString': {'name': 'RecipeSearchString', 'value': 'never searched before'}}), None)
+    check('site down: uncached search answered with an apology',
+          answered_with(response, skinnytaste.ORIGIN_UNAVAILABLE_SPEECH))
+    response = skinnytaste.lambda_handler(make_event(session, 'IntentRequest', 'PickRecipeNumber', {
+        'RecipeNumber': {'name': 'RecipeNumber', 'value': '1'}}), None)
+    check('site down: uncached recipe answered with an apology',
+          answered_with(response, skinnytaste.RECIPE_UNAVAILABLE_SPEECH))
+
+    # Layout change: recipes are read from the JSON-LD instead, or the pick
+    # is answered with an apology when there's none.
+    wait_for_background_threads(server)
+    server.fault = 'layout'
+    reset_circuit_breaker()
+    alternate_parses_before = degraded_stats['alternate_parses']
+    for recipe_id in (200, 201):
+        expected_recipe = skinnytaste.normalize_recipe_details(skinnytaste.parse_recipe_details(recipe_page(recipe_id)))
+        check('layout change: recipe {0} read from JSON-LD'.format(recipe_id),
+              skinnytaste.get_recipe_details('', recipe_url(recipe_id)) == expected_recipe)
+    check('layout change: alternate parses counted', degraded_stats['alternate_parses'] - alternate_parses_before == 2)
+
+    server.fault = 'broken'
+    response = skinnytaste.lambda_handler(make_event(session, 'IntentRequest', 'PickRecipeNumber', {
+        'RecipeNumber': {'name': 'RecipeNumber', 'value': '1'}}), None)
+    check('unreadable page: recipe answered with an apology',
+          answered_with(response, skinnytaste.RECIPE_UNAVAILABLE_SPEECH))
+
+    server.fault = None
+    wait_for_background_threads(server)
+    server.shutdown()
+    return all(results)
+
+
+# ----------------------- Progress migration -----------------------------
+
+def run_migration_check():
+    """ Check that users whose items have one of the old shapes keep their
+    place, and are moved to the new layout on their next step; and that the
+    recent recipes History works. Returns whether every check passed.
+    """
+    server = start_fixture_server()
+    base_url = 'http://{0}:{1}'.format(*server.server_address)
+    os.environ['SKINNYTASTE_BASE_URL'] = base_url
+    os.environ['METRICS_SAMPLE_RATE'] = '0'
+    os.environ['RECIPE_INDEX_PATH'] = ''
+    import skinnytaste
+
+    fake_dynamodb = FakeDynamoDB()
+    skinnytaste.dynamodb_client = fake_dynamodb
+    progress_table = fake_dynamodb.table(skinnytaste.PROGRESS_TABLE_NAME)
+    results = []
+
+    def check(description, passed):
+        print('{0:<60} {1}'.format(description, 'ok' if passed else 'FAILED'))
+        results.append(passed)
+
+    def ask(user_id, intent_name, slots=None, attributes=None):
+        session = {
+            'new': False,
+            'sessionId': 'migration-' + user_id,
+            'application': {'applicationId': 'benchmark'},
+            'user': {'userId': user_id},
+            'attributes': attributes or {}
+        }
+        response = skinnytaste.lambda_handler(make_event(session, 'IntentRequest', intent_name, slots), None)
+        return response['response']['outputSpeech']['ssml']
+
+    def progress_of(user_id):
+        return progress_table[FakeDynamoDB.key_of({'user_id': {'S': user_id}})]
+
+    recipe = skinnytaste.normalize_recipe_details(skinnytaste.parse_recipe_details(recipe_page(0)))
+    legacy_items = {
+        'compact': {
+            'Recipe': {'B': recipe.encode()},
+            'NumberOfSteps': {'N': str(len(recipe.steps_ssml))}
+        },
+        'rendered steps': {
+            'RecipeSteps': {'L': [{'S': step_ssml} for step_ssml in recipe.steps_ssml]},
+            'RecipeIngredients': {'L': [{'S': ingredient} for ingredient in recipe.ingredients]}
+        },
+        'raw instructions': {
+            'RecipeInstructions': {'L': [{'S': instruction} for instruction in recipe.instructions]},
+            'RecipeIngredients': {'L': [{'S': ingredient} for ingredient in recipe.ingredients]}
+        }
+    }
+    for shape, legacy_item in sorted(legacy_items.items()):
+        user_id = 'legacy ' + shape
+        legacy_item = dict(legacy_item, user_id={'S': user_id}, CurrentStep={'N': '3'})
+        progress_table[FakeDynamoDB.key_of({'user_id': {'S': user_id}})] = legacy_item
+
+        check('{0} item: repeat reads step 3'.format(shape), recipe.steps_ssml[2] in ask(user_id, 'RepeatStep'))
+        check('{0} item: next reads step 4'.format(shape), recipe.steps_ssml[3] in ask(user_id, 'NextStep'))
+        progress = progress_of(user_id)
+        check('{0} item: moved to the new layout'.format(shape),
+              'RecipeKey' in progress and 'Recipe' not in progress and 'RecipeSteps' not in progress
+              and progress['CurrentStep']['N'] == '4')
+        check('{0} item: next reads step 5 after moving'.format(shape), recipe.steps_ssml[4] in ask(user_id, 'NextStep'))
+
+    check('no recipe yet: asked to search first', 'picked a recipe yet' in ask('new user', 'NextStep'))
+
+    # Pick two recipes, then go back to the first where it was left
+    first_url, second_url = base_url + '/recipe-10/', base_url + '/recipe-11/'
+    first_recipe = skinnytaste.get_recipe_details('First', first_url)
+    search_results = {'search_results': [['First', first_url], ['Second', second_url]]}
+    pick = {'RecipeNumber': {'name': 'RecipeNumber', 'value': '1'}}
+    ask('cook', 'PickRecipeNumber', pick, search_results)
+    ask('cook', 'NextStep')
+    ask('cook', 'NextStep')
+    pick['RecipeNumber']['value'] = '2'
+    ask('cook', 'PickRecipeNumber', pick, search_results)
+    speech = ask('cook', 'ResumePreviousRecipe')
+    check('history: back to the first recipe at step 3',
+          'Going back to First at step 3' in speech and first_recipe.steps_ssml[2] in speech)
+    history = progress_of('cook')['History']['L']
+    check('history: second recipe kept in the history',
+          len(history) == 1 and history[0]['M']['RecipeTitle']['S'] == 'Second')
+    pick['RecipeNumber']['value'] = '1'
+    ask('other cook', 'PickRecipeNumber', pick, search_results)
+    stored_urls = [item['Url']['S'] for item in fake_dynamodb.table(skinnytaste.RECIPES_TABLE_NAME).values()
+                   if not item['recipe_key']['S'].startswith('legacy-')]
+    check('recipes stored once per URL', sorted(stored_urls) == [first_url, second_url])
+
+    server.shutdown()
+    return all(results)
+
+
+# ----------------------- Query rewriting -----------------------------
+
+# Misheard and differently-worded queries, and what they should be searched as
+MISHEARD_QUERIES = [
+    ('brocoli', 'broccoli'),
+    ('brockly', 'broccoli'),
+    ('turkey chilly', 'turkey chili'),
+    ('zoodles', 'zucchini noodles'),
+    ('zuchini', 'zucchini'),
+    ('chiken stir fry', 'chicken stir fry'),
+    ('sweet potatoe', 'sweet potato'),
+    ('quinoa sallad', 'quinoa salad'),
+    ('keen wah salad', 'quinoa salad'),
+    ('califlower', 'cauliflower'),
+    ('cauliflour soup', 'cauliflower soup'),
+    ('salmen', 'salmon'),
+    ('spinnach', 'spinach'),
+    ('mushroms skillet', 'mushrooms skillet'),
+    ('enchilladas', 'enchiladas'),
+    ('frittatta', 'frittata'),
+    ('chicken casserol', 'chicken casserole'),
+    ('brown rise', 'brown rice'),
+    ('black beens soup', 'black beans soup'),
+    ('parmesean chicken', 'parmesan chicken'),
+    ('crock pot chili', 'slow cooker chili'),
+    ('prawn tacos', 'shrimp tacos'),
+    ('courgette frittata', 'zucchini frittata'),
+    ('shrimp burito bowls', 'shrimp burrito bowls'),
+    ('garlick shrimp', 'garlic shrimp'),
+    ('cilantro lyme chicken', 'cilantro lime chicken')
+]
+
+SOUND_ALIKE_LETTERS = {'c': 'k', 'k': 'c', 's': 'c', 'i': 'y', 'y': 'i', 'f': 'ph', 'z': 's', 'e': 'a', 'a': 'e'}
+
+
+def mishear(rng, word):
+    """ One plausible transcription error in a word. """
+    position = rng.randrange(1, len(word) - 1)
+    kind = rng.choice(['delete', 'double', 'swap', 'sound'])
+    if kind == 'delete':
+        return word[:position] + word[position + 1:]
+    if kind == 'double':
+        return word[:position] + word[position] + word[position:]
+    if kind == 'swap':
+        return word[:position] + word[position + 1] + word[position] + word[position + 2:]
+    for position in range(1, len(word)):
+        if word[position] in SOUND_ALIKE_LETTERS:
+            return word[:position] + SOUND_ALIKE_LETTERS[word[position]] + word[position + 1:]
+    return word[:position] + word[position + 1:]
+
+
+def filler_vocabulary(rng, size):
+    """ Made-up words standing in for the rest of a real site's vocabulary. """
+    consonants = 'bcdfghklmnprstvz'
+    vowels = 'aeiou'
+    words = set()
+    while len(words) < size:
+        syllables = rng.randint(2, 4)
+        words.add(''.join(rng.choice(consonants) + rng.choice(vowels) for _ in range(syllables)) + rng.choice(['', 's', 'n', 'r']))
+    return words
+
+
+def run_query_rewriting_benchmark(vocabulary_size=30000, seed=0, repeat=20):
+    """ Report how many misheard queries are rewritten to the intended query,
+    how many correct queries are changed, and how long rewriting takes with a
+    vocabulary of about vocabulary_size words. Also compares getting the
+    spelling index ready on the first search from an index file saved with
+    it, and from one saved without it.
+    """
+    import query_rewrite
+    import recipe_index
+
+    rng = random.Random(seed)
+    index = recipe_index.build_index(fixture_documents())
+    site_words = sorted(set(index['surface_forms'].values()))
+
+    # Filler words appear in one recipe each, so they're rarer than the real ones
+    for word in filler_vocabulary(rng, max(0, vocabulary_size - len(index['postings']))):
+        term = recipe_index.index_term(word)
+        if term is not None and term not in index['postings']:
+            index['postings'][term] = [0, 1]
+            index['surface_forms'][term] = word
+
+    started_at = time.time()
+    index['spelling'] = query_rewrite.pack_spelling_index(
+        query_rewrite.build_spelling_index(query_rewrite.vocabulary_frequencies(index)))
+    build_time = time.time() - started_at
+
+    # What the first search of a container does, with and without the
+    # spelling index in the file
+    first_search_times = {}
+    for saved_spelling in (True, False):
+        saved_index = index if saved_spelling else dict((key, value) for key, value in index.items() if key != 'spelling')
+        index_file, index_path = tempfile.mkstemp(suffix='.json.gz')
+        os.close(index_file)
+        try:
+            recipe_index.save_index(saved_index, index_path)
+            index_size = os.path.getsize(index_path)
+            started_at = time.time()
+            spelling_index = query_rewrite.spelling_index_from_recipe_index(recipe_index.load_index(index_path))
+            first_search_times[saved_spelling] = (time.time() - started_at, index_size)
+        finally:
+            os.remove(index_path)
+
+    generated_queries = []
+    for word in site_words:
+        if len(word) >= 6:
+            generated_queries.append((mishear(rng, word), word))
+
+    def accuracy(queries):
+        correct = 0
+        for query, expected in queries:
+            rewritten_terms = recipe_index.tokenize(query_rewrite.rewrite_query(spelling_index, query))
+            if rewritten_terms == recipe_index.tokenize(expected):
+                correct += 1
+        return correct, len(queries)
+
+    def known_before_rewriting(queries):
+        return sum(1 for query, _ in queries
+                   if all(term in index['postings'] for term in recipe_index.tokenize(query)))
+
+    unchanged_queries = [(query.lower(), query.lower()) for query in QUERIES]
+
+    latencies = []
+    all_queries = MISHEARD_QUERIES + generated_queries + unchanged_queries
+    for _ in range(repeat):
+        for query, _ in all_queries:
+            started_at = time.time()
+            query_rewrite.rewrite_query(spelling_index, query)
+            latencies.append(time.time() - started_at)
+    latencies.sort()
+
+    print('vocabulary: {0} words, spelling index built in {1:.2f}s ({2} delete keys)'.format(
+        len(spelling_index['words']), build_time, len(spelling_index['deletes'])))
+    for saved_spelling in (True, False):
+        print('index file {0:<25} {1:>9} bytes, loaded and spelling index ready in {2:.2f}s'.format(
+            'with the spelling index:' if saved_spelling else 'without it:',
+            first_search_times[saved_spelling][1], first_search_times[saved_spelling][0]))
+    for description, queries in [('misheard queries', MISHEARD_QUERIES),
+                                 ('generated mishearings', generated_queries),
+                                 ('correct queries left alone', unchanged_queries)]:
+        correct, total = accuracy(queries)
+        print('{0:<28} {1:>3}/{2:<3} rewritten right, {3:>3} matched the index without rewriting'.format(
+            description, correct, total, known_before_rewriting(queries)))
+    print('rewrite latency: p50 {0:.3f} ms, p99 {1:.3f} ms, max {2:.3f} ms'.format(
+        percentile(latencies, 0.50) * 1000, percentile(latencies, 0.99) * 1000, latencies[-1] * 1000))
+
+
+def synthetic_catalog(rng, number_of_recipes, ingredient_pool):
+    """ Recipes of 6 to 14 ingredients each, with a few ingredients (the
+    start of ingredient_pool) in most recipes and the rest rare, as on the site.
+    """
+    documents = []
+    for recipe_id in range(number_of_recipes):
+        ingredients = set()
+        for _ in range(rng.randint(6, 14)):
+            ingredients.add(ingredient_pool[int(len(ingredient_pool) * rng.random() ** 3)])
+        documents.append({
+            'title': 'Recipe {0}'.format(recipe_id),
+            'url': '/recipe-{0}/'.format(recipe_id),
+            'lastmod': None,
+            'ingredients': ['1 cup ' + ingredient for ingredient in sorted(ingredients)]
+        })
+    return documents
+
+
+def scan_by_ingredients(index, document_terms, ingredients_text, max_results=10):
+    """ What recipe_index.search_by_ingredients does, by checking every recipe. """
+    import recipe_index
+
+    terms = set(term for term in recipe_index.tokenize(ingredients_text)
+                if term not in recipe_index.INGREDIENT_QUERY_STOPWORDS)
+    documents = index['documents']
+    matches = []
+    for doc_id, doc_terms in enumerate(document_terms):
+        matched = len(terms & doc_terms)
+        if matched:
+            matches.append((-matched, len(documents[doc_id]['ingredients']), doc_id))
+    matches.sort()
+    return [documents[doc_id]['url'] for _, _, doc_id in matches[:max_results]]
+
+
+def run_ingredient_search_benchmark(catalog_sizes=(1000, 10000, 50000), seed=0, number_of_queries=200):
+    """ Compare ingredient searches on the index's bitsets with scanning every
+    recipe, over catalogs of each size. Returns False if they ever disagree.
+    """
+    import recipe_index
+
+    rng = random.Random(seed)
+    ingredient_pool = sorted(filler_vocabulary(rng, 3000))
+    rng.shuffle(ingredient_pool)
+
+    all_agree = True
+    print('{0:>8} {1:>9} {2:>12} {3:>22} {4:>22}'.format(
+        'recipes', 'build s', 'bitsets ms', 'bitset p50/p99 ms', 'scan p50/p99 ms'))
+    for catalog_size in catalog_sizes:
+        documents = synthetic_catalog(rng, catalog_size, ingredient_pool)
+        started_at = time.time()
+        index = recipe_index.build_index(documents)
+        build_time = time.time() - started_at
+
+        queries = []
+        for _ in range(number_of_queries):
+            ingredients = [ingredient_pool[int(len(ingredient_pool) * rng.random() ** 3)]
+                           for _ in range(rng.randint(1, 5))]
+            queries.append('some ' + ', '.join(ingredients[:-1]) + (' and ' if len(ingredients) > 1 else '') + ingredients[-1])
+
+        # Bitsets are built on a term's first use; time that separately
+        started_at = time.time()
+        for query in queries:
+            recipe_index.search_by_ingredients(index, query)
+        bitset_build_time = time.time() - started_at
+
+        document_terms = [set(term for ingredient in document['ingredients'] for term in recipe_index.tokenize(ingredient))
+                          for document in documents]
+        bitset_latencies = []
+        scan_latencies = []
+        for query in queries:
+            started_at = time.time()
+            recipe_results = recipe_index.search_by_ingredients(index, query)
+            bitset_latencies.append(time.time() - started_at)
+
+            started_at = time.time()
+            scanned_urls = scan_by_ingredients(index, document_terms, query)
+            scan_latencies.append(time.time() - started_at)
+
+            if [recipe_result.url for recipe_result in recipe_results] != scanned_urls:
+                print('Results differ for "{0}"'.format(query))
+                all_agree = False
+        bitset_latencies.sort()
+        scan_latencies.sort()
+
+        print('{0:>8} {1:>9.2f} {2:>12.1f} {3:>22} {4:>22}'.format(
+            catalog_size, build_time, bitset_build_time * 1000,
+            '{0:.3f} / {1:.3f}'.format(percentile(bitset_latencies, 0.50) * 1000, percentile(bitset_latencies, 0.99) * 1000),
+            '{0:.3f} / {1:.3f}'.format(percentile(scan_latencies, 0.50) * 1000, percentile(scan_latencies, 0.99) * 1000)))
+
+    print('bitset and scan results {0}'.format('agree' if all_agree else 'DIFFER'))
+    return all_agree
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Replay Alexa sessions through lambda_handler against local stand-ins.')
+    parser.add_argument('--sessions', type=int, default=100)
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--steps', type=int, default=8, help='Next/previous/repeat requests per session')
+    parser.add_argument('--handler', default='lambda_handler', help='Entry point in skinnytaste to drive')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--dynamodb-latency', type=float, default=0.0, help='Milliseconds added to each DynamoDB call')
+    parser.add_argument('--no-index', action='store_true',
+                        help='Replay without a recipe index, so every search goes to the site')
+    parser.add_argument('--json-output', help='Write the results to this file, e.g. to use as a baseline')
+    parser.add_argument('--baseline', help='Compare against results written earlier with --json-output')
+    parser.add_argument('--compare-handler', help='Also run this entry point first and compare latency and responses '
+                                                  'against it, e.g. --handler overlapped_lambda_handler '
+                                                  '--compare-handler lambda_handler')
+    parser.add_argument('--search-log', nargs='?', const='', metavar='QUERY_LOG',
+                        help='Only replay a search query log (one query per line) through SearchForRecipe and '
+                             'report latency and the search cache hit rate; without a file, a generated log '
+                             'where query popularity follows a Zipf distribution')
+    parser.add_argument('--startup', action='store_true',
+                        help='Only time the import and first request of each kind in a new interpreter')
+    parser.add_argument('--step-latency', action='store_true',
+                        help='Only time recipe normalization and step navigation for recipes of growing size')
+    parser.add_argument('--step-writes', action='store_true',
+                        help='Only compare the bytes and WCU written per pick and step with the old whole item puts')
+    parser.add_argument('--metrics-overhead', action='store_true',
+                        help='Only time the metrics hooks, alone and as part of RepeatStep requests')
+    parser.add_argument('--recipe-encoding', action='store_true',
+                        help='Only compare the stored size and speed of the recipe encodings')
+    parser.add_argument('--parser-backends', action='store_true',
+                        help='Only compare the HTML parser backends on the fixture pages')
+    parser.add_argument('--page-streaming', action='store_true',
+                        help='Only check streamed recipe pages against whole ones and compare bytes read')
+    parser.add_argument('--fault-injection', action='store_true',
+                        help='Only check the degraded mode against the fixture server with faults injected')
+    parser.add_argument('--query-rewriting', action='store_true',
+                        help='Only report the accuracy and latency of search query rewriting')
+    parser.add_argument('--vocabulary-size', type=int, default=30000,
+                        help='Words in the vocabulary for --query-rewriting')
+    parser.add_argument('--ingredient-search', action='store_true',
+                        help='Only compare ingredient search on the index with scanning every recipe')
+    parser.add_argument('--catalog-sizes', default='1000,10000,50000',
+                        help='Comma-separated numbers of recipes for --ingredient-search')
+    parser.add_argument('--migration', action='store_true',
+                        help='Only check that users are moved from the old item shapes to the new layout')
+    args = parser.parse_args()
+
+    if args.ingredient_search:
+        catalog_sizes = [int(catalog_size) for catalog_size in args.catalog_sizes.split(',')]
+        sys.exit(0 if run_ingredient_search_benchmark(catalog_sizes, args.seed) else 1)
+    if args.migration:
+        sys.exit(0 if run_migration_check() else 1)
+    if args.query_rewriting:
+        run_query_rewriting_benchmark(args.vocabulary_size, args.seed)
+        sys.exit(0)
+    if args.fault_injection:
+        sys.exit(0 if run_fault_injection() else 1)
+    if args.page_streaming:
+        sys.exit(0 if run_streaming_benchmark() else 1)
+    if args.parser_backends:
+        sys.exit(0 if run_parser_backend_benchmark() else 1)
+    if args.recipe_encoding:
+        run_encoding_benchmark()
+        sys.exit(0)
+    if args.metrics_overhead:
+        run_metrics_overhead_benchmark()
+        sys.exit(0)
+    if args.step_latency:
+        run_step_latency_benchmark()
+        sys.exit(0)
+    if args.step_writes:
+        run_step_write_benchmark()
+        sys.exit(0)
+    if args.startup:
+        run_startup_benchmark()
+        sys.exit(0)
+    if args.search_log is not None:
+        run_search_log_benchmark(args.search_log or None, seed=args.seed, use_index=not args.no_index)
+        sys.exit(0)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+    elif args.compare_handler:
+        baseline = run_benchmark(args.sessions, args.concurrency, args.steps, args.compare_handler, args.seed,
+                                 args.dynamodb_latency / 1000.0, not args.no_index)
+        print(args.compare_handler + ':')
+        print_report(baseline)
+        print('')
+        print(args.handler + ':')
+
+    summary = run_benchmark(args.sessions, args.concurrency, args.steps, args.handler, args.seed,
+                            args.dynamodb_latency / 1000.0, not args.no_index)
+    print_report(summary, baseline)
+
+    responses_match = True
+    if args.compare_handler:
+        print('')
+        responses_match = compare_responses(baseline, summary)
+
+    if args.json_output:
+        del summary['responses']
+        with open(args.json_output, 'w') as output_file:
+            json.dump(summary, output_file, indent=2, sort_keys=True)
+    sys.exit(0 if responses_match else 1)
@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" Warm the search and recipe caches ahead of traffic peaks.
+
+Runs every query in a top-queries file (one per line, "#" for comments),
+then scrapes the top recipes of each search and any extra recipe URLs, and
+writes everything to the in-process and shared cache tiers in bulk:
+
+    python prewarm.py --queries top_queries.txt --recipes-per-query 3
+    python prewarm.py --recipes holiday_recipes.txt --concurrency 4 --rate 2
+"""
+
+import argparse
+import sys
+import time
+
+import skinnytaste
+
+
+def read_lines(path):
+    with open(path) as lines_file:
+        lines = [line.strip() for line in lines_file]
+    return [line for line in lines if line and not line.startswith('#')]
+
+
+def prewarm(search_queries, recipe_urls, recipes_per_query=3, max_workers=skinnytaste.BATCH_MAX_WORKERS,
+            requests_per_second=skinnytaste.BATCH_REQUESTS_PER_SECOND, progress=skinnytaste.print_batch_progress):
+    """ Returns the number of searches and recipes that couldn't be fetched. """
+    failures = 0
+
+    recipe_urls = list(recipe_urls)
+    if search_queries:
+        search_results = skinnytaste.search_queries_batch(search_queries, max_workers, requests_per_second, progress)
+        for recipe_results in search_results.values():
+            if isinstance(recipe_results, Exception):
+                failures += 1
+                continue
+            recipe_urls.extend(recipe_result.url for recipe_result in recipe_results[:recipes_per_query])
+
+    if recipe_urls:
+        recipes = skinnytaste.fetch_recipes_batch(recipe_urls, max_workers, requests_per_second, progress)
+        failures += sum(1 for recipe_details in recipes.values() if isinstance(recipe_details, Exception))
+
+    return failures
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Warm the Skinnytaste skill caches.')
+    parser.add_argument('--queries', help='File of search queries, one per line')
+    parser.add_argument('--recipes', help='File of recipe URLs, one per line')
+    parser.add_argument('--recipes-per-query', type=int, default=3)
+    parser.add_argument('--concurrency', type=int, default=skinnytaste.BATCH_MAX_WORKERS)
+    parser.add_argument('--rate', type=float, default=skinnytaste.BATCH_REQUESTS_PER_SECOND,
+                        help='Requests per second per host')
+    args = parser.parse_args()
+
+    if not args.queries and not args.recipes:
+        parser.error('give --queries and/or --recipes')
+
+    started_at = time.time()
+    failures = prewarm(
+        read_lines(args.queries) if args.queries else [],
+        read_lines(args.recipes) if args.recipes else [],
+        args.recipes_per_query,
+        args.concurrency,
+        args.rate
+    )
+    print("Prewarm finished in {seconds:.1f}s with {failures} failures".format(
+        seconds=time.time() - started_at, failures=failures))
+    sys.exit(1 if failures else 0)
@@ -0,0 +1,260 @@
+# -*- coding: utf-8 -*-
+
+""" Rewriting of voice search queries before they're searched.
+
+Alexa's transcription of the search slot is noisy ("brocoli", "turkey
+chilly"), and people say "zoodles" or "crock pot" where the site says
+"zucchini noodles" or "slow cooker". rewrite_query maps synonyms to the
+site's terms and corrects words the recipe index doesn't know to the closest
+word it does, so more searches hit the index and the search cache first time.
+
+Spelling correction uses a symmetric delete index: every vocabulary word is
+stored under each string made by deleting one of its letters, and a query
+word is looked up under the strings made by deleting up to two of its
+letters, so finding candidates takes a few dictionary lookups whatever the
+size of the vocabulary. Ties, and words too far off to correct by spelling,
+are settled with a phonetic key.
+"""
+
+import re
+
+import recipe_index
+
+
+# Spoken or regional names, and the words the site uses instead. Phrases are
+# matched before single words.
+SYNONYMS = {
+    'zoodle': 'zucchini noodles',
+    'zoodles': 'zucchini noodles',
+    'courgette': 'zucchini',
+    'courgettes': 'zucchini',
+    'aubergine': 'eggplant',
+    'aubergines': 'eggplant',
+    'capsicum': 'bell pepper',
+    'coriander': 'cilantro',
+    'scallion': 'green onion',
+    'scallions': 'green onions',
+    'prawn': 'shrimp',
+    'prawns': 'shrimp',
+    'garbanzo': 'chickpea',
+    'garbanzo bean': 'chickpeas',
+    'garbanzo beans': 'chickpeas',
+    'hamburger meat': 'ground beef',
+    'minced beef': 'ground beef',
+    'bbq': 'barbecue',
+    'mac and cheese': 'macaroni and cheese',
+    'mac n cheese': 'macaroni and cheese',
+    'crock pot': 'slow cooker',
+    'crockpot': 'slow cooker',
+    'insta pot': 'instant pot',
+    'instapot': 'instant pot',
+    'keen wah': 'quinoa',
+    'keen wa': 'quinoa'
+}
+MAX_SYNONYM_WORDS = max(len(phrase.split()) for phrase in SYNONYMS)
+
+# Words shorter than this are never corrected; there are too many real words
+# one letter away from them. Words up to SHORT_WORD_LENGTH letters are only
+# corrected by one edit, longer ones by up to two.
+MIN_CORRECTION_LENGTH = 4
+SHORT_WORD_LENGTH = 5
+
+# Rewrites applied in order to build a word's phonetic key, before vowels
+# are dropped and repeated letters collapsed.
+PHONETIC_RULES = [(re.compile(pattern), replacement) for pattern, replacement in [
+    (r'^kn', 'n'),
+    (r'^wr', 'r'),
+    (r'ph', 'f'),
+    (r'gh', ''),
+    (r'ck', 'k'),
+    (r'c(?=[eiy])', 's'),
+    (r'c', 'k'),
+    (r'q', 'k'),
+    (r'x', 'ks'),
+    (r'z', 's'),
+    (r'dg', 'j'),
+    (r'j', 'h')
+]]
+
+
+def phonetic_key(word):
+    key = word
+    for pattern, replacement in PHONETIC_RULES:
+        key = pattern.sub(replacement, key)
+    if not key:
+        return key
+    key = key[0] + re.sub(r'[aeiouyhw]', '', key[1:])
+    return re.sub(r'(.)\1+', r'\1', key)
+
+
+def edit_distance(a, b):
+    """ Optimal string alignment distance: insertions, deletions,
+    substitutions and transpositions of adjacent letters.
+    """
+    previous_row = None
+    row = range(len(b) + 1)
+    for i in range(1, len(a) + 1):
+        previous_row, row = row, [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            row[j] = min(row[j - 1] + 1, previous_row[j] + 1, previous_row[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                row[j] = min(row[j], two_rows_back[j - 2] + 1)
+        two_rows_back = previous_row
+    return row[len(b)]
+
+
+def single_deletes(word):
+    return set(word[:i] + word[i + 1:] for i in range(len(word)))
+
+
+def build_spelling_index(word_frequencies):
+    """ Build the spelling index from {word: frequency}. The ids of the words
+    under each delete and phonetic key are kept comma-separated, and only
+    parsed (with word_ids) for the keys a query looks up.
+    """
+    words = sorted(word_frequencies)
+    deletes = {}
+    phonetic_keys = {}
+    for word_id, word in enumerate(words):
+        for deleted in single_deletes(word) | set([word]):
+            deletes.setdefault(deleted, []).append(str(word_id))
+        phonetic_keys.setdefault(phonetic_key(word), []).append(str(word_id))
+
+    return {
+        'words': words,
+        'frequencies': [word_frequencies[word] for word in words],
+        'deletes': dict((deleted, ','.join(ids)) for deleted, ids in deletes.items()),
+        'phonetic_keys': dict((key, ','.join(ids)) for key, ids in phonetic_keys.items())
+    }
+
+
+def word_ids(ids):
+    return [int(word_id) for word_id in ids.split(',')] if ids else []
+
+
+def pack_spelling_index(spelling_index):
+    """ The spelling index as a few long strings, for recipe_index to save in
+    the index file. They load from JSON many times faster than the dicts.
+    """
+    packed = {
+        'words': '\n'.join(spelling_index['words']),
+        'frequencies': spelling_index['frequencies']
+    }
+    for name in ('deletes', 'phonetic_keys'):
+        keys = sorted(spelling_index[name])
+        packed[name] = ['\n'.join(keys), '\n'.join(spelling_index[name][key] for key in keys)]
+    return packed
+
+
+def unpack_spelling_index(packed):
+    # Every word is a key of deletes, so there are keys whenever there are words
+    spelling_index = {
+        'words': packed['words'].split('\n') if packed['words'] else [],
+        'frequencies': packed['frequencies']
+    }
+    for name in ('deletes', 'phonetic_keys'):
+        keys, ids = packed[name]
+        spelling_index[name] = dict(zip(keys.split('\n'), ids.split('\n'))) if packed['words'] else {}
+    return spelling_index
+
+
+def vocabulary_frequencies(index):
+    """ {word: number of recipes} for the vocabulary of a recipe index. """
+    surface_forms = index.get('surface_forms', {})
+    word_frequencies = {}
+    for term, term_postings in index['postings'].items():
+        word = surface_forms.get(term, term)
+        word_frequencies[word] = word_frequencies.get(word, 0) + len(term_postings) // 2
+    return word_frequencies
+
+
+def spelling_index_from_recipe_index(index):
+    """ Return the spelling index saved in a recipe index (see
+    pack_spelling_index), along with the set of terms (as
+    recipe_index.tokenize produces them) that need no correcting. It's built
+    from the index's vocabulary for index files saved without one, and empty
+    (only synonyms are rewritten) without an index.
+    """
+    if index is None:
+        spelling_index = build_spelling_index({})
+        spelling_index['known_terms'] = frozenset()
+        return spelling_index
+
+    if 'spelling' in index:
+        spelling_index = unpack_spelling_index(index['spelling'])
+    else:
+        spelling_index = build_spelling_index(vocabulary_frequencies(index))
+    spelling_index['known_terms'] = frozenset(index['postings'])
+    return spelling_index
+
+
+def correct_word(spelling_index, word):
+    """ Return the vocabulary word closest to word, or None if there's none
+    close enough.
+    """
+    words = spelling_index['words']
+    frequencies = spelling_index['frequencies']
+    max_distance = 1 if len(word) <= SHORT_WORD_LENGTH else 2
+
+    query_deletes = set([word])
+    deleted = single_deletes(word)
+    query_deletes |= deleted
+    if max_distance > 1:
+        for once_deleted in deleted:
+            query_deletes |= single_deletes(once_deleted)
+
+    candidate_ids = set()
+    for query_delete in query_deletes:
+        candidate_ids.update(word_ids(spelling_index['deletes'].get(query_delete)))
+
+    key = phonetic_key(word)
+    best = None
+    for word_id in candidate_ids:
+        distance = edit_distance(word, words[word_id])
+        if distance > max_distance:
+            continue
+        rank = (distance, phonetic_key(words[word_id]) != key, -frequencies[word_id], words[word_id])
+        if best is None or rank < best:
+            best = rank
+    if best is not None:
+        return best[3]
+
+    # Nothing close in spelling; try words that sound the same
+    for word_id in word_ids(spelling_index['phonetic_keys'].get(key)):
+        distance = edit_distance(word, words[word_id])
+        if distance > max_distance + 1:
+            continue
+        rank = (distance, -frequencies[word_id], words[word_id])
+        if best is None or rank < best:
+            best = rank
+    return best[2] if best is not None else None
+
+
+def is_known_word(spelling_index, word):
+    terms = recipe_index.tokenize(word)
+    return all(term in spelling_index['known_terms'] for term in terms)
+
+
+def rewrite_query(spelling_index, query):
+    """ Return the query with synonyms replaced and misheard words corrected.
+    Words the index knows, stopwords and short words are left alone.
+    """
+    words = query.split()
+    rewritten_words = []
+    i = 0
+    while i < len(words):
+        for phrase_length in range(min(MAX_SYNONYM_WORDS, len(words) - i), 0, -1):
+            phrase = ' '.join(words[i:i + phrase_length])
+            if phrase in SYNONYMS:
+                rewritten_words.append(SYNONYMS[phrase])
+                i += phrase_length
+                break
+        else:
+            word = words[i]
+            if (len(word) >= MIN_CORRECTION_LENGTH and word.isalpha() and spelling_index['words']
+                    and not is_known_word(spelling_index, word)):
+                word = correct_word(spelling_index, word) or word
+            rewritten_words.append(word)
+            i += 1
+    return ' '.join(rewritten_words)
@@ -0,0 +1,391 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" Offline search index of Skinnytaste recipes.
+
+Run this module to crawl the site's sitemaps and (re)build the index file that
+ships with the Lambda function:
+
+    python recipe_index.py --output recipe_index.json.gz
+
+Only pages whose sitemap <lastmod> changed since the previous build are
+fetched again. At request time skinnytaste.search_for_recipe loads the file
+once per container and answers searches with search_index().
+"""
+
+import binascii
+import gzip
+import json
+import math
+import re
+
+from recipe_model import SearchResult
+
+
+INDEX_VERSION = 1
+SITEMAP_INDEX_URL = 'https://www.skinnytaste.com/sitemap_index.xml'
+SITEMAP_NAMESPACE = '{http://www.sitemaps.org/schemas/sitemap/0.9}'
+
+# BM25 parameters, and how much more a word in the title counts than a word
+# in the ingredient list.
+BM25_K1 = 1.2
+BM25_B = 0.75
+TITLE_WEIGHT = 3
+
+STOPWORDS = set([
+    'a', 'an', 'and', 'or', 'the', 'of', 'with', 'in', 'on', 'for', 'to',
+    'recipe', 'recipes', 'cup', 'cups', 'tsp', 'tbsp', 'teaspoon', 'teaspoons',
+    'tablespoon', 'tablespoons', 'oz', 'ounce', 'ounces', 'lb', 'lbs',
+    'pound', 'pounds', 'large', 'medium', 'small', 'chopped', 'minced',
+    'sliced', 'diced', 'fresh', 'taste'
+])
+
+# Words people say around the ingredients they have on hand
+INGREDIENT_QUERY_STOPWORDS = set([
+    'some', 'leftover', 'left', 'over', 'have', 'got', 'my', 'make', 'cook', 'using', 'use', 'only', 'just'
+])
+
+
+# ----------------------- Searching the index -----------------------------
+
+def index_term(word):
+    """ The index term for a lowercase word, or None for stopwords. Simple
+    plurals are reduced so "tomatoes" and "tomato" match.
+    """
+    if word in STOPWORDS or len(word) < 2:
+        return None
+    if word.endswith('oes'):
+        return word[:-2]
+    if word.endswith('ies'):
+        return word[:-3] + 'y'
+    if word.endswith('s') and not word.endswith('ss'):
+        return word[:-1]
+    return word
+
+
+def tokenize(text):
+    """ Split text into lowercase index terms, dropping stopwords. """
+    terms = []
+    for word in re.findall(r'[a-z]+', text.lower()):
+        term = index_term(word)
+        if term is not None:
+            terms.append(term)
+    return terms
+
+
+def load_index(index_path):
+    with gzip.open(index_path, 'rb') as index_file:
+        index = json.loads(index_file.read().decode('utf-8'))
+    if index['version'] != INDEX_VERSION:
+        raise ValueError("Unsupported recipe index version: " + str(index['version']))
+    return index
+
+
+def save_index(index, index_path):
+    # Keys starting with "_" hold structures derived at runtime
+    saved_index = dict((key, value) for key, value in index.items() if not key.startswith('_'))
+    with gzip.open(index_path, 'wb') as index_file:
+        index_file.write(json.dumps(saved_index, separators=(',', ':')).encode('utf-8'))
+
+
+def search_index(index, search_query, max_results=10):
+    """ Return up to max_results SearchResults for the query, best BM25 score
+    first.
+    """
+    documents = index['documents']
+    doc_lengths = index['doc_lengths']
+    avg_doc_length = index['avg_doc_length'] or 1.0
+    number_of_documents = len(documents)
+
+    scores = {}
+    for term in set(tokenize(search_query)):
+        postings = index['postings'].get(term)
+        if not postings:
+            continue
+
+        # Postings are stored flat as [doc_id, term_frequency, doc_id, ...]
+        document_frequency = len(postings) // 2
+        idf = math.log(1.0 + (number_of_documents - document_frequency + 0.5) / (document_frequency + 0.5))
+        for i in range(0, len(postings), 2):
+            doc_id = postings[i]
+            term_frequency = postings[i + 1]
+            length_norm = 1.0 - BM25_B + BM25_B * doc_lengths[doc_id] / avg_doc_length
+            score = idf * term_frequency * (BM25_K1 + 1) / (term_frequency + BM25_K1 * length_norm)
+            scores[doc_id] = scores.get(doc_id, 0.0) + score
+
+    ranked_doc_ids = sorted(scores, key=lambda doc_id: (-scores[doc_id], doc_id))[:max_results]
+    return [SearchResult(documents[doc_id]['title'], documents[doc_id]['url']) for doc_id in ranked_doc_ids]
+
+
+def make_bitset(doc_ids, number_of_documents):
+    """ A long with bit doc_id set for each of doc_ids. """
+    bits = bytearray(number_of_documents // 8 + 1)
+    for doc_id in doc_ids:
+        bits[doc_id // 8] |= 1 << (doc_id % 8)
+    bits.reverse()
+    return long(binascii.hexlify(bits), 16)
+
+
+def bitset_doc_ids(bitset):
+    return [match.start() for match in re.finditer('1', bin(bitset)[:1:-1])]
+
+
+def get_ingredient_bitset(index, term):
+    """ Bitset of the recipes with an ingredient matching term, built from
+    its posting list on first use.
+    """
+    bitsets = index.setdefault('_ingredient_bitsets', {})
+    if term not in bitsets:
+        bitsets[term] = make_bitset(index['ingredient_postings'].get(term, ()), len(index['documents']))
+    return bitsets[term]
+
+
+def get_ingredient_count_bitsets(index):
+    """ [(number of ingredients, bitset of the recipes with that many)],
+    fewest first.
+    """
+    if '_ingredient_count_bitsets' not in index:
+        doc_ids_by_count = {}
+        for doc_id, document in enumerate(index['documents']):
+            doc_ids_by_count.setdefault(len(document['ingredients']), []).append(doc_id)
+        index['_ingredient_count_bitsets'] = [
+            (count, make_bitset(doc_ids, len(index['documents'])))
+            for count, doc_ids in sorted(doc_ids_by_count.items())
+        ]
+    return index['_ingredient_count_bitsets']
+
+
+def search_by_ingredients(index, ingredients_text, max_results=10):
+    """ Return up to max_results SearchResults for the recipes that use the
+    most of the ingredients in ingredients_text, and among those the ones
+    needing the fewest other ingredients. Returns None if the index has no
+    ingredient postings.
+
+    How many of the ingredients each recipe uses is counted with a bit-sliced
+    counter over the ingredients' bitsets, so the work grows with the number
+    of ingredients asked for rather than the number of recipes.
+    """
+    if 'ingredient_postings' not in index:
+        return None
+
+    terms = []
+    for term in tokenize(ingredients_text):
+        if term not in INGREDIENT_QUERY_STOPWORDS and term in index['ingredient_postings'] and term not in terms:
+            terms.append(term)
+    if not terms:
+        return []
+
+    # counter[i] holds bit i of each recipe's count of matching ingredients
+    counter = []
+    for term in terms:
+        carry = get_ingredient_bitset(index, term)
+        for i in range(len(counter)):
+            counter[i], carry = counter[i] ^ carry, counter[i] & carry
+        if carry:
+            counter.append(carry)
+
+    documents = index['documents']
+    recipe_results = []
+    for count in range(len(terms), 0, -1):
+        if count >> len(counter):
+            continue
+        tier = -1
+        for i, bits in enumerate(counter):
+            tier &= bits if count >> i & 1 else ~bits
+        if not tier:
+            continue
+
+        # Fewest ingredients left to buy first
+        for _, count_bitset in get_ingredient_count_bitsets(index):
+            for doc_id in bitset_doc_ids(tier & count_bitset)[:max_results - len(recipe_results)]:
+                recipe_results.append(SearchResult(documents[doc_id]['title'], documents[doc_id]['url']))
+            if len(recipe_results) >= max_results:
+                return recipe_results
+    return recipe_results
+
+
+# ----------------------- Building the index -----------------------------
+
+def build_index(documents, skipped_pages=None):
+    """ Build the inverted index from a list of documents, each a dict with
+    title, url, lastmod and ingredients. skipped_pages, the lastmod of each
+    crawled page that isn't a recipe, is kept for the next crawl. The index
+    also keeps the most common word behind each term, as the vocabulary for
+    query_rewrite, the spelling index query_rewrite builds from it, and the
+    sorted ids of the recipes using each ingredient term, for
+    search_by_ingredients.
+    """
+    import query_rewrite
+
+    term_frequencies = {}
+    doc_lengths = []
+    word_counts = {}
+    ingredient_postings = {}
+
+    for doc_id, document in enumerate(documents):
+        for text in [document['title']] + document['ingredients']:
+            for word in re.findall(r'[a-z]+', text.lower()):
+                term = index_term(word)
+                if term is not None:
+                    term_words = word_counts.setdefault(term, {})
+                    term_words[word] = term_words.get(word, 0) + 1
+
+        counts = {}
+        for term in tokenize(document['title']):
+            counts[term] = counts.get(term, 0) + TITLE_WEIGHT
+        for ingredient in document['ingredients']:
+            for term in tokenize(ingredient):
+                counts[term] = counts.get(term, 0) + 1
+
+        for term, count in counts.items():
+            term_frequencies.setdefault(term, []).extend([doc_id, count])
+        doc_lengths.append(sum(counts.values()))
+
+        ingredient_terms = set()
+        for ingredient in document['ingredients']:
+            ingredient_terms.update(tokenize(ingredient))
+        for term in ingredient_terms:
+            ingredient_postings.setdefault(term, []).append(doc_id)
+
+    index = {
+        'version': INDEX_VERSION,
+        'documents': documents,
+        'skipped_pages': skipped_pages or {},
+        'doc_lengths': doc_lengths,
+        'avg_doc_length': float(sum(doc_lengths)) / len(doc_lengths) if doc_lengths else 0.0,
+        'postings': term_frequencies,
+        'ingredient_postings': ingredient_postings,
+        'surface_forms': dict(
+            (term, max(sorted(term_words), key=lambda word: term_words[word]))
+            for term, term_words in word_counts.items()
+        )
+    }
+
+    # Building the spelling index takes seconds for the site's vocabulary, so
+    # it's done here rather than on a user's first search
+    index['spelling'] = query_rewrite.pack_spelling_index(
+        query_rewrite.build_spelling_index(query_rewrite.vocabulary_frequencies(index)))
+    return index
+
+
+def fetch_page(url):
+    import skinnytaste
+
+    return skinnytaste.fetch_url(url).text
+
+
+def read_sitemap(sitemap_xml):
+    """ Return (loc, lastmod) pairs for every <url> or <sitemap> entry. """
+    import xml.etree.ElementTree as ElementTree
+
+    entries = []
+    root = ElementTree.fromstring(sitemap_xml.encode('utf-8'))
+    for element in root:
+        loc = element.find(SITEMAP_NAMESPACE + 'loc')
+        lastmod = element.find(SITEMAP_NAMESPACE + 'lastmod')
+        if loc is not None:
+            entries.append((loc.text.strip(), lastmod.text.strip() if lastmod is not None else None))
+    return entries
+
+
+def list_recipe_pages(sitemap_index_url=SITEMAP_INDEX_URL, fetch=fetch_page):
+    """ Walk the sitemap index and return (url, lastmod) for every post. """
+    pages = []
+    for sitemap_url, _ in read_sitemap(fetch(sitemap_index_url)):
+        if 'post-sitemap' not in sitemap_url:
+            continue
+        pages.extend(read_sitemap(fetch(sitemap_url)))
+    return pages
+
+
+def parse_recipe_document(recipe_url, lastmod, recipe_page_html):
+    """ Turn a recipe page into an index document, or None if the page isn't
+    a recipe the skill can read.
+    """
+    import skinnytaste
+
+    try:
+        recipe_details = skinnytaste.extract_recipe_details(recipe_page_html)
+    except skinnytaste.RecipeParseError:
+        return None
+
+    if not recipe_details['title']:
+        return None
+
+    return {
+        'title': recipe_details['title'],
+        'url': recipe_url,
+        'lastmod': lastmod,
+        'ingredients': recipe_details['ingredients']
+    }
+
+
+def crawl(pages, previous_index=None, fetch=fetch_page):
+    """ Return (documents, skipped_pages) for the given (url, lastmod) pages:
+    the index documents of the recipes, and the lastmod of each page that
+    isn't one. Pages whose lastmod hasn't changed since previous_index aren't
+    fetched again. A page that can't be fetched keeps its previous document,
+    if it has one, and is tried again on the next build.
+    """
+    from skinnytaste import OriginUnavailableError
+
+    previous_documents = {}
+    previous_skipped_pages = {}
+    if previous_index is not None:
+        for document in previous_index['documents']:
+            previous_documents[document['url']] = document
+        previous_skipped_pages = previous_index.get('skipped_pages', {})
+
+    documents = []
+    skipped_pages = {}
+    fetched = 0
+    failed = 0
+    for recipe_url, lastmod in pages:
+        previous_document = previous_documents.get(recipe_url)
+        if lastmod is not None:
+            if previous_document is not None and previous_document['lastmod'] == lastmod:
+                documents.append(previous_document)
+                continue
+            if previous_skipped_pages.get(recipe_url) == lastmod:
+                skipped_pages[recipe_url] = lastmod
+                continue
+
+        fetched += 1
+        try:
+            recipe_page_html = fetch(recipe_url)
+        except OriginUnavailableError as e:
+            print("Keeping the previous version of " + recipe_url + ": " + str(e))
+            failed += 1
+            if previous_document is not None:
+                documents.append(previous_document)
+            continue
+
+        document = parse_recipe_document(recipe_url, lastmod, recipe_page_html)
+        if document is not None:
+            documents.append(document)
+        elif lastmod is not None:
+            skipped_pages[recipe_url] = lastmod
+
+    print("Indexed {count} recipes ({fetched} pages fetched, {failed} failed)".format(
+        count=len(documents), fetched=fetched, failed=failed))
+    return documents, skipped_pages
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Build the Skinnytaste recipe search index.')
+    parser.add_argument('--output', default='recipe_index.json.gz')
+    parser.add_argument('--sitemap', default=SITEMAP_INDEX_URL)
+    parser.add_argument('--full', action='store_true', help='Re-fetch every page instead of only changed ones')
+    args = parser.parse_args()
+
+    previous_index = None
+    if not args.full:
+        try:
+            previous_index = load_index(args.output)
+        except (IOError, ValueError):
+            previous_index = None
+
+    documents, skipped_pages = crawl(list_recipe_pages(args.sitemap), previous_index)
+    save_index(build_index(documents, skipped_pages), args.output)
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+
+""" Recipes and search results as they're passed around the skill, and their
+compact serialized form for DynamoDB and the caches.
+
+The serialized form is a one-byte format version followed by JSON, stored as
+a single binary ("B") attribute. JSON of COMPRESS_MIN_SIZE bytes or more is
+zlib-compressed first; since the JSON is always a list, a "[" after the
+version byte tells the two apart.
+"""
+
+import json
+import zlib
+
+
+RECIPE_FORMAT_VERSION = 1
+SEARCH_RESULTS_FORMAT_VERSION = 1
+
+# Compressing small blobs costs more time than the write capacity it saves
+# (a unit per KB). Level 1 gets most of level 6's saving in half the time.
+COMPRESS_MIN_SIZE = 1024
+COMPRESSION_LEVEL = 1
+
+
+def pack(version, fields):
+    serialized = json.dumps(fields, separators=(',', ':'))
+    if len(serialized) >= COMPRESS_MIN_SIZE:
+        serialized = zlib.compress(serialized, COMPRESSION_LEVEL)
+    return chr(version) + serialized
+
+
+def unpack(data, expected_version):
+    version = ord(data[0])
+    if version != expected_version:
+        raise ValueError("Unsupported serialized format version: " + str(version))
+    if data[1:2] == '[':
+        return json.loads(data[1:])
+    return json.loads(zlib.decompress(data[1:]))
+
+
+class Recipe(object):
+    """ A normalized recipe: its ingredients and instructions, plus the speech
+    for each step and the recipe card text, rendered when it was ingested.
+    """
+    __slots__ = ('ingredients', 'instructions', 'steps_ssml', 'card_text')
+
+    def __init__(self, ingredients, instructions, steps_ssml, card_text):
+        self.ingredients = ingredients
+        self.instructions = instructions
+        self.steps_ssml = steps_ssml
+        self.card_text = card_text
+
+    def __eq__(self, other):
+        return isinstance(other, Recipe) and all(
+            getattr(self, field) == getattr(other, field) for field in self.__slots__)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return 'Recipe({0} ingredients, {1} steps)'.format(len(self.ingredients), len(self.steps_ssml))
+
+    def encode(self):
+        return pack(RECIPE_FORMAT_VERSION, [self.ingredients, self.instructions, self.steps_ssml, self.card_text])
+
+    @classmethod
+    def decode(cls, data):
+        ingredients, instructions, steps_ssml, card_text = unpack(data, RECIPE_FORMAT_VERSION)
+        return cls(ingredients, instructions, steps_ssml, card_text)
+
+
+class SearchResult(object):
+    __slots__ = ('title', 'url')
+
+    def __init__(self, title, url):
+        self.title = title
+        self.url = url
+
+    def __eq__(self, other):
+        return isinstance(other, SearchResult) and self.title == other.title and self.url == other.url
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return 'SearchResult({0!r}, {1!r})'.format(self.title, self.url)
+
+
+def encode_search_results(search_results):
+    return pack(SEARCH_RESULTS_FORMAT_VERSION, [[result.title, result.url] for result in search_results])
+
+
+def decode_search_results(data):
+    return [SearchResult(title, url) for title, url in unpack(data, SEARCH_RESULTS_FORMAT_VERSION)]
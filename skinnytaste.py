@@ -1,14 +1,51 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
-from bs4 import BeautifulSoup
-import requests
+# Only lightweight standard library modules are imported here. bs4, requests,
+# boto3 and the recipe index are imported by the functions that need them, so
+# requests like LaunchRequest and AMAZON.HelpIntent don't pay for loading them
+# on a cold start. See warm_up for pre-loading them instead.
+import os
+import hashlib
 import urllib
-from pprint import pprint
-import boto3
+import urlparse
+import json
+import time
+import random
+import re
+import threading
+import HTMLParser
+from collections import OrderedDict
+
+from recipe_model import Recipe, SearchResult, encode_search_results, decode_search_results
 
 
 def lambda_handler(event, context):
+    """ Entry point of the Lambda function. Handles the request within one
+    deadline derived from the Alexa timeout (see response_deadline) and emits
+    one structured metrics record for the invocation.
+    """
+    # Scheduled warm-up pings only load dependencies and create clients
+    if event.get('source') == 'aws.events' or event.get('warmup'):
+        warm_up()
+        return {'warmed_up': True}
+
+    start_invocation_metrics()
+    invocation_state['deadline'] = response_deadline(context)
+    try:
+        response = route_request(event, context)
+        wait_for_background_io()
+    except Exception:
+        emit_invocation_metrics(event, None, failed=True)
+        raise
+    finally:
+        invocation_state['deadline'] = None
+
+    emit_invocation_metrics(event, response)
+    return response
+
+
+def route_request(event, context):
     """ Route the incoming request based on type (LaunchRequest, IntentRequest,
     etc.) The JSON body of the request is provided in the event parameter.
     """
@@ -24,6 +61,8 @@ def lambda_handler(event, context):
     #         os.environ["SKILL_ID"]):
     #     raise ValueError("Invalid Application ID")
 
+    clear_user_item_cache()
+
     if event['session']['new']:
         on_session_started({'requestId': event['request']['requestId']},
                            event['session'])
@@ -68,6 +107,8 @@ def on_intent(intent_request, session):
     if intent_name == "SearchForRecipe":
         return alexa_search_for_recipe(intent, session)
     # Once the search results are found, choose a specific recipe
+    elif intent_name == "SearchByIngredients":
+        return alexa_search_by_ingredients(intent, session)
     elif intent_name == "PickRecipeNumber":
         return alexa_pick_recipe_number(intent, session)
     elif intent_name == "NextStep":
@@ -76,6 +117,10 @@ def on_intent(intent_request, session):
         return alexa_previous_step(intent, session)
     elif intent_name == "RepeatStep":
         return alexa_repeat_step(intent, session)
+    elif intent_name == "ResumeRecipe":
+        return alexa_resume_recipe(intent, session)
+    elif intent_name == "ResumePreviousRecipe":
+        return alexa_resume_previous_recipe(intent, session)
     elif intent_name == "AMAZON.HelpIntent":
         return alexa_help(intent, session)
     elif intent_name == "AMAZON.StopIntent" or intent_name == "AMAZON.CancelIntent":
@@ -121,7 +166,6 @@ def alexa_search_for_recipe(intent, session):
         session_attributes = session['attributes']
     else:
         session_attributes = {}
-    should_end_session = False
     reprompt_text = 'Sorry, I didn\'t catch that. Please say "recipe" and then the number of the result.'
     session_attributes['new_session'] = False
 
@@ -133,30 +177,98 @@ def alexa_search_for_recipe(intent, session):
             speech_output, False, False, reprompt_text, False))
     
     # Search the Skinnytaste site for the search string provided by the user
-    recipe_results = search_for_recipe(intent['slots']['RecipeSearchString']['value'])
+    try:
+        recipe_results = search_for_recipe(intent['slots']['RecipeSearchString']['value'])
+    except OriginUnavailableError as e:
+        print("Search failed: " + str(e))
+        degraded_stats['unavailable_responses'] += 1
+        return build_response(session_attributes, build_speechlet_response(
+            ORIGIN_UNAVAILABLE_SPEECH, False, False, ORIGIN_UNAVAILABLE_SPEECH, False))
 
-    # Loop through the search results and append them to the speech output
     speech_output = '<p>Here are the top search results for "{search_string}": </p>'.format(
         search_string=intent['slots']['RecipeSearchString']['value']
     )
+    card_title = 'Search results for "{search}":'.format(search=intent['slots']['RecipeSearchString']['value'])
+    return build_search_results_response(session_attributes, recipe_results, speech_output, card_title)
+
+
+def alexa_search_by_ingredients(intent, session):
+    if 'attributes' in session.keys():
+        session_attributes = session['attributes']
+    else:
+        session_attributes = {}
+    reprompt_text = 'Sorry, I didn\'t catch that. Please say "recipe" and then the number of the result.'
+    session_attributes['new_session'] = False
 
+    # Error handling: User did not say any ingredients
+    if 'value' not in intent['slots']['IngredientList'].keys():
+        speech_output = ('<p>Sorry, I didn\'t catch which ingredients you have. '
+                         'Try saying something like "what can I make with chicken and spinach".</p>')
+        return build_response(session_attributes, build_speechlet_response(
+            speech_output, False, False, reprompt_text, False))
+
+    ingredients = intent['slots']['IngredientList']['value']
+    try:
+        recipe_results = search_by_ingredients(ingredients)
+    except OriginUnavailableError as e:
+        print("Ingredient search failed: " + str(e))
+        degraded_stats['unavailable_responses'] += 1
+        return build_response(session_attributes, build_speechlet_response(
+            ORIGIN_UNAVAILABLE_SPEECH, False, False, ORIGIN_UNAVAILABLE_SPEECH, False))
+
+    if not recipe_results:
+        speech_output = ('<p>Sorry, I couldn\'t find any recipes using "{ingredients}". '
+                         'Try naming fewer or different ingredients.</p>').format(ingredients=ingredients)
+        return build_response(session_attributes, build_speechlet_response(
+            speech_output, False, False, 'Try saying "what can I make with" and then your ingredients.', False))
+
+    speech_output = '<p>Here are recipes you can make with "{ingredients}": </p>'.format(ingredients=ingredients)
+    card_title = 'Recipes using "{ingredients}":'.format(ingredients=ingredients)
+    return build_search_results_response(session_attributes, recipe_results, speech_output, card_title)
+
+
+def build_search_results_response(session_attributes, recipe_results, speech_output, card_title):
+    """ Read out the top three results after the speech_output heading, and
+    keep them in the session for PickRecipeNumber.
+    """
+    should_end_session = False
+    reprompt_text = 'Sorry, I didn\'t catch that. Please say "recipe" and then the number of the result.'
+
+    # Loop through the search results and append them to the speech output
     for search_result_counter in range(0, min([len(recipe_results), 3])):  # We take the min() to account for searches with less than 3 results
         speech_output += "Recipe {result_count}: {result}. ".format(
             result_count=search_result_counter + 1,
-            result=recipe_results[search_result_counter]['recipe_title']
+            result=recipe_results[search_result_counter].title
             )
 
-    # Save the search results to the session for later
-    session_attributes['recipe_results'] = recipe_results
+    # Save the top search results to the session for later. Only the titles
+    # and URLs of the results we read out are kept, to keep the session small.
+    session_attributes['search_results'] = [
+        [recipe_result.title, recipe_result.url]
+        for recipe_result in recipe_results[:3]
+    ]
+    session_attributes.pop('recipe_results', None)
+    session_attributes.pop('recipes_prefetched', None)
+
+    # The user will almost always pick one of these next, so start getting
+    # the recipes into the cache. The numbers of the results being prefetched
+    # are kept to tell whether the pick was served by the prefetch.
+    prefetched_results = prefetch_recipe_details(recipe_results)
+    if prefetched_results:
+        session_attributes['prefetched_results'] = prefetched_results
+    else:
+        session_attributes.pop('prefetched_results', None)
 
     # Finish the speech output
     speech_output += '<p>Which recipe number would you like? Say "recipe" and then the number of the result.</p>'
 
-    card_title = 'Search results for "{search}":'.format(search=intent['slots']['RecipeSearchString']['value'])
-    card_output = BeautifulSoup(speech_output, 'html.parser').get_text()
-    
-    card_output = card_output.replace('Recipe', '\nRecipe')
-    card_output = card_output.replace('Which recipe', '\n\nWhich recipe')
+    with timed('ResponseBuild'):
+        from bs4 import BeautifulSoup
+
+        card_output = BeautifulSoup(speech_output, 'html.parser').get_text()
+
+        card_output = card_output.replace('Recipe', '\nRecipe')
+        card_output = card_output.replace('Which recipe', '\n\nWhich recipe')
 
     return build_response(session_attributes, build_speechlet_response(
         speech_output, card_title, card_output, reprompt_text, should_end_session))
@@ -185,50 +297,60 @@ def alexa_pick_recipe_number(intent, session):
 
     # Retrieve the search results from the first interaction,
     # then retrieve the URL for the chosen recipe number
-    recipe_results = session_attributes['recipe_results']
-    recipe_title = recipe_results[recipe_number - 1]['recipe_title']
-    recipe_url = recipe_results[recipe_number - 1]['recipe_url']
-
-    # Scrape the recipe details from Skinnytaste.com
-    recipe_details = get_recipe_details(recipe_title, recipe_url)
-
-    # Save recipe details and the current recipe step as a session attribute for later access
-    session_attributes['recipe_details'] = recipe_details
+    recipe_results = get_session_search_results(session_attributes)
+    recipe_title = recipe_results[recipe_number - 1].title
+    recipe_url = recipe_results[recipe_number - 1].url
+
+    # Saving the pick needs the user's progress item for their History. When
+    # overlapping I/O it's read while the recipe is scraped; a recipe fresh in
+    # this container's cache takes no I/O, so then there's nothing to overlap.
+    read_previous_item = start_read(lambda: get_user_item(session, projection=None, consistent_read=False),
+                                    in_background=not recipe_is_cached(recipe_url))
+
+    # Scrape the recipe details from Skinnytaste.com, or wait for the prefetch
+    # after the search to do it
+    wait_for_prefetch(recipe_url)
+    cache_hits_before = recipe_cache_stats['hits']
+    stale_recipes_before = degraded_stats['stale_recipes_served']
+    try:
+        recipe_details = get_recipe_details(recipe_title, recipe_url)
+    except (OriginUnavailableError, RecipeParseError) as e:
+        print("Could not get recipe " + recipe_url + ": " + str(e))
+        degraded_stats['unavailable_responses'] += 1
+        return build_response(session_attributes, build_speechlet_response(
+            RECIPE_UNAVAILABLE_SPEECH, False, False, reprompt_text, False))
+    record_pick_prefetch_outcome(session_attributes, recipe_number, recipe_cache_stats['hits'] > cache_hits_before)
 
-    # Save current recipe step to the database
-    set_current_recipe_step(session, 1, recipe_details)
-    # session_attributes['current_recipe_step'] = 1
+    # Save the recipe to the database, starting at the first step. The session
+    # only keeps the recipe's URL and the step; the steps themselves are read
+    # back from the database.
+    save_recipe_to_database(session, recipe_title, recipe_url, recipe_details, read_previous_item())
 
     # Because this is the first step, repeat the name of the recipe for the user.
     current_recipe_step = get_current_recipe_step(session)
     if current_recipe_step == 1:
         speech_output = 'Here are the instructions for {recipe_title}. '.format(recipe_title=recipe_title)
 
-    # Create a list of all the instructions, separated by new lines, for the Alexa card
-    list_of_instructions = ''
-    for step_number, instruction in enumerate(recipe_details['instructions']):
-        list_of_instructions += 'Step {step_number}: {instruction}\n'.format(
-            step_number=step_number + 1,
-            instruction=instruction
-        )
-
     # Add the current recipe step instruction to the speech output
     speech_output += read_recipe_instruction(session)
 
     # Create the Alexa card with the entire recipe
     card_title = 'Recipe Instructions for {recipe_title}'.format(recipe_title=recipe_title)
-    card_output = list_of_instructions
+    card_output = recipe_details.card_text
+    if degraded_stats['stale_recipes_served'] > stale_recipes_before:
+        card_output += STALE_RECIPE_CARD_NOTE
 
     return build_response(session_attributes, build_speechlet_response(
         speech_output, card_title, card_output, reprompt_text, should_end_session))
 
 
 def alexa_next_step(intent, session):
-    print 'intent:'
-    pprint(intent)
-    
-    print 'session:'
-    pprint(session)
+    # The step read here is checked when the new step is written (see
+    # set_current_recipe_step), so it's safe to read it eventually consistent.
+    get_user_item(session, consistent_read=False)
+    if get_user_recipe(session) is None:
+        return alexa_no_recipe(intent, session)
+
     current_recipe_step = get_current_recipe_step(session)
     
     session_attributes = session['attributes']
@@ -237,11 +359,18 @@ def alexa_next_step(intent, session):
     reprompt_text = "Sorry, I didn't catch that. Please repeat."
 
     # Increase the recipe step number
-    set_current_recipe_step(session, current_recipe_step + 1, session_attributes['recipe_details'])
+    try:
+        if not set_current_recipe_step(session, current_recipe_step + 1):
+            return alexa_no_recipe(intent, session)
+    except ProgressConflictError as e:
+        print(str(e))
+        return build_response(session_attributes, build_speechlet_response(
+            PROGRESS_CONFLICT_SPEECH + read_recipe_instruction(session), False, False, reprompt_text,
+            should_end_session))
 
     speech_output = read_recipe_instruction(session)
 
-    if current_recipe_step == len(session_attributes['recipe_details']['instructions']):
+    if current_recipe_step == get_number_of_steps(session):
         speech_output += "<p>This was the last step. If you're done cooking, just say 'End'! Enjoy your meal!</p>"
 
     return build_response(session_attributes, build_speechlet_response(
@@ -249,6 +378,12 @@ def alexa_next_step(intent, session):
 
 
 def alexa_previous_step(intent, session):
+    # The step read here is checked when the new step is written (see
+    # set_current_recipe_step), so it's safe to read it eventually consistent.
+    get_user_item(session, consistent_read=False)
+    if get_user_recipe(session) is None:
+        return alexa_no_recipe(intent, session)
+
     current_recipe_step = get_current_recipe_step(session)
     
     session_attributes = session['attributes']
@@ -257,7 +392,14 @@ def alexa_previous_step(intent, session):
     reprompt_text = "Sorry, I didn't catch that. Please repeat."
 
     # Decrease the recipe step number
-    set_current_recipe_step(session, current_recipe_step - 1, session_attributes['recipe_details'])
+    try:
+        if not set_current_recipe_step(session, current_recipe_step - 1):
+            return alexa_no_recipe(intent, session)
+    except ProgressConflictError as e:
+        print(str(e))
+        return build_response(session_attributes, build_speechlet_response(
+            PROGRESS_CONFLICT_SPEECH + read_recipe_instruction(session), False, False, reprompt_text,
+            should_end_session))
 
     speech_output = read_recipe_instruction(session)
 
@@ -266,11 +408,9 @@ def alexa_previous_step(intent, session):
 
 
 def alexa_repeat_step(intent, session):
-    print 'intent:'
-    pprint(intent)
-    
-    print 'session:'
-    pprint(session)
+    if get_user_recipe(session) is None:
+        return alexa_no_recipe(intent, session)
+
     current_recipe_step = get_current_recipe_step(session)
     
     session_attributes = session['attributes']
@@ -284,6 +424,74 @@ def alexa_repeat_step(intent, session):
         speech_output, False, False, reprompt_text, should_end_session))
 
 
+def alexa_resume_recipe(intent, session):
+    if get_user_recipe(session) is None:
+        return alexa_no_recipe(intent, session)
+
+    session_attributes = session.get('attributes', {})
+    should_end_session = True
+    reprompt_text = "Sorry, I didn't catch that. Please repeat."
+
+    speech_output = 'Picking up {recipe_title} at step {step}. '.format(
+        recipe_title=get_user_recipe_title(session),
+        step=get_current_recipe_step(session)
+    )
+    speech_output += read_recipe_instruction(session)
+
+    return build_response(session_attributes, build_speechlet_response(
+        speech_output, False, False, reprompt_text, should_end_session))
+
+
+def alexa_resume_previous_recipe(intent, session):
+    """ Go back to the recipe the user was on before their current one, at
+    the step where they left it.
+    """
+    session_attributes = session.get('attributes', {})
+    session['attributes'] = session_attributes
+    should_end_session = True
+    reprompt_text = "Sorry, I didn't catch that. Please repeat."
+
+    item = get_user_item(session, projection=None)
+    history = item.get('History', {'L': []})['L'] if item is not None else []
+    previous_recipe = None
+    for entry in history:
+        previous_recipe = get_stored_recipe(entry['M']['RecipeKey']['S'])
+        if previous_recipe is not None:
+            break
+
+    if previous_recipe is None:
+        speech_output = ('<p>You don\'t have an earlier recipe saved. '
+                         'Try saying "search for" and then a recipe or ingredient.</p>')
+        return build_response(session_attributes, build_speechlet_response(
+            speech_output, False, False, reprompt_text, False))
+
+    recipe_title = entry['M']['RecipeTitle']['S']
+    recipe_step = min(int(entry['M']['CurrentStep']['N']), len(previous_recipe.steps_ssml))
+    save_user_progress(session, entry['M']['RecipeKey']['S'], recipe_title, previous_recipe, recipe_step, item,
+                       store=renew_stored_recipe(entry['M']['RecipeKey']['S']))
+
+    speech_output = 'Going back to {recipe_title} at step {step}. '.format(
+        recipe_title=recipe_title,
+        step=recipe_step
+    )
+    speech_output += read_recipe_instruction(session)
+
+    return build_response(session_attributes, build_speechlet_response(
+        speech_output, False, False, reprompt_text, should_end_session))
+
+
+def alexa_no_recipe(intent, session):
+    session_attributes = session.get('attributes', {})
+    should_end_session = False
+    reprompt_text = 'Try saying "search for" and then a recipe or ingredient.'
+
+    speech_output = ('<p>You haven\'t picked a recipe yet. '
+                     'Try saying "search for" and then a recipe or ingredient.</p>')
+
+    return build_response(session_attributes, build_speechlet_response(
+        speech_output, False, False, reprompt_text, should_end_session))
+
+
 def alexa_help(intent, session, invalid_intent=False):
     if 'attributes' in session.keys():
         session_attributes = session['attributes']
@@ -299,7 +507,8 @@ def alexa_help(intent, session, invalid_intent=False):
                          'to navigate the recipe instructions.</p>')
     else:
         speech_output = ('<p>Start using the Skinny Taste Alexa skill by searching for a recipe. '
-                        'Try something like "search for broccoli" to find broccoli recipes.</p>')
+                        'Try something like "search for broccoli" to find broccoli recipes, '
+                        'or "what can I make with chicken and spinach" to use up what you have.</p>')
 
     return build_response(session_attributes, build_speechlet_response(
         speech_output, False, False, reprompt_text, should_end_session))
@@ -321,162 +530,2037 @@ def alexa_end_session(intent, session):
 # --------------- Helpers that build all of the responses ---------------------
 
 def build_speechlet_response(speech_output, card_title, card_output, reprompt_text, should_end_session):
-    speechlet_response = {
-        'outputSpeech': {
-            'type': 'SSML',
-            'ssml': '<speak>' + speech_output + '</speak>'
-        },
-        'reprompt': {
+    with timed('ResponseBuild'):
+        speechlet_response = {
             'outputSpeech': {
-                'type': 'PlainText',
-                'text': reprompt_text
+                'type': 'SSML',
+                'ssml': '<speak>' + speech_output + '</speak>'
+            },
+            'reprompt': {
+                'outputSpeech': {
+                    'type': 'PlainText',
+                    'text': reprompt_text
+                }
+            },
+            'shouldEndSession': should_end_session
+        }
+
+        if card_title:
+            speechlet_response['card'] = {
+                'type': 'Standard',
+                'title': card_title,
+                'text': card_output
             }
-        },
-        'shouldEndSession': should_end_session
-    }
 
-    if card_title:
-        speechlet_response['card'] = {
-            'type': 'Standard',
-            'title': card_title,
-            'text': card_output
+        return speechlet_response
+
+
+def build_response(session_attributes, speechlet_response):
+    with timed('ResponseBuild'):
+        return {
+            'version': '1.0',
+            'sessionAttributes': session_attributes,
+            'response': speechlet_response
         }
 
-    return speechlet_response
 
+# ----------------------- Instrumentation -----------------------------
 
-def build_response(session_attributes, speechlet_response):
+METRICS_NAMESPACE = 'SkinnytasteSkill'
+
+# Fraction of invocations that emit a metrics record. Timings are always
+# collected (they're cheap); only the serialization and logging is sampled.
+METRICS_SAMPLE_RATE = float(os.environ.get('METRICS_SAMPLE_RATE', '1.0'))
+
+# True until the first invocation in this container has been handled
+cold_start = True
+
+# Timings (in seconds) of the phases of the current invocation, and snapshots
+# of the cache counters when it started.
+invocation_metrics = {
+    'started_at': 0.0,
+    'timings': {},
+    'counters_before': {}
+}
+
+# Threads started during an invocation add their phase timings to that
+# invocation's record, not to whichever invocation is running when they end.
+class ThreadMetrics(threading.local):
+    timings = None
+
+
+thread_metrics = ThreadMetrics()
+
+
+def current_timings():
+    timings = thread_metrics.timings
+    if timings is None:
+        return invocation_metrics['timings']
+    return timings
+
+
+def start_thread(target, *args):
+    """ Start a daemon thread running target(*args), timed as part of the
+    invocation that started it. Timings it records after that invocation's
+    metrics were emitted are dropped.
+    """
+    timings = current_timings()
+
+    def run():
+        thread_metrics.timings = timings
+        target(*args)
+
+    thread = threading.Thread(target=run)
+    thread.daemon = True
+    thread.start()
+    return thread
+
+
+class timed(object):
+    """ Context manager adding the time spent in the block to a phase of the
+    metrics of the invocation running it (see start_thread).
+    """
+    __slots__ = ('phase', 'started_at')
+
+    def __init__(self, phase):
+        self.phase = phase
+
+    def __enter__(self):
+        self.started_at = time.time()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # current_timings(), inlined as this runs for every timed block
+        timings = thread_metrics.timings
+        if timings is None:
+            timings = invocation_metrics['timings']
+        timings[self.phase] = timings.get(self.phase, 0.0) + time.time() - self.started_at
+        return False
+
+
+def get_counters():
     return {
-        'version': '1.0',
-        'sessionAttributes': session_attributes,
-        'response': speechlet_response
+        'RecipeCacheHits': recipe_cache_stats['hits'],
+        'RecipeCacheMisses': recipe_cache_stats['misses'],
+        'RecipeCacheRefreshes': recipe_cache_stats['refreshes'],
+        'SearchCacheHits': search_cache_stats['hits'],
+        'SearchCacheMisses': search_cache_stats['misses'],
+        'SearchIndexHits': search_cache_stats['index_hits'],
+        'SearchCacheStaleHits': search_cache_stats['stale_hits'],
+        'SearchQueriesRewritten': search_cache_stats['rewrites'],
+        'IngredientSearches': search_cache_stats['ingredient_searches'],
+        'StaleRecipesServed': degraded_stats['stale_recipes_served'],
+        'AlternateRecipeParses': degraded_stats['alternate_parses'],
+        'RecipeParseFailures': degraded_stats['parse_failures'],
+        'UnavailableResponses': degraded_stats['unavailable_responses'],
+        'RecipePageBytesRead': recipe_page_stats['bytes_read'],
+        'RecipePagesCutShort': recipe_page_stats['cut_short'],
+        'PicksServedByPrefetch': prefetch_stats['picks_served_by_prefetch']
     }
 
 
-# ----------------------- Search for a recipe -----------------------------
+def start_invocation_metrics():
+    invocation_metrics['started_at'] = time.time()
+    invocation_metrics['timings'] = {}
+    invocation_metrics['counters_before'] = get_counters()
+
+
+def emit_invocation_metrics(event, response, failed=False):
+    """ Print one Embedded Metric Format record for the invocation, which
+    CloudWatch turns into metrics dimensioned by intent.
+    """
+    global cold_start
+    was_cold_start = cold_start
+    cold_start = False
+
+    if random.random() >= METRICS_SAMPLE_RATE:
+        return
+
+    request = event.get('request', {})
+    if 'intent' in request:
+        intent_name = request['intent']['name']
+    else:
+        intent_name = request.get('type', 'Unknown')
+
+    record = {
+        'Intent': intent_name,
+        'ColdStart': int(was_cold_start),
+        'Failed': int(failed),
+        'Duration': (time.time() - invocation_metrics['started_at']) * 1000,
+        'RequestBytes': len(json.dumps(event, separators=(',', ':'))),
+        'ResponseBytes': len(json.dumps(response, separators=(',', ':'))) if response is not None else 0
+    }
+    metric_definitions = [
+        {'Name': 'Duration', 'Unit': 'Milliseconds'},
+        {'Name': 'ColdStart', 'Unit': 'Count'},
+        {'Name': 'Failed', 'Unit': 'Count'},
+        {'Name': 'RequestBytes', 'Unit': 'Bytes'},
+        {'Name': 'ResponseBytes', 'Unit': 'Bytes'}
+    ]
+
+    # Phase timings. Threads the invocation started (see start_thread) add
+    # their time here too, so phases can add up to more than the duration.
+    for phase, seconds in invocation_metrics['timings'].items():
+        record[phase] = seconds * 1000
+        metric_definitions.append({'Name': phase, 'Unit': 'Milliseconds'})
+
+    counters_before = invocation_metrics['counters_before']
+    for counter, value in get_counters().items():
+        record[counter] = value - counters_before.get(counter, 0)
+        metric_definitions.append({'Name': counter, 'Unit': 'Count'})
+
+    record['_aws'] = {
+        'Timestamp': int(time.time() * 1000),
+        'CloudWatchMetrics': [{
+            'Namespace': METRICS_NAMESPACE,
+            'Dimensions': [['Intent']],
+            'Metrics': metric_definitions
+        }]
+    }
+    print(json.dumps(record, separators=(',', ':')))
+
+
+# ----------------------- Saved recipes and progress -----------------------------
+
+# Recipes picked by users are stored once, keyed by a hash of their URL, and
+# shared by everyone who picks them. The progress table only keeps a small
+# item per user: the recipe they're on, their step, and their recent recipes.
+PROGRESS_TABLE_NAME = "skinnytaste"
+RECIPES_TABLE_NAME = "skinnytaste_recipes"
+
+# Progress items expire this long after they were last touched, and stored
+# recipes this long after they were last written or renewed. A stored recipe
+# is renewed whenever it would otherwise expire before a progress item
+# pointing at it. Both tables should have "ExpiresAt" configured as their TTL
+# attribute.
+PROGRESS_RETENTION = 90 * 24 * 60 * 60
+STORED_RECIPE_RETENTION = 180 * 24 * 60 * 60
+
+# How many earlier recipes are kept in a user's History
+RECENT_RECIPES_LIMIT = 5
+
+# Attributes of the progress item that step navigation reads
+PROGRESS_PROJECTION = "RecipeKey, RecipeTitle, CurrentStep, NumberOfSteps"
+
+# Module-level DynamoDB client, created on first use and reused (along with
+# its connection pool) across warm Lambda invocations.
+dynamodb_client = None
+
+# Per-invocation read-through cache of user items, keyed by userId. This is
+# cleared at the start of every lambda_handler call so each handler does at
+# most one read of the user's item. The recipe decoded from the item is kept
+# alongside it, so it's only decoded once too.
+user_item_cache = {}
+user_recipe_cache = {}
+
+# In-process copies of stored recipes, and the digest and expiry of the
+# version in the table as last read or written by this container, both keyed
+# by recipe key.
+stored_recipe_cache = OrderedDict()
+stored_recipe_versions = OrderedDict()
+
+
+def get_dynamodb_client():
+    global dynamodb_client
+    if dynamodb_client is None:
+        import boto3
+
+        dynamodb_client = boto3.client('dynamodb')
+    return dynamodb_client
+
+
+def clear_user_item_cache():
+    user_item_cache.clear()
+    user_recipe_cache.clear()
+
+
+def get_user_item(session, projection=PROGRESS_PROJECTION, consistent_read=True):
+    """ Return the user's progress item, or None if they have none, reading it
+    from the table only if it hasn't already been read (or written) during
+    this invocation. Step navigation only reads the projected attributes; the
+    step must be read back exactly as the previous request wrote it, so reads
+    are strongly consistent unless the caller says otherwise.
+    """
+    user_id = session['user']['userId']
+    if user_id not in user_item_cache:
+        get_item_kwargs = {'ConsistentRead': consistent_read}
+        if projection:
+            get_item_kwargs['ProjectionExpression'] = projection
+        with timed('DynamoDBGet'):
+            get_response = get_dynamodb_client().get_item(
+                TableName=PROGRESS_TABLE_NAME,
+                Key={
+                    "user_id": {
+                        "S": user_id
+                    }
+                },
+                **get_item_kwargs
+            )
+        item = get_response.get('Item')
+
+        # Items from before recipes were stored separately hold the recipe
+        # itself, which the projection leaves out
+        if item is not None and projection and 'RecipeKey' not in item:
+            return get_user_item(session, projection=None, consistent_read=consistent_read)
+
+        user_item_cache[user_id] = item
+    return user_item_cache[user_id]
+
 
 def get_current_recipe_step(session):
-    client = boto3.client('dynamodb')
-    get_response = client.get_item(
-        TableName = "skinnytaste",
-        Key = {
-            "user_id": {
-                "S": session['user']['userId']
-            }
-        }
-    )
-    current_recipe_step = int(get_response['Item']['CurrentStep']['N'])
+    item = get_user_item(session)
+    current_recipe_step = int(item['CurrentStep']['N'])
 
-    # When you get the current recipe step from the database, also double-check to see if the current session knows the recipe instructions and ingredients
-    # If not, get the instructions and ingredients from the database and add to the current session.
+    # Keep the step number in the session in line with the database
     if 'attributes' not in session.keys():
         session['attributes'] = {}
-    
-    if 'recipe_details' not in session['attributes'].keys():
-        recipe_instructions = []
-        recipe_ingredients = []
+    session['attributes']['current_step'] = current_recipe_step
 
-        for instruction in get_response['Item']['RecipeInstructions']['L']:
-            recipe_instructions.append(instruction['S'])
+    # Sessions from before the compact session format carry the whole recipe.
+    # Drop it so it stops being sent back and forth on every request.
+    session['attributes'].pop('recipe_details', None)
 
-        for ingredient in get_response['Item']['RecipeIngredients']['L']:
-            recipe_ingredients.append(ingredient['S'])
+    return current_recipe_step
 
-        session['attributes']['recipe_details'] = {
-            'instructions': [], 
-            'ingredients': []
+
+def get_user_recipe(session):
+    """ Return the user's current recipe, or None if they don't have one. """
+    user_id = session['user']['userId']
+    if user_id not in user_recipe_cache:
+        item = get_user_item(session)
+        if item is None:
+            user_recipe_cache[user_id] = None
+        elif 'RecipeKey' in item:
+            user_recipe_cache[user_id] = get_stored_recipe(item['RecipeKey']['S'])
+        else:
+            user_recipe_cache[user_id] = decode_user_recipe(item)
+    return user_recipe_cache[user_id]
+
+
+def get_user_recipe_title(session):
+    item = get_user_item(session)
+    if 'RecipeTitle' in item:
+        return item['RecipeTitle']['S']
+    return 'your recipe'
+
+
+def decode_user_recipe(item):
+    """ Decode the recipe held in a progress item of the old shape. """
+    if 'Recipe' in item:
+        return Recipe.decode(item['Recipe']['B'])
+
+    # Items saved before the compact format store the recipe as lists of
+    # strings: either pre-rendered step speech or, before that, the raw
+    # instructions.
+    recipe_ingredients = [ingredient['S'] for ingredient in item['RecipeIngredients']['L']]
+    if 'RecipeSteps' in item:
+        return Recipe(recipe_ingredients, [], [step['S'] for step in item['RecipeSteps']['L']], '')
+    recipe_instructions = [instruction['S'] for instruction in item['RecipeInstructions']['L']]
+    return Recipe(recipe_ingredients, recipe_instructions, render_recipe_steps(recipe_instructions), '')
+
+
+def get_number_of_steps(session):
+    return len(get_user_recipe(session).steps_ssml)
+
+
+def get_session_search_results(session_attributes):
+    """ Return the search results saved in the session. Sessions from before
+    the compact session format carry the full result list instead.
+    """
+    if 'search_results' in session_attributes:
+        return [
+            SearchResult(recipe_title, recipe_url)
+            for recipe_title, recipe_url in session_attributes['search_results']
+        ]
+    return [
+        SearchResult(recipe_result['recipe_title'], recipe_result['recipe_url'])
+        for recipe_result in session_attributes['recipe_results']
+    ]
+
+
+def recipe_key_for_url(recipe_url):
+    return hashlib.sha1(normalize_recipe_url(recipe_url).encode('utf-8')).hexdigest()
+
+
+def get_stored_recipe(recipe_key):
+    """ Return a stored recipe, or None if it has expired. Stored recipes
+    only change when their page is scraped again, and any recent version will
+    do, so they're read with eventual consistency and kept in-process.
+    """
+    recipe = lru_get(stored_recipe_cache, recipe_key)
+    if recipe is not None:
+        return recipe
+
+    with timed('DynamoDBGet'):
+        get_response = get_dynamodb_client().get_item(
+            TableName=RECIPES_TABLE_NAME,
+            Key={
+                "recipe_key": {
+                    "S": recipe_key
+                }
+            },
+            ProjectionExpression="Recipe, ExpiresAt",
+            ConsistentRead=False
+        )
+    if 'Item' not in get_response:
+        return None
+
+    item = get_response['Item']
+    recipe = Recipe.decode(item['Recipe']['B'])
+    lru_set(stored_recipe_cache, recipe_key, recipe, RECIPE_CACHE_MAX_SIZE)
+    lru_set(stored_recipe_versions, recipe_key, {
+        'digest': hashlib.sha1(item['Recipe']['B']).hexdigest(),
+        'expires_at': int(item['ExpiresAt']['N'])
+    }, RECIPE_CACHE_MAX_SIZE)
+    return recipe
+
+
+def store_recipe(recipe_key, recipe_url, recipe_details):
+    """ Return the write storing a recipe for every user who picks it, to be
+    run before the write of a progress item pointing at it. Returns None if
+    the same version is already stored and won't expire before the progress
+    item does.
+    """
+    encoded_recipe = recipe_details.encode()
+    digest = hashlib.sha1(encoded_recipe).hexdigest()
+    version = lru_get(stored_recipe_versions, recipe_key)
+    if (version is not None and version['digest'] == digest and
+            version['expires_at'] >= time.time() + PROGRESS_RETENTION):
+        lru_set(stored_recipe_cache, recipe_key, recipe_details, RECIPE_CACHE_MAX_SIZE)
+        return None
+
+    expires_at = int(time.time() + STORED_RECIPE_RETENTION)
+    item = {
+        "recipe_key": {
+            "S": recipe_key
+        },
+        "Url": {
+            "S": recipe_url
+        },
+        "Recipe": {
+            "B": encoded_recipe
+        },
+        "ExpiresAt": {
+            "N": str(expires_at)
         }
+    }
 
-        session['attributes']['recipe_details']['instructions'] = recipe_instructions
-        session['attributes']['recipe_details']['ingredients'] = recipe_ingredients
+    def write():
+        with timed('DynamoDBPut'):
+            get_dynamodb_client().put_item(TableName=RECIPES_TABLE_NAME, Item=item)
+        lru_set(stored_recipe_cache, recipe_key, recipe_details, RECIPE_CACHE_MAX_SIZE)
+        lru_set(stored_recipe_versions, recipe_key, {'digest': digest, 'expires_at': expires_at}, RECIPE_CACHE_MAX_SIZE)
 
-    return current_recipe_step
+    return write
 
 
-def set_current_recipe_step(session, recipe_step, recipe_details):
-    client = boto3.client('dynamodb')
-    recipe_instructions_db = []
-    recipe_ingredients_db = []
+def renew_stored_recipe(recipe_key):
+    """ Return the write pushing back the expiry of a stored recipe that would
+    otherwise expire before a progress item touched now, or None if it
+    doesn't need it. A recipe that has already expired isn't written again.
+    """
+    version = lru_get(stored_recipe_versions, recipe_key)
+    if version is None or version['expires_at'] >= time.time() + PROGRESS_RETENTION:
+        return None
+
+    def write():
+        import botocore.exceptions
+
+        expires_at = int(time.time() + STORED_RECIPE_RETENTION)
+        try:
+            with timed('DynamoDBPut'):
+                get_dynamodb_client().update_item(
+                    TableName=RECIPES_TABLE_NAME,
+                    Key={
+                        "recipe_key": {
+                            "S": recipe_key
+                        }
+                    },
+                    UpdateExpression="SET ExpiresAt = :expires_at",
+                    ConditionExpression="attribute_exists(recipe_key)",
+                    ExpressionAttributeValues={
+                        ":expires_at": {"N": str(expires_at)}
+                    }
+                )
+        except botocore.exceptions.ClientError as e:
+            print("Could not renew stored recipe " + recipe_key + ": " + str(e))
+            return
+        lru_set(stored_recipe_versions, recipe_key, dict(version, expires_at=expires_at), RECIPE_CACHE_MAX_SIZE)
 
-    for instruction in recipe_details['instructions']:
-        recipe_instructions_db.append({
-            "S": instruction
-        })
+    return write
 
-    for ingredient in recipe_details['ingredients']:
-        recipe_ingredients_db.append({
-            "S": ingredient
-        })
 
+def recent_recipes_history(previous_item, recipe_key):
+    """ The History for a user moving to recipe_key: the recipe they were on
+    goes first, followed by their earlier recipes, without recipe_key itself.
+    """
+    history = []
+    if previous_item is not None and 'RecipeKey' in previous_item:
+        history.append({
+            "M": {
+                "RecipeKey": previous_item['RecipeKey'],
+                "RecipeTitle": previous_item['RecipeTitle'],
+                "CurrentStep": previous_item['CurrentStep'],
+                "NumberOfSteps": previous_item['NumberOfSteps'],
+                "LastTouched": previous_item['LastTouched']
+            }
+        })
+        history.extend(previous_item.get('History', {'L': []})['L'])
+
+    recent_recipes = []
+    seen_recipe_keys = set([recipe_key])
+    for entry in history:
+        entry_recipe_key = entry['M']['RecipeKey']['S']
+        if entry_recipe_key not in seen_recipe_keys:
+            seen_recipe_keys.add(entry_recipe_key)
+            recent_recipes.append(entry)
+    return recent_recipes[:RECENT_RECIPES_LIMIT]
+
+
+def save_user_progress(session, recipe_key, recipe_title, recipe_details, recipe_step, previous_item, store=None):
+    """ Move the user to a recipe, keeping the one they were on in their
+    History. store is the write of the recipe itself (see store_recipe); the
+    progress item is only written once it has succeeded, so it never points
+    at a recipe that wasn't stored.
+    """
+    now = int(time.time())
     item = {
         "user_id": {
             "S": session['user']['userId']
         },
+        "RecipeKey": {
+            "S": recipe_key
+        },
+        "RecipeTitle": {
+            "S": recipe_title
+        },
         "CurrentStep": {
             "N": str(recipe_step)
         },
-        "RecipeInstructions": {
-            "L": recipe_instructions_db
+        "NumberOfSteps": {
+            "N": str(len(recipe_details.steps_ssml))
+        },
+        "LastTouched": {
+            "N": str(now)
+        },
+        "ExpiresAt": {
+            "N": str(now + PROGRESS_RETENTION)
         },
-        "RecipeIngredients": {
-            "L": recipe_ingredients_db
+        "History": {
+            "L": recent_recipes_history(previous_item, recipe_key)
         }
     }
-    client.put_item(TableName="skinnytaste", Item=item)
+
+    def write():
+        if store is not None:
+            store()
+        with timed('DynamoDBPut'):
+            get_dynamodb_client().put_item(TableName=PROGRESS_TABLE_NAME, Item=item)
+
+    run_write(write)
+
+    # Write-through: later reads in this invocation see the new item without
+    # another round trip.
+    user_item_cache[session['user']['userId']] = item
+    user_recipe_cache[session['user']['userId']] = recipe_details
+    if 'attributes' in session:
+        session['attributes']['recipe_key'] = recipe_key
+
+
+def save_recipe_to_database(session, recipe_title, recipe_url, recipe_details, previous_item):
+    """ Store the chosen recipe and move the user to its first step, keeping
+    the recipe of their previous_item (the whole progress item, which needn't
+    be read consistently) in their History. Picking a recipe is the only time
+    the recipe itself is written; navigating the steps afterwards only
+    updates the progress item (see set_current_recipe_step).
+    """
+    recipe_key = recipe_key_for_url(recipe_url)
+    save_user_progress(session, recipe_key, recipe_title, recipe_details, 1, previous_item,
+                       store=store_recipe(recipe_key, recipe_url, recipe_details))
+
+
+def migrate_user_item(session, item, recipe_step):
+    """ Move a user's item of the old shape, which holds the recipe itself, to
+    a stored recipe and a progress item. The old items don't record the
+    recipe's URL, so the recipe is stored under a hash of its contents.
+    """
+    recipe_details = decode_user_recipe(item)
+    recipe_key = 'legacy-' + hashlib.sha1(recipe_details.encode()).hexdigest()
+    save_user_progress(session, recipe_key, 'your recipe', recipe_details, recipe_step, None,
+                       store=store_recipe(recipe_key, '', recipe_details))
+    print("Migrated the item of user " + session['user']['userId'])
+
+
+class ProgressConflictError(Exception):
+    """ Raised when the user's progress changed again while a move was being
+    retried.
+    """
+    pass
+
+
+PROGRESS_CONFLICT_SPEECH = '<p>Your place in the recipe just changed on another device, so here\'s where you are.</p>'
+
+
+def set_current_recipe_step(session, recipe_step):
+    """ Move the user to recipe_step, clamped to the bounds of the recipe.
+    Only the step and expiry of the progress item are written, and only if
+    the item is still the one this request read. If it isn't (the read was
+    out of date, or the user moved on another device) the item is read again
+    and the same move applied to it, once. If that fails too, the item is
+    read again and ProgressConflictError raised, with the step it's on in the
+    session. The stored recipe is renewed along with the progress item when it
+    needs to be. Returns False if the user no longer has a recipe.
+    """
+    import botocore.exceptions
+
+    item = get_user_item(session)
+    if 'RecipeKey' not in item:
+        recipe_step = max(1, min(recipe_step, get_number_of_steps(session)))
+        migrate_user_item(session, item, recipe_step)
+        session['attributes']['current_step'] = recipe_step
+        return True
+
+    step_change = recipe_step - int(item['CurrentStep']['N'])
+    for attempt in range(2):
+        recipe_step = max(1, min(int(item['CurrentStep']['N']) + step_change, get_number_of_steps(session)))
+        now = int(time.time())
+        try:
+            with timed('DynamoDBPut'):
+                get_dynamodb_client().update_item(
+                    TableName=PROGRESS_TABLE_NAME,
+                    Key={
+                        "user_id": {
+                            "S": session['user']['userId']
+                        }
+                    },
+                    UpdateExpression="SET CurrentStep = :step, LastTouched = :now, ExpiresAt = :expires_at",
+                    ConditionExpression=("RecipeKey = :recipe_key AND CurrentStep = :current_step "
+                                         "AND NumberOfSteps >= :step"),
+                    ExpressionAttributeValues={
+                        ":step": {"N": str(recipe_step)},
+                        ":recipe_key": item['RecipeKey'],
+                        ":current_step": item['CurrentStep'],
+                        ":now": {"N": str(now)},
+                        ":expires_at": {"N": str(now + PROGRESS_RETENTION)}
+                    }
+                )
+            break
+        except botocore.exceptions.ClientError as e:
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise
+            clear_user_item_cache()
+            item = get_user_item(session)
+            if item is None or 'RecipeKey' not in item or get_user_recipe(session) is None:
+                return False
+            if attempt > 0:
+                get_current_recipe_step(session)
+                raise ProgressConflictError("Progress of user " + session['user']['userId'] + " changed twice")
+
+    item['CurrentStep'] = {"N": str(recipe_step)}
+    session['attributes']['current_step'] = recipe_step
+
+    renewal = renew_stored_recipe(item['RecipeKey']['S'])
+    if renewal is not None:
+        run_write(renewal)
+    return True
 
 
 def read_recipe_instruction(session):
+    """ Return the speech for the user's current step. The speech is rendered
+    once when the recipe is ingested, so this is just a lookup.
+    """
     current_recipe_step = get_current_recipe_step(session)
-    current_recipe_instruction = session['attributes']['recipe_details']['instructions'][current_recipe_step - 1]
-    total_number_of_steps = len(session['attributes']['recipe_details']['instructions'])
+    return get_user_recipe(session).steps_ssml[current_recipe_step - 1]
 
-    current_recipe_step_speech_output = '<p>Step {step_number} of {total_steps}: {instruction} </p>'.format(
-        step_number=current_recipe_step,
-        total_steps=total_number_of_steps,
-        instruction=current_recipe_instruction.replace(' . ', '')
-    )
 
-    if current_recipe_step != total_number_of_steps:
-        current_recipe_step_speech_output += '<p>Say "Alexa, Ask Skinnytaste What\'s the next step?" to continue.</p>'
-    else:
-        current_recipe_step_speech_output += '<p>This was the final step! Happy cooking!</p>'
+# ----------------------- Search for a recipe -----------------------------
+
+def normalize_search_query(search_query):
+    """ Normalize a search string so that "Chicken ", "chicken" and "chicken
+    recipes" all share one cache entry. The sample utterances can leave a
+    trailing "recipe" or "recipes" in the slot value.
+    """
+    query = ' '.join(search_query.lower().split())
+    stripped_query = re.sub(r'\s*\brecipes?$', '', query)
+    return stripped_query or query
+
 
-    return current_recipe_step_speech_output
+# The spelling index saved in the recipe index file (or, for older files,
+# built from its vocabulary), set by get_spelling_index
+spelling_index = None
+
+
+def get_spelling_index():
+    global spelling_index
+    if spelling_index is None:
+        import query_rewrite
+
+        spelling_index = query_rewrite.spelling_index_from_recipe_index(get_recipe_index())
+    return spelling_index
+
+
+def rewrite_search_query(query):
+    """ Correct misheard words and replace synonyms with the site's terms (see
+    query_rewrite), so more searches hit the index and the search cache.
+    """
+    import query_rewrite
+
+    rewritten_query = query_rewrite.rewrite_query(get_spelling_index(), query)
+    if rewritten_query != query:
+        search_cache_stats['rewrites'] += 1
+        print('Rewrote search query "' + query + '" to "' + rewritten_query + '"')
+    return rewritten_query
 
 
 def search_for_recipe(search_query):
-    # Create a list of search results
-    recipe_results = []
+    """ Return the search results for a query, from the offline index or the
+    search cache when possible. Stale entries are served immediately while a
+    background thread fetches fresh results.
+    """
+    return search_rewritten_query(rewrite_search_query(normalize_search_query(search_query)))
+
+
+def search_rewritten_query(query):
+    """ search_for_recipe for a query that's already been normalized and
+    rewritten.
+    """
+    # Answer from the offline index when we have one; the live search is only
+    # a fallback for queries the index knows nothing about.
+    index = get_recipe_index()
+    if index is not None:
+        import recipe_index
+
+        recipe_results = recipe_index.search_index(index, query)
+        if recipe_results:
+            search_cache_stats['index_hits'] += 1
+            return recipe_results
+
+    cache_key = 'search:' + query
+
+    entry = lru_get(search_cache, cache_key)
+    if entry is None and SEARCH_CACHE_SHARED:
+        entry = get_shared_cache_entry(cache_key)
+        if entry is not None:
+            lru_set(search_cache, cache_key, entry, SEARCH_CACHE_MAX_SIZE)
+
+    if entry is None:
+        search_cache_stats['misses'] += 1
+        return refresh_search_results(query)
+
+    search_cache_stats['hits'] += 1
+    if entry['fresh_until'] <= time.time():
+        search_cache_stats['stale_hits'] += 1
+        start_background_search_refresh(query)
+
+    return entry['value']
+
+
+def search_by_ingredients(ingredients_text):
+    """ Return the recipes that make the most of the ingredients the user has
+    (see recipe_index.search_by_ingredients). Without an index that knows the
+    ingredients, this is an ordinary search for them.
+    """
+    query = rewrite_search_query(normalize_search_query(ingredients_text))
+
+    index = get_recipe_index()
+    if index is not None:
+        import recipe_index
+
+        recipe_results = recipe_index.search_by_ingredients(index, query)
+        if recipe_results:
+            search_cache_stats['ingredient_searches'] += 1
+            return recipe_results
+
+    return search_rewritten_query(query)
 
+
+def make_search_entry(recipe_results):
+    return {
+        'value': recipe_results,
+        'fresh_until': time.time() + SEARCH_CACHE_TTL,
+        'etag': None,
+        'last_modified': None
+    }
+
+
+def refresh_search_results(query):
+    recipe_results = scrape_search_results(query)
+
+    entry = make_search_entry(recipe_results)
+    lru_set(search_cache, 'search:' + query, entry, SEARCH_CACHE_MAX_SIZE)
+    if SEARCH_CACHE_SHARED:
+        put_shared_cache_entry('search:' + query, entry)
+
+    return recipe_results
+
+
+def start_background_search_refresh(query):
+    """ Refresh a stale search in a background thread. Lambda freezes the
+    container once the response is returned, so a refresh that doesn't finish
+    in time picks up again on the next warm invocation.
+    """
+    with cache_lock:
+        if query in search_refreshes_in_flight:
+            return
+        search_refreshes_in_flight.add(query)
+
+    def refresh():
+        try:
+            refresh_search_results(query)
+        except Exception as e:
+            print("Background search refresh failed for " + query + ": " + str(e))
+        finally:
+            with cache_lock:
+                search_refreshes_in_flight.discard(query)
+
+    start_thread(refresh)
+
+
+def search_cache_hit_rate():
+    lookups = search_cache_stats['hits'] + search_cache_stats['misses']
+    if lookups == 0:
+        return 0.0
+    return float(search_cache_stats['hits']) / lookups
+
+
+def scrape_search_results(search_query):
     # Scrape the search results page
-    search_results_page = requests.get('http://www.skinnytaste.com/?s={search_query}'.format(
+    search_results_page = fetch_url('{base_url}/?s={search_query}'.format(
+        base_url=SKINNYTASTE_BASE_URL,
         search_query=urllib.quote_plus(search_query))
     )
-    soup = BeautifulSoup(search_results_page.text, 'html.parser')
-    
+    return parse_search_results(search_results_page.text)
+
+
+def parse_search_results(search_results_page_html):
+    if parser_uses_xpath():
+        return parse_search_results_xpath(search_results_page_html)
+
+    # Create a list of search results
+    recipe_results = []
+    soup = make_soup(search_results_page_html, SEARCH_RESULTS_STRAINER)
+
     # Filter the search results page by the actual results
     search_results = soup.find_all('a', {'rel': 'bookmark'})
     for item in search_results:
         if item.h2:
-            recipe_results.append({
-                'recipe_title': item.h2.text,
-                'recipe_url': item['href']
-            })    
+            recipe_results.append(SearchResult(item.h2.text, item['href']))
+
+    return recipe_results
+
+# ----------------------- Fetching pages -----------------------------
+
+SKINNYTASTE_BASE_URL = os.environ.get('SKINNYTASTE_BASE_URL', 'https://www.skinnytaste.com')
+
+# (connect, read) timeouts in seconds for every request to the site, and how
+# many times a failed request is retried with jittered exponential backoff.
+# All the attempts at fetching a page, and reading a streamed page, share a
+# budget of FETCH_TIME_BUDGET seconds, cut short by the request's deadline.
+FETCH_TIMEOUT = (3.05, 5)
+FETCH_MAX_RETRIES = 2
+FETCH_RETRY_BACKOFF = 0.2
+FETCH_TIME_BUDGET = 5.0
+
+# After this many consecutive failed fetches, stop calling the site for
+# CIRCUIT_RESET_TIMEOUT seconds and fail fast instead. After that, a single
+# trial fetch is let through; its success closes the breaker, and its
+# failure keeps it open for another CIRCUIT_RESET_TIMEOUT.
+CIRCUIT_FAILURE_THRESHOLD = 5
+CIRCUIT_RESET_TIMEOUT = 30
+
+# Module-level HTTP session, so connections are kept alive and reused across
+# warm Lambda invocations (and by the prefetch and batch threads). Its pool
+# keeps up to http_pool_size connections to the site; connections beyond
+# that are closed after use, and urllib3 warns "Connection pool is full".
+http_session = None
+http_pool_size = 0
+circuit_breaker = {
+    'failures': 0,
+    'opened_at': None,
+    'trial_fetch': False
+}
+circuit_lock = threading.Lock()
+
+
+class OriginUnavailableError(Exception):
+    """ Raised when the site can't be reached, or the circuit breaker is open. """
+    pass
+
+
+def get_http_session(concurrent_requests=0):
+    """ Return the HTTP session, with a pool big enough for a request's
+    prefetch threads and its own fetch, for the batch workers, and for
+    concurrent_requests threads fetching at once.
+    """
+    global http_session, http_pool_size
+    pool_size = max(PREFETCH_COUNT, BATCH_MAX_WORKERS, concurrent_requests) + 1
+    if http_session is None or http_pool_size < pool_size:
+        import requests
+        import requests.adapters
+
+        # requests only decodes brotli responses when the brotli package is installed
+        try:
+            import brotli
+            accept_encoding = 'gzip, deflate, br'
+        except ImportError:
+            accept_encoding = 'gzip, deflate'
+
+        http_session = requests.Session()
+        http_pool_size = pool_size
+        adapter = requests.adapters.HTTPAdapter(pool_connections=2, pool_maxsize=pool_size)
+        http_session.mount('https://', adapter)
+        http_session.mount('http://', adapter)
+        http_session.headers['Accept-Encoding'] = accept_encoding
+    return http_session
+
+
+def use_https(url):
+    """ Skip the http -> https redirect the site answers plain http with. """
+    parts = urlparse.urlsplit(url)
+    if parts.scheme == 'http' and parts.netloc.lower().endswith('skinnytaste.com'):
+        return urlparse.urlunsplit(('https',) + tuple(parts[1:]))
+    return url
+
+
+def circuit_is_open():
+    opened_at = circuit_breaker['opened_at']
+    return opened_at is not None and (
+        time.time() - opened_at < CIRCUIT_RESET_TIMEOUT or circuit_breaker['trial_fetch'])
+
+
+def start_fetch():
+    """ Whether a fetch may go to the site. While the breaker is half-open,
+    only the first caller gets to make the trial fetch.
+    """
+    with circuit_lock:
+        if circuit_is_open():
+            return False
+        if circuit_breaker['opened_at'] is not None:
+            circuit_breaker['trial_fetch'] = True
+        return True
+
+
+def record_fetch_result(succeeded):
+    """ Update the breaker with the outcome of a fetch. None is a fetch the
+    site answered with a client error: it ends a trial fetch, but counts
+    neither as a success nor as a failure.
+    """
+    with circuit_lock:
+        circuit_breaker['trial_fetch'] = False
+        if succeeded:
+            circuit_breaker['failures'] = 0
+            circuit_breaker['opened_at'] = None
+        elif succeeded is not None:
+            circuit_breaker['failures'] += 1
+            if circuit_breaker['failures'] >= CIRCUIT_FAILURE_THRESHOLD:
+                circuit_breaker['opened_at'] = time.time()
+
+
+def fetch_url(url, headers=None, stream=False):
+    """ GET a page from the site through the shared session, retrying
+    connection errors, timeouts, 429 and 5xx responses. Only a 200, or a 304
+    answering a conditional request, is returned; anything else raises
+    OriginUnavailableError, so error pages are never parsed or cached. Only
+    the errors it retries count towards opening the circuit breaker. With
+    stream, only the headers have been read when it returns, and the time
+    left to read the rest is in the response's fetch_deadline.
+    """
+    import requests.exceptions
+
+    if not start_fetch():
+        raise OriginUnavailableError("Circuit breaker open, not fetching " + url)
+
+    url = use_https(url)
+    conditional = bool(headers) and ('If-None-Match' in headers or 'If-Modified-Since' in headers)
+
+    # Never wait on the site past the budget, or the deadline of the request
+    deadline = time.time() + FETCH_TIME_BUDGET
+    remaining_time = get_remaining_time()
+    if remaining_time is not None:
+        deadline = min(deadline, time.time() + remaining_time)
+
+    error = "out of time"
+    retry_delay = 0
+    for attempt in range(FETCH_MAX_RETRIES + 1):
+        if attempt > 0:
+            retry_delay = max(retry_delay, random.uniform(0, FETCH_RETRY_BACKOFF * 2 ** attempt))
+            if time.time() + retry_delay >= deadline:
+                break
+            time.sleep(retry_delay)
+
+        remaining_time = deadline - time.time()
+        if remaining_time <= 0:
+            break
+        timeout = (min(FETCH_TIMEOUT[0], remaining_time), min(FETCH_TIMEOUT[1], remaining_time))
+
+        retry_delay = 0
+        try:
+            with timed('HttpFetch'):
+                response = get_http_session().get(url, headers=headers, timeout=timeout, stream=stream)
+        except requests.exceptions.RequestException as e:
+            error = str(e)
+            continue
+
+        if response.status_code == 200 or (response.status_code == 304 and conditional):
+            record_fetch_result(True)
+            response.fetch_deadline = deadline
+            return response
+        response.close()
+        error = "HTTP " + str(response.status_code)
+
+        # Other client errors (403, 404, ...) won't go away by asking again,
+        # and don't mean the site is down
+        if response.status_code != 429 and response.status_code < 500:
+            record_fetch_result(None)
+            raise OriginUnavailableError("Fetching " + url + " failed: " + error)
+        if response.headers.get('Retry-After', '').isdigit():
+            retry_delay = int(response.headers['Retry-After'])
+
+    record_fetch_result(False)
+    raise OriginUnavailableError("Fetching " + url + " failed: " + error)
+
+
+# ----------------------- Overlapped I/O -----------------------------
+
+# Alexa gives up on a skill that hasn't answered within 8 seconds. Every
+# request is answered with this much time to spare.
+ALEXA_RESPONSE_TIMEOUT = 8.0
+RESPONSE_SAFETY_MARGIN = 0.5
+
+# State of the current invocation. lambda_handler gives every request a
+# deadline; overlapped_lambda_handler also turns on overlap_io, without which
+# every read and write is synchronous. pending_io holds the threads of the
+# reads and writes the response waits for, and io_errors what the writes among
+# them raised.
+invocation_state = {
+    'overlap_io': False,
+    'deadline': None,
+    'pending_io': [],
+    'io_errors': []
+}
+
+
+def overlapped_lambda_handler(event, context):
+    """ Alternative entry point that overlaps DynamoDB writes whose result
+    the response doesn't depend on (saving the picked recipe, filling the
+    shared cache) with building the response, and reads that don't depend on
+    each other (a user's progress and the recipe they picked) with each
+    other. Responses are the same as lambda_handler's.
+
+    Python 2.7 has no asyncio, so the overlapping is done with threads.
+    """
+    invocation_state['overlap_io'] = True
+    invocation_state['pending_io'] = []
+    invocation_state['io_errors'] = []
+    try:
+        return lambda_handler(event, context)
+    finally:
+        invocation_state['overlap_io'] = False
+
+
+def response_deadline(context):
+    """ When the response has to be ready: before Alexa's timeout, or the
+    function's own if that's sooner, with a safety margin.
+    """
+    time_budget = ALEXA_RESPONSE_TIMEOUT
+    if context is not None and hasattr(context, 'get_remaining_time_in_millis'):
+        time_budget = min(time_budget, context.get_remaining_time_in_millis() / 1000.0)
+    return time.time() + time_budget - RESPONSE_SAFETY_MARGIN
+
+
+def get_remaining_time():
+    """ Seconds left before the request's deadline, or None without one. """
+    if invocation_state['deadline'] is None:
+        return None
+    return invocation_state['deadline'] - time.time()
+
+
+# Thread.join with a timeout sleeps longer and longer between checks on
+# Python 2, and can return well after the thread has finished. Waits the
+# response is held up by check at this interval instead.
+JOIN_POLL_INTERVAL = 0.0005
+
+
+def join_until(thread, deadline):
+    """ Wait for thread to finish, or until the deadline if there is one.
+    Returns whether it finished.
+    """
+    if deadline is None:
+        thread.join()
+        return True
+    while thread.is_alive():
+        remaining_time = deadline - time.time()
+        if remaining_time <= 0:
+            return False
+        time.sleep(min(JOIN_POLL_INTERVAL, remaining_time))
+    return True
+
+
+def run_write(write):
+    """ Run a DynamoDB write. When overlapping I/O it runs on its own thread,
+    and lambda_handler waits for it before returning the response, raising
+    what it raised as the write would have without overlapping.
+    """
+    if not invocation_state['overlap_io']:
+        write()
+        return
+
+    io_errors = invocation_state['io_errors']
+
+    def run():
+        try:
+            write()
+        except Exception as e:
+            print("Background write failed: " + str(e))
+            io_errors.append(e)
+
+    invocation_state['pending_io'].append(start_thread(run))
+
+
+def start_read(read, in_background=True):
+    """ Start a DynamoDB read whose result is needed later in the request,
+    and return a function that waits for its result. When overlapping I/O
+    the read runs on its own thread in the meantime; otherwise (or when
+    in_background is False) it's only made when the result is asked for.
+    Errors are raised when it's asked for.
+    """
+    if not invocation_state['overlap_io'] or not in_background:
+        return read
+
+    result = {}
+
+    def run():
+        try:
+            result['value'] = read()
+        except Exception as e:
+            result['error'] = e
+
+    read_thread = start_thread(run)
+    invocation_state['pending_io'].append(read_thread)
+
+    def wait():
+        read_thread.join()
+        if 'error' in result:
+            raise result['error']
+        return result['value']
+
+    return wait
+
+
+def wait_for_background_io():
+    pending_io = invocation_state['pending_io']
+    while pending_io:
+        io_thread = pending_io.pop()
+        if not join_until(io_thread, invocation_state['deadline']):
+            print("Background read or write still running at the response deadline")
+    io_errors = invocation_state['io_errors']
+    if io_errors:
+        invocation_state['io_errors'] = []
+        raise io_errors[0]
+
+
+# ----------------------- Degraded mode -----------------------------
+
+# When there's a cached copy of a recipe to fall back on, refreshing it from
+# the site gets this many seconds before the cached copy is served instead.
+# The refresh carries on in the background and repairs the cache entry.
+# Searches don't need this: stale search results are always served at once
+# and refreshed in the background (see search_for_recipe).
+STALE_FALLBACK_DEADLINE = float(os.environ.get('STALE_FALLBACK_DEADLINE', '2.5'))
+
+ORIGIN_UNAVAILABLE_SPEECH = ('<p>Sorry, I\'m having trouble reaching Skinnytaste right now. '
+                             'Please try your search again in a minute.</p>')
+RECIPE_UNAVAILABLE_SPEECH = ('<p>Sorry, I couldn\'t get that recipe from Skinnytaste right now. '
+                             'Say "recipe" and then the number of another result, or try again in a minute.</p>')
+STALE_RECIPE_CARD_NOTE = '\n(Skinnytaste.com could not be reached, so this is a saved copy of the recipe.)'
+
+degraded_stats = {
+    'stale_recipes_served': 0,
+    'alternate_parses': 0,
+    'parse_failures': 0,
+    'unavailable_responses': 0
+}
+
+
+class RecipeParseError(Exception):
+    """ Raised when no recipe can be extracted from a page. """
+    pass
+
+
+class DeadlineExceededError(Exception):
+    pass
+
+
+def run_with_deadline(work, time_limit):
+    """ Run work on a background thread and return its result, or raise
+    DeadlineExceededError if it takes longer than time_limit seconds (or the
+    request's deadline, if that's sooner). The work keeps running after that.
+    """
+    remaining_time = get_remaining_time()
+    if remaining_time is not None:
+        time_limit = min(time_limit, remaining_time)
+
+    outcome = {}
+
+    def run():
+        try:
+            outcome['result'] = work()
+        except Exception as e:
+            outcome['error'] = e
+
+    work_thread = start_thread(run)
+
+    if not join_until(work_thread, time.time() + time_limit):
+        raise DeadlineExceededError("Gave up waiting after {0:.1f}s".format(time_limit))
+    if 'error' in outcome:
+        raise outcome['error']
+    return outcome['result']
+
+
+# ----------------------- Cache of scraped pages -----------------------------
+
+# Name of the DynamoDB table shared by all Lambda containers as the second
+# cache tier. Its "ExpiresAt" attribute should be configured as the table TTL.
+CACHE_TABLE_NAME = "skinnytaste_cache"
+
+# How long a cached recipe is served without going back to the site, and how
+# much longer the shared tier keeps it around for conditional revalidation.
+RECIPE_CACHE_MAX_SIZE = 256
+RECIPE_CACHE_TTL = 24 * 60 * 60
+CACHE_RETENTION = 7 * 24 * 60 * 60
+
+# In-process LRU of parsed recipes, keyed by normalized URL. It survives for
+# as long as the Lambda container stays warm.
+recipe_cache = OrderedDict()
+recipe_cache_stats = {
+    'hits': 0,
+    'misses': 0,
+    'refreshes': 0
+}
+
+
+# Search results change more often than recipes, so they're kept for less
+# time. Set SEARCH_CACHE_SHARED to False to keep search results in-process only.
+SEARCH_CACHE_MAX_SIZE = 512
+SEARCH_CACHE_TTL = 60 * 60
+SEARCH_CACHE_SHARED = True
+
+search_cache = OrderedDict()
+search_cache_stats = {
+    'hits': 0,
+    'misses': 0,
+    'stale_hits': 0,
+    'index_hits': 0,
+    'rewrites': 0,
+    'ingredient_searches': 0
+}
+search_refreshes_in_flight = set()
+
+# Background refreshes update the caches from another thread.
+cache_lock = threading.Lock()
+
+
+def lru_get(cache, key):
+    with cache_lock:
+        entry = cache.pop(key, None)
+        if entry is not None:
+            cache[key] = entry
+        return entry
+
+
+def lru_set(cache, key, entry, max_size):
+    with cache_lock:
+        cache.pop(key, None)
+        cache[key] = entry
+        while len(cache) > max_size:
+            cache.popitem(last=False)
+
+
+def get_shared_cache_entry(cache_key):
+    """ Read an entry from the shared DynamoDB cache tier. Returns None if the
+    entry doesn't exist or the table can't be read.
+    """
+    import botocore.exceptions
+
+    try:
+        with timed('DynamoDBGet'):
+            get_response = get_dynamodb_client().get_item(
+                TableName=CACHE_TABLE_NAME,
+                Key={
+                    "cache_key": {
+                        "S": cache_key
+                    }
+                }
+            )
+    except botocore.exceptions.ClientError as e:
+        print("Shared cache read failed for " + cache_key + ": " + str(e))
+        return None
+
+    if 'Item' not in get_response:
+        return None
+
+    item = get_response['Item']
+
+    # Entries written before values were stored in the compact binary format
+    # are treated as missing and get replaced.
+    if 'Blob' not in item:
+        return None
+
+    return {
+        'value': decode_cache_value(cache_key, item['Blob']['B']),
+        'fresh_until': float(item['FreshUntil']['N']),
+        'etag': item['ETag']['S'] if 'ETag' in item else None,
+        'last_modified': item['LastModified']['S'] if 'LastModified' in item else None
+    }
+
+
+def encode_cache_value(cache_key, value):
+    if cache_key.startswith('recipe:'):
+        return value.encode()
+    return encode_search_results(value)
+
+
+def decode_cache_value(cache_key, data):
+    if cache_key.startswith('recipe:'):
+        return Recipe.decode(data)
+    return decode_search_results(data)
+
+
+def build_shared_cache_item(cache_key, entry):
+    item = {
+        "cache_key": {
+            "S": cache_key
+        },
+        "Blob": {
+            "B": encode_cache_value(cache_key, entry['value'])
+        },
+        "FreshUntil": {
+            "N": str(entry['fresh_until'])
+        },
+        "ExpiresAt": {
+            "N": str(int(entry['fresh_until'] + CACHE_RETENTION))
+        }
+    }
+    if entry.get('etag'):
+        item['ETag'] = {"S": entry['etag']}
+    if entry.get('last_modified'):
+        item['LastModified'] = {"S": entry['last_modified']}
+    return item
+
+
+def put_shared_cache_entry(cache_key, entry):
+    import botocore.exceptions
+
+    item = build_shared_cache_item(cache_key, entry)
+
+    def write():
+        try:
+            with timed('DynamoDBPut'):
+                get_dynamodb_client().put_item(TableName=CACHE_TABLE_NAME, Item=item)
+        except botocore.exceptions.ClientError as e:
+            print("Shared cache write failed for " + cache_key + ": " + str(e))
+
+    run_write(write)
+
+
+def put_shared_cache_entries(entries):
+    """ Write many cache entries ({cache_key: entry}) to the shared tier with
+    batch_write_item, 25 items per call, retrying unprocessed items.
+    """
+    import botocore.exceptions
+
+    put_requests = [
+        {'PutRequest': {'Item': build_shared_cache_item(cache_key, entry)}}
+        for cache_key, entry in entries.items()
+    ]
+
+    for batch_start in range(0, len(put_requests), BATCH_WRITE_SIZE):
+        request_items = {CACHE_TABLE_NAME: put_requests[batch_start:batch_start + BATCH_WRITE_SIZE]}
+        for attempt in range(BATCH_WRITE_MAX_RETRIES + 1):
+            if attempt > 0:
+                time.sleep(random.uniform(0, FETCH_RETRY_BACKOFF * 2 ** attempt))
+            try:
+                with timed('DynamoDBPut'):
+                    batch_response = get_dynamodb_client().batch_write_item(RequestItems=request_items)
+            except botocore.exceptions.ClientError as e:
+                print("Shared cache batch write failed: " + str(e))
+                break
+
+            request_items = batch_response.get('UnprocessedItems', {})
+            if not request_items:
+                break
+        else:
+            print("Gave up on {count} unprocessed cache writes".format(
+                count=len(request_items.get(CACHE_TABLE_NAME, []))))
+
+
+# Offline recipe index built by recipe_index.py. Either a local path (by
+# default the file deployed next to this module) or an s3://bucket/key URL.
+RECIPE_INDEX_PATH = os.environ.get(
+    'RECIPE_INDEX_PATH',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'recipe_index.json.gz')
+)
+
+# Loaded once per container by get_recipe_index
+loaded_recipe_index = None
+recipe_index_loaded = False
+
+
+def get_recipe_index():
+    """ Return the offline recipe index, or None if there isn't one. """
+    global loaded_recipe_index, recipe_index_loaded
+    if recipe_index_loaded:
+        return loaded_recipe_index
+    recipe_index_loaded = True
+
+    import recipe_index
+
+    index_path = RECIPE_INDEX_PATH
+    try:
+        if index_path.startswith('s3://'):
+            import boto3
+
+            bucket, key = index_path[len('s3://'):].split('/', 1)
+            index_path = '/tmp/recipe_index.json.gz'
+            boto3.client('s3').download_file(bucket, key, index_path)
+        if os.path.exists(index_path):
+            loaded_recipe_index = recipe_index.load_index(index_path)
+    except Exception as e:
+        print("Could not load recipe index from " + RECIPE_INDEX_PATH + ": " + str(e))
+
+    return loaded_recipe_index
+
+
+def normalize_recipe_url(recipe_url):
+    """ Normalize a recipe URL so that the same page always maps to the same
+    cache key, regardless of scheme, "www.", query string or trailing slash.
+    """
+    parts = urlparse.urlsplit(recipe_url.strip())
+    netloc = parts.netloc.lower()
+    if netloc.startswith('www.'):
+        netloc = netloc[len('www.'):]
+    path = parts.path.rstrip('/') + '/'
+    return netloc + path
+
+
+# ----------------------- Batch fetching -----------------------------
+
+# Limits for warming the caches in bulk: how many pages are fetched at once,
+# and how many requests per second each host gets.
+BATCH_MAX_WORKERS = 8
+BATCH_REQUESTS_PER_SECOND = 4.0
+
+# batch_write_item takes at most 25 items per call
+BATCH_WRITE_SIZE = 25
+BATCH_WRITE_MAX_RETRIES = 3
+
+# Earliest time the next request to each host may start
+host_next_request_at = {}
+host_rate_lock = threading.Lock()
+
+
+def wait_for_host_slot(url, requests_per_second):
+    host = urlparse.urlsplit(url).netloc.lower()
+    with host_rate_lock:
+        now = time.time()
+        request_at = max(now, host_next_request_at.get(host, now))
+        host_next_request_at[host] = request_at + 1.0 / requests_per_second
+    if request_at > now:
+        time.sleep(request_at - now)
+
+
+def print_batch_progress(done, total, item, error):
+    print("[{done}/{total}] {item}{error}".format(
+        done=done,
+        total=total,
+        item=item,
+        error=" failed: " + str(error) if error is not None else ""
+    ))
+
+
+def run_batch(items, work, max_workers, progress):
+    """ Call work(item) for every item on up to max_workers threads. Returns
+    {item: result}, with the exception as the result for failed items.
+    """
+    import Queue
+
+    # Every worker may be fetching at once
+    get_http_session(max_workers)
+
+    work_queue = Queue.Queue()
+    for item in items:
+        work_queue.put(item)
+
+    results = {}
+    progress_lock = threading.Lock()
+
+    def worker():
+        while True:
+            try:
+                item = work_queue.get_nowait()
+            except Queue.Empty:
+                return
+
+            error = None
+            try:
+                results[item] = work(item)
+            except Exception as e:
+                results[item] = error = e
+
+            with progress_lock:
+                if progress is not None:
+                    progress(len(results), len(items), item, error)
+
+    worker_threads = [threading.Thread(target=worker) for _ in range(min(max_workers, len(items)))]
+    for worker_thread in worker_threads:
+        worker_thread.start()
+    for worker_thread in worker_threads:
+        worker_thread.join()
+
+    return results
+
+
+def fetch_recipes_batch(recipe_urls, max_workers=BATCH_MAX_WORKERS,
+                        requests_per_second=BATCH_REQUESTS_PER_SECOND, progress=print_batch_progress):
+    """ Scrape many recipes at once and put them in both cache tiers, writing
+    the shared tier in bulk. Returns {recipe_url: recipe_details}, with the
+    exception in place of the recipe for pages that failed.
+    """
+    def fetch(recipe_url):
+        wait_for_host_slot(recipe_url, requests_per_second)
+        return fetch_recipe_entry(recipe_url)
+
+    results = run_batch(sorted(set(recipe_urls)), fetch, max_workers, progress)
+
+    entries = {}
+    recipes = {}
+    for recipe_url, entry in results.items():
+        if isinstance(entry, Exception):
+            recipes[recipe_url] = entry
+            continue
+        cache_key = 'recipe:' + normalize_recipe_url(recipe_url)
+        lru_set(recipe_cache, cache_key, entry, RECIPE_CACHE_MAX_SIZE)
+        entries[cache_key] = entry
+        recipes[recipe_url] = entry['value']
+
+    put_shared_cache_entries(entries)
+    return recipes
+
+
+def search_queries_batch(search_queries, max_workers=BATCH_MAX_WORKERS,
+                         requests_per_second=BATCH_REQUESTS_PER_SECOND, progress=print_batch_progress):
+    """ Run many searches at once and put the results in the search caches.
+    Returns {normalized and rewritten query: recipe_results}, with the
+    exception in place of the results for searches that failed.
+    """
+    def search(query):
+        wait_for_host_slot(SKINNYTASTE_BASE_URL, requests_per_second)
+        return scrape_search_results(query)
+
+    queries = sorted(set(rewrite_search_query(normalize_search_query(search_query)) for search_query in search_queries))
+    results = run_batch(queries, search, max_workers, progress)
+
+    entries = {}
+    for query, recipe_results in results.items():
+        if isinstance(recipe_results, Exception):
+            continue
+        entry = make_search_entry(recipe_results)
+        lru_set(search_cache, 'search:' + query, entry, SEARCH_CACHE_MAX_SIZE)
+        entries['search:' + query] = entry
+
+    if SEARCH_CACHE_SHARED:
+        put_shared_cache_entries(entries)
+    return results
+
+
+# ----------------------- HTML parsing -----------------------------
+
+# Parser backends for scraped pages, as (BeautifulSoup tree builder, whether to
+# only build the parts of the tree we read). "lxml-xpath" doesn't use
+# BeautifulSoup at all: it parses with lxml.html and picks out what we read
+# with XPath. Pick one with the HTML_PARSER_BACKEND environment variable. The
+# lxml backends need the lxml package deployed with the function; without it
+# we fall back to html.parser.
+HTML_PARSER_BACKENDS = {
+    'html.parser': ('html.parser', False),
+    'lxml': ('lxml', False),
+    'strainer': ('html.parser', True),
+    'lxml-strainer': ('lxml', True),
+    'lxml-xpath': ('lxml.html', False)
+}
+
+
+def in_recipe_card(name, attrs):
+    classes = attrs.get('class') or ''
+    if not isinstance(classes, list):
+        classes = classes.split()
+    return name == 'h1' or 'ingredient' in classes or 'instructions' in classes
+
+
+# The only parts of each page we read: search result links, the title and
+# recipe card of new-layout recipes, and the post body of legacy recipes.
+# They're SoupStrainer arguments, so bs4 isn't needed until a page is parsed.
+SEARCH_RESULTS_STRAINER = {'name': 'a', 'rel': 'bookmark'}
+RECIPE_CARD_STRAINER = {'name': in_recipe_card}
+LEGACY_POST_STRAINER = {'name': 'div', 'class_': 'post'}
+
+
+def resolve_parser_backend(backend_name):
+    if backend_name not in HTML_PARSER_BACKENDS:
+        print("Unknown HTML parser backend " + backend_name + ", using html.parser")
+        backend_name = 'html.parser'
+
+    tree_builder, restrict_tree = HTML_PARSER_BACKENDS[backend_name]
+    if tree_builder.startswith('lxml'):
+        try:
+            import lxml.html
+        except ImportError:
+            print("lxml is not installed, using html.parser")
+            tree_builder = 'html.parser'
+
+    return tree_builder, restrict_tree
+
+
+# Resolved on first use by get_parser_backend
+html_parser_backend = None
+
+
+def get_parser_backend():
+    global html_parser_backend
+    if html_parser_backend is None:
+        html_parser_backend = resolve_parser_backend(os.environ.get('HTML_PARSER_BACKEND', 'html.parser'))
+    return html_parser_backend
+
+
+def parser_restricts_tree():
+    return get_parser_backend()[1]
+
+
+def parser_uses_xpath():
+    return get_parser_backend()[0] == 'lxml.html'
+
+
+def make_soup(markup, strainer):
+    """ Parse markup with the configured backend. The strainer limits the tree
+    to the elements we need when the backend is a restricted one.
+    """
+    from bs4 import BeautifulSoup, SoupStrainer
+
+    tree_builder, restrict_tree = get_parser_backend()
+    with timed('HtmlParse'):
+        if restrict_tree:
+            return BeautifulSoup(markup, tree_builder, parse_only=SoupStrainer(**strainer))
+        return BeautifulSoup(markup, tree_builder)
+
+
+# XPath for what parse_search_results and parse_recipe_details read, matching
+# class and rel values the way BeautifulSoup does: as one of the
+# whitespace-separated words of the attribute.
+def has_word(attribute, word):
+    return "contains(concat(' ', normalize-space(@{0}), ' '), ' {1} ')".format(attribute, word)
 
+
+SEARCH_RESULT_LINKS_XPATH = '//a[{0}]'.format(has_word('rel', 'bookmark'))
+RECIPE_INGREDIENTS_XPATH = '//*[{0}]'.format(has_word('class', 'ingredient'))
+RECIPE_INSTRUCTIONS_XPATH = '(//*[{0}])[1]'.format(has_word('class', 'instructions'))
+LEGACY_POST_XPATH = '(//div[{0}])[1]'.format(has_word('class', 'post'))
+
+
+def parse_document(markup):
+    """ Parse markup with lxml.html for the lxml-xpath backend. """
+    import lxml.etree
+    import lxml.html
+
+    with timed('HtmlParse'):
+        try:
+            return lxml.html.document_fromstring(markup)
+        except lxml.etree.ParserError:
+            # An empty page
+            return lxml.html.document_fromstring('<html></html>')
+
+
+def element_text(element):
+    # A plain unicode string, like BeautifulSoup's .text, rather than lxml's
+    # string type that keeps the whole tree alive
+    return unicode(element.text_content())
+
+
+def first_element(elements):
+    return elements[0] if elements else None
+
+
+def text_without_link(element):
+    """ The element's text, minus the text of its first link, the way
+    parse_recipe_details drops the links in some instructions.
+    """
+    link = first_element(element.xpath('.//a'))
+    if link is not None:
+        return element_text(element).replace(element_text(link), '')
+    return element_text(element)
+
+
+def parse_search_results_xpath(search_results_page_html):
+    recipe_results = []
+    for link in parse_document(search_results_page_html).xpath(SEARCH_RESULT_LINKS_XPATH):
+        heading = first_element(link.xpath('.//h2'))
+        if heading is not None:
+            recipe_results.append(SearchResult(element_text(heading), unicode(link.get('href'))))
     return recipe_results
 
+
+def parse_recipe_details_xpath(recipe_page_html):
+    """ parse_recipe_details for the lxml-xpath backend. """
+    document = parse_document(recipe_page_html)
+    title_element = first_element(document.xpath('(//h1)[1]'))
+    recipe_details = {
+        'title': element_text(title_element).strip() if title_element is not None else None,
+        'ingredients': [element_text(element) for element in document.xpath(RECIPE_INGREDIENTS_XPATH)],
+        'instructions': []
+    }
+
+    if recipe_details['ingredients']:
+        instructions = first_element(document.xpath(RECIPE_INSTRUCTIONS_XPATH))
+        if instructions is None:
+            raise AttributeError("No instructions in the recipe card")
+        recipe_details['instructions'] = [text_without_link(element) for element in instructions.xpath('.//li')]
+        return recipe_details
+
+    # A legacy recipe: the list items of the post are the ingredients, and
+    # its paragraphs from "Directions:" up to the newsletter sign-up the
+    # instructions
+    post = document.xpath(LEGACY_POST_XPATH)[0]
+    recipe_details['ingredients'] = [element_text(element) for element in post.xpath('.//li')]
+    instructions_capture_flag = False
+    for paragraph in post.xpath('.//p'):
+        paragraph_text = element_text(paragraph)
+        if 'Get new free recipes and exclusive content delivered right to your inbox:' in paragraph_text:
+            instructions_capture_flag = False
+        if instructions_capture_flag:
+            recipe_details['instructions'].append(text_without_link(paragraph))
+        if 'Directions:' in paragraph_text:
+            instructions_capture_flag = True
+    return recipe_details
+
+
 # ----------------------- Get the details of a recipe -----------------------------
 
+def recipe_is_cached(recipe_url):
+    """ Whether get_recipe_details would answer from the in-process cache. """
+    entry = recipe_cache.get('recipe:' + normalize_recipe_url(recipe_url))
+    return entry is not None and entry['fresh_until'] > time.time()
+
+
 def get_recipe_details(recipe_title, recipe_url):
+    """ Return the ingredients and instructions for a recipe. Parsed recipes
+    are cached in-process and in the shared cache table; once an entry goes
+    stale it's revalidated against the site with ETag/Last-Modified. If that
+    fails or takes too long, the stale entry is served.
+    """
+    cache_key = 'recipe:' + normalize_recipe_url(recipe_url)
+
+    entry = lru_get(recipe_cache, cache_key)
+    if entry is None:
+        entry = get_shared_cache_entry(cache_key)
+        if entry is not None:
+            lru_set(recipe_cache, cache_key, entry, RECIPE_CACHE_MAX_SIZE)
+
+    if entry is not None and entry['fresh_until'] > time.time():
+        recipe_cache_stats['hits'] += 1
+        return entry['value']
+
+    if entry is None:
+        recipe_cache_stats['misses'] += 1
+        return refresh_recipe_entry(cache_key, recipe_url, None)['value']
+
+    recipe_cache_stats['refreshes'] += 1
+    try:
+        return run_with_deadline(
+            lambda: refresh_recipe_entry(cache_key, recipe_url, entry),
+            STALE_FALLBACK_DEADLINE
+        )['value']
+    except (DeadlineExceededError, OriginUnavailableError, RecipeParseError) as e:
+        print("Serving stale recipe for " + recipe_url + ": " + str(e))
+        degraded_stats['stale_recipes_served'] += 1
+        return entry['value']
+
+
+def refresh_recipe_entry(cache_key, recipe_url, entry):
+    entry = fetch_recipe_entry(recipe_url, entry)
+    lru_set(recipe_cache, cache_key, entry, RECIPE_CACHE_MAX_SIZE)
+    put_shared_cache_entry(cache_key, entry)
+    return entry
+
+
+def fetch_recipe_entry(recipe_url, entry=None):
+    """ Scrape and normalize a recipe page into a cache entry. If there's an
+    expired entry, the site is asked to skip the body if it hasn't changed.
+    """
+    request_headers = {}
+    if entry is not None:
+        if entry.get('etag'):
+            request_headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            request_headers['If-Modified-Since'] = entry['last_modified']
+
+    recipe_page = fetch_url(recipe_url, headers=request_headers, stream=STREAM_RECIPE_PAGES)
+    if entry is not None and recipe_page.status_code == 304:
+        recipe_page.close()
+        entry = dict(entry)
+    else:
+        entry = {
+            'value': normalize_recipe_details(extract_recipe_details(read_recipe_page(recipe_page))),
+            'etag': None,
+            'last_modified': None
+        }
+
+    entry['fresh_until'] = time.time() + RECIPE_CACHE_TTL
+    entry['etag'] = recipe_page.headers.get('ETag', entry['etag'])
+    entry['last_modified'] = recipe_page.headers.get('Last-Modified', entry['last_modified'])
+    return entry
+
+
+# ----------------------- Reading recipe pages -----------------------------
+
+# Recipe pages are downloaded in chunks and only up to the end of the recipe;
+# the comments and related posts after it are never read. Set
+# STREAM_RECIPE_PAGES=0 to always read whole pages.
+STREAM_RECIPE_PAGES = os.environ.get('STREAM_RECIPE_PAGES', '1') == '1'
+RECIPE_PAGE_CHUNK_SIZE = 16 * 1024
+
+# Legacy recipes end with the newsletter sign-up that follows "Directions:"
+LEGACY_RECIPE_END_MARKER = 'Get new free recipes and exclusive content delivered right to your inbox:'
+
+VOID_ELEMENTS = frozenset([
+    'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link', 'meta', 'param', 'source', 'track', 'wbr'
+])
+
+recipe_page_stats = {
+    'bytes_read': 0,
+    'cut_short': 0
+}
+
+
+class RecipeEndDetector(HTMLParser.HTMLParser):
+    """ Incremental parser fed a recipe page as it downloads. Sets done once
+    everything parse_recipe_details reads has gone by: the end of the
+    .instructions element, or the end marker of a legacy recipe.
+    """
+
+    def __init__(self):
+        HTMLParser.HTMLParser.__init__(self)
+        self.instructions_depth = 0
+        self.text = ''
+        self.done = False
+
+    def handle_starttag(self, tag, attrs):
+        self.text = ''
+        if tag in VOID_ELEMENTS:
+            return
+        if self.instructions_depth:
+            self.instructions_depth += 1
+        elif 'instructions' in (dict(attrs).get('class') or '').split():
+            self.instructions_depth = 1
+
+    def handle_endtag(self, tag):
+        self.text = ''
+        if self.instructions_depth and tag not in VOID_ELEMENTS:
+            self.instructions_depth -= 1
+            if not self.instructions_depth:
+                self.done = True
+
+    def handle_data(self, data):
+        # Text can arrive in pieces when it's split across chunks
+        self.text += data
+        if LEGACY_RECIPE_END_MARKER in self.text:
+            self.done = True
+
+
+def read_recipe_page(recipe_page):
+    """ Return the HTML of a recipe page fetched with fetch_url. A streamed
+    page is only read up to the end of the recipe, then the connection is
+    closed so the rest of it is never downloaded.
+    """
+    if not STREAM_RECIPE_PAGES:
+        recipe_page_stats['bytes_read'] += len(recipe_page.content)
+        return recipe_page.text
+
+    import requests.exceptions
+
+    detector = RecipeEndDetector()
+    chunks = []
+    try:
+        with timed('HttpFetch'):
+            for chunk in recipe_page.iter_content(RECIPE_PAGE_CHUNK_SIZE):
+                if time.time() > getattr(recipe_page, 'fetch_deadline', float('inf')):
+                    raise OriginUnavailableError("Reading " + recipe_page.url + " ran out of time")
+                chunks.append(chunk)
+                recipe_page_stats['bytes_read'] += len(chunk)
+                if detector is not None:
+                    try:
+                        detector.feed(chunk)
+                    except HTMLParser.HTMLParseError:
+                        # Markup the detector can't follow; read the whole page
+                        detector = None
+                if detector is not None and detector.done:
+                    recipe_page_stats['cut_short'] += 1
+                    break
+    except requests.exceptions.RequestException as e:
+        raise OriginUnavailableError("Reading " + recipe_page.url + " failed: " + str(e))
+    finally:
+        recipe_page.close()
+
+    return ''.join(chunks).decode(recipe_page.encoding or 'utf-8', 'replace')
+
+
+# Steps longer than this many characters are split at sentence boundaries, so
+# Alexa reads them in manageable pieces.
+MAX_STEP_LENGTH = 400
+
+
+def clean_text(text):
+    return ' '.join(text.split())
+
+
+def split_long_step(instruction):
+    if len(instruction) <= MAX_STEP_LENGTH:
+        return [instruction]
+
+    steps = []
+    current_step = ''
+    for sentence in re.split(r'(?<=[.!?])\s+', instruction):
+        if current_step and len(current_step) + 1 + len(sentence) > MAX_STEP_LENGTH:
+            steps.append(current_step)
+            current_step = sentence
+        else:
+            current_step = (current_step + ' ' + sentence).strip()
+    if current_step:
+        steps.append(current_step)
+    return steps
+
+
+def render_recipe_steps(recipe_instructions):
+    """ Render the speech Alexa reads out for each step of a recipe. """
+    total_number_of_steps = len(recipe_instructions)
+    steps_ssml = []
+    for step_number, instruction in enumerate(recipe_instructions, 1):
+        step_ssml = '<p>Step {step_number} of {total_steps}: {instruction} </p>'.format(
+            step_number=step_number,
+            total_steps=total_number_of_steps,
+            instruction=instruction.replace(' . ', '')
+        )
+
+        if step_number != total_number_of_steps:
+            step_ssml += '<p>Say "Alexa, Ask Skinnytaste What\'s the next step?" to continue.</p>'
+        else:
+            step_ssml += '<p>This was the final step! Happy cooking!</p>'
+        steps_ssml.append(step_ssml)
+
+    return steps_ssml
+
+
+def normalize_recipe_details(recipe_details):
+    """ Turn a scraped recipe into a Recipe, once, when it's ingested: collapse
+    whitespace, split over-long steps, and pre-render the speech for each step
+    and the text of the recipe card.
+    """
+    recipe_instructions = []
+    for instruction in recipe_details['instructions']:
+        instruction = clean_text(instruction)
+        if instruction:
+            recipe_instructions.extend(split_long_step(instruction))
+
+    card_text = ''
+    for step_number, instruction in enumerate(recipe_instructions, 1):
+        card_text += 'Step {step_number}: {instruction}\n'.format(
+            step_number=step_number,
+            instruction=instruction
+        )
+
+    return Recipe(
+        [clean_text(ingredient) for ingredient in recipe_details['ingredients']],
+        recipe_instructions,
+        render_recipe_steps(recipe_instructions),
+        card_text
+    )
+
+
+# Prefetch of the recipes behind the top search results. It runs in the
+# background, without holding up the search response. Lambda freezes the
+# container once the response is sent, so a prefetch that isn't done by then
+# carries on when the next request, usually the pick, thaws it. A pick of a
+# recipe still being prefetched waits for that prefetch instead of fetching
+# the recipe again.
+PREFETCH_COUNT = 3
+
+# The prefetch threads started, by recipe cache key. A thread removes itself
+# when it's done, unless it finished before it was added.
+prefetches_in_flight = {}
+
+prefetch_stats = {
+    'started': 0,
+    'completed': 0,
+    'picks': 0,
+    'picks_served_by_prefetch': 0
+}
+
+
+def prefetch_recipe_details(recipe_results):
+    """ Start getting the recipes of the top results into the cache, skipping
+    those already fresh in this container's cache or being prefetched. Returns
+    the numbers (counting from 1) of the results being prefetched.
+    """
+    def prefetch(cache_key, recipe_title, recipe_url):
+        try:
+            get_recipe_details(recipe_title, recipe_url)
+            prefetch_stats['completed'] += 1
+        except Exception as e:
+            print("Prefetch failed for " + recipe_url + ": " + str(e))
+        finally:
+            prefetches_in_flight.pop(cache_key, None)
+
+    prefetched_results = []
+    for result_number, recipe_result in enumerate(recipe_results[:PREFETCH_COUNT], 1):
+        cache_key = 'recipe:' + normalize_recipe_url(recipe_result.url)
+        prefetch_thread = prefetches_in_flight.get(cache_key)
+        if (prefetch_thread is not None and prefetch_thread.is_alive()) or recipe_is_cached(recipe_result.url):
+            continue
+        prefetches_in_flight[cache_key] = start_thread(prefetch, cache_key, recipe_result.title, recipe_result.url)
+        prefetched_results.append(result_number)
+        prefetch_stats['started'] += 1
+    return prefetched_results
+
+
+def wait_for_prefetch(recipe_url):
+    """ Wait, up to the request's deadline, for a prefetch of the recipe still
+    running in this container.
+    """
+    prefetch_thread = prefetches_in_flight.get('recipe:' + normalize_recipe_url(recipe_url))
+    if prefetch_thread is not None:
+        join_until(prefetch_thread, invocation_state['deadline'])
+
+
+def record_pick_prefetch_outcome(session_attributes, recipe_number, served_from_cache):
+    """ Count how often the recipe for a PickRecipeNumber turn was already in
+    the cache because the prefetch after the search fetched it.
+    """
+    prefetch_stats['picks'] += 1
+    if served_from_cache and recipe_number in session_attributes.get('prefetched_results', []):
+        prefetch_stats['picks_served_by_prefetch'] += 1
+
+
+def parse_recipe_details(recipe_page_html):
+    if parser_uses_xpath():
+        return parse_recipe_details_xpath(recipe_page_html)
+
     # Create the recipe details dictionary
     recipe_details = {
+        'title': None,
         'ingredients': [],
         'instructions': []
     }
 
-    # Scrape the recipe page
-    recipe_page = requests.get(recipe_url)
-    soup = BeautifulSoup(recipe_page.text, 'html.parser')
+    soup = make_soup(recipe_page_html, RECIPE_CARD_STRAINER)
+    if soup.h1 is not None:
+        recipe_details['title'] = soup.h1.get_text().strip()
 
     # Scrape ingredients from the recipe page, add to recipe details
     ingredients_elements = soup.find_all(class_='ingredient')
@@ -498,6 +2582,8 @@ def get_recipe_details(recipe_title, recipe_url):
                 recipe_details['instructions'].append(instructions_item.text)
     else:
         # The recipe is an older recipe and ingredients and instructions aren't properly labeled, so we'll have to scrape a different way
+        if parser_restricts_tree():
+            soup = make_soup(recipe_page_html, LEGACY_POST_STRAINER)
         content = soup.find_all('div', class_='post')
 
         # Capture the ingredients
@@ -527,7 +2613,114 @@ def get_recipe_details(recipe_title, recipe_url):
     return recipe_details
 
 
+def extract_recipe_details(recipe_page_html):
+    """ Scrape a recipe page with parse_recipe_details, falling back to the
+    page's schema.org JSON-LD when the markup isn't laid out the way it
+    expects. Raises RecipeParseError if neither finds any instructions.
+    """
+    try:
+        recipe_details = parse_recipe_details(recipe_page_html)
+        if recipe_details['instructions']:
+            return recipe_details
+    except (IndexError, AttributeError) as e:
+        print("Recipe markup not recognized: " + repr(e))
+
+    recipe_details = parse_recipe_json_ld(recipe_page_html)
+    if recipe_details is None or not recipe_details['instructions']:
+        degraded_stats['parse_failures'] += 1
+        raise RecipeParseError("No recipe found in the page")
+
+    degraded_stats['alternate_parses'] += 1
+    return recipe_details
+
+
+JSON_LD_PATTERN = re.compile(
+    r'<script[^>]*type=["\']application/ld\+json["\'][^>]*>(.*?)</script>', re.DOTALL | re.IGNORECASE)
+TAG_PATTERN = re.compile(r'<[^>]+>')
+
+
+def parse_recipe_json_ld(recipe_page_html):
+    """ Return the title, ingredients and instructions from the schema.org
+    Recipe in the page's JSON-LD, or None if it has none.
+    """
+    for json_ld in JSON_LD_PATTERN.findall(recipe_page_html):
+        try:
+            data = json.loads(json_ld)
+        except ValueError:
+            continue
+
+        recipe = find_json_ld_recipe(data)
+        if recipe is not None:
+            return {
+                'title': json_ld_text(recipe['name']).strip() if recipe.get('name') else None,
+                'ingredients': [json_ld_text(ingredient) for ingredient in recipe.get('recipeIngredient', [])],
+                'instructions': json_ld_instructions(recipe.get('recipeInstructions', []))
+            }
+    return None
+
+
+def find_json_ld_recipe(data):
+    if isinstance(data, list):
+        for element in data:
+            recipe = find_json_ld_recipe(element)
+            if recipe is not None:
+                return recipe
+    elif isinstance(data, dict):
+        types = data.get('@type')
+        if types == 'Recipe' or (isinstance(types, list) and 'Recipe' in types):
+            return data
+        if '@graph' in data:
+            return find_json_ld_recipe(data['@graph'])
+    return None
+
+
+def json_ld_text(text):
+    return HTMLParser.HTMLParser().unescape(TAG_PATTERN.sub(' ', text))
+
+
+def json_ld_instructions(instructions):
+    """ recipeInstructions can be a string, a list of strings, HowToSteps, or
+    HowToSections of HowToSteps.
+    """
+    if isinstance(instructions, basestring):
+        return [json_ld_text(line) for line in instructions.split('\n') if line.strip()]
+
+    recipe_instructions = []
+    for instruction in instructions:
+        if isinstance(instruction, basestring):
+            recipe_instructions.append(json_ld_text(instruction))
+        elif 'itemListElement' in instruction:
+            recipe_instructions.extend(json_ld_instructions(instruction['itemListElement']))
+        elif 'text' in instruction:
+            recipe_instructions.append(json_ld_text(instruction['text']))
+    return recipe_instructions
+
+
+# ----------------------- Warm-up -----------------------------
+
+def warm_up():
+    """ Load the heavy dependencies and create the clients this container will
+    use, so the first real request doesn't pay for it. Runs at init time when
+    WARM_UP_ON_INIT is set (e.g. with provisioned concurrency), and on
+    scheduled warm-up events.
+    """
+    import bs4
+    import requests
+
+    get_dynamodb_client()
+    get_http_session()
+    get_parser_backend()
+    get_recipe_index()
+    get_spelling_index()
+
+
+if os.environ.get('WARM_UP_ON_INIT', '').lower() in ('1', 'true', 'yes'):
+    warm_up()
+
+
 if __name__ == "__main__":
+    from pprint import pprint
+
     recipe_results = search_for_recipe('chicken sausage and peppers macaroni casserole')
-    recipe_details = get_recipe_details(recipe_results[0]['recipe_title'], recipe_results[0]['recipe_url'])
-    pprint(recipe_details)
\ No newline at end of file
+    recipe_details = get_recipe_details(recipe_results[0].title, recipe_results[0].url)
+    pprint(recipe_details.instructions)
\ No newline at end of file
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+
+""" Shared fixtures: the skill module wired to benchmark.py's fixture HTTP
+server and in-memory DynamoDB, with its caches and counters reset for every
+test.
+"""
+
+import os
+import sys
+
+import botocore.exceptions
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Read by skinnytaste when it's imported
+os.environ['METRICS_SAMPLE_RATE'] = '0'
+os.environ['RECIPE_INDEX_PATH'] = ''
+
+import benchmark
+import skinnytaste
+
+
+@pytest.fixture(scope='session')
+def fixture_server():
+    server = benchmark.start_fixture_server()
+    yield server
+    server.shutdown()
+
+
+@pytest.fixture
+def skill(fixture_server, monkeypatch):
+    """ The skinnytaste module, scraping the fixture server and storing
+    everything in a fresh FakeDynamoDB (skill.dynamodb_client), without a
+    recipe index.
+    """
+    monkeypatch.setattr(skinnytaste, 'dynamodb_client', benchmark.FakeDynamoDB())
+    monkeypatch.setattr(skinnytaste, 'SKINNYTASTE_BASE_URL', fixture_server.base_url)
+    monkeypatch.setattr(skinnytaste, 'loaded_recipe_index', None)
+    monkeypatch.setattr(skinnytaste, 'recipe_index_loaded', True)
+    monkeypatch.setattr(skinnytaste, 'spelling_index', None)
+
+    for cache in (skinnytaste.recipe_cache, skinnytaste.search_cache, skinnytaste.stored_recipe_cache,
+                  skinnytaste.stored_recipe_versions, skinnytaste.user_item_cache, skinnytaste.user_recipe_cache,
+                  skinnytaste.host_next_request_at, skinnytaste.prefetches_in_flight):
+        cache.clear()
+    for stats in (skinnytaste.recipe_cache_stats, skinnytaste.search_cache_stats, skinnytaste.degraded_stats,
+                  skinnytaste.recipe_page_stats, skinnytaste.prefetch_stats):
+        for counter in stats:
+            stats[counter] = 0
+    skinnytaste.record_fetch_result(True)
+
+    fixture_server.fault = None
+    fixture_server.faults_left = None
+    fixture_server.request_counts.clear()
+
+    yield skinnytaste
+
+    # Let prefetches, refreshes and background writes finish before the next
+    # test resets the module
+    benchmark.wait_for_background_threads(fixture_server)
+    fixture_server.fault = None
+    fixture_server.faults_left = None
+
+
+@pytest.fixture
+def ask(skill):
+    """ ask(user_id, intent_name, slots=None, attributes=None) sends one
+    IntentRequest through lambda_handler and returns the response.
+    """
+    def ask(user_id, intent_name, slots=None, attributes=None, handler=None):
+        session = {
+            'new': False,
+            'sessionId': 'test-' + user_id,
+            'application': {'applicationId': 'test'},
+            'user': {'userId': user_id},
+            'attributes': attributes or {}
+        }
+        event = benchmark.make_event(session, 'IntentRequest', intent_name, slots)
+        return (handler or skill.lambda_handler)(event, None)
+    return ask
+
+
+def speech_of(response):
+    return response['response']['outputSpeech']['ssml']
+
+
+def fail_writes_to(dynamodb, table_name, operation='put_item'):
+    """ Make every operation call on table_name fail, as DynamoDB does when
+    it's throttling.
+    """
+    write = getattr(dynamodb, operation)
+
+    def failing_write(TableName, **kwargs):
+        if TableName == table_name:
+            raise botocore.exceptions.ClientError(
+                {'Error': {'Code': 'ProvisionedThroughputExceededException', 'Message': 'Slow down'}}, operation)
+        return write(TableName=TableName, **kwargs)
+    setattr(dynamodb, operation, failing_write)
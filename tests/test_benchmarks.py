@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+
+""" Latency of the hot intents, for pytest-benchmark:
+
+    python -m pytest tests/test_benchmarks.py --benchmark-autosave
+    python -m pytest tests/test_benchmarks.py --benchmark-compare
+
+Searches are answered from a recipe index of the fixture recipes, as in the
+replay. Skipped if pytest-benchmark isn't installed.
+"""
+
+import pytest
+
+pytest.importorskip('pytest_benchmark')
+
+import benchmark as fixtures
+import recipe_index
+
+
+SEARCH_CHICKEN = {'RecipeSearchString': {'name': 'RecipeSearchString', 'value': 'chicken'}}
+SEARCH_MISHEARD = {'RecipeSearchString': {'name': 'RecipeSearchString', 'value': 'chiken stir fry'}}
+SEARCH_INGREDIENTS = {'IngredientList': {'name': 'IngredientList', 'value': 'shrimp and lime'}}
+PICK_RECIPE_1 = {'RecipeNumber': {'name': 'RecipeNumber', 'value': '1'}}
+
+
+@pytest.fixture
+def indexed_skill(skill, fixture_server, monkeypatch):
+    monkeypatch.setattr(skill, 'PREFETCH_COUNT', 0)
+    monkeypatch.setattr(skill, 'loaded_recipe_index',
+                        recipe_index.build_index(fixtures.fixture_documents(fixture_server.base_url)))
+    return skill
+
+
+@pytest.fixture
+def cook(indexed_skill, ask):
+    """ ask() for a user who has searched for chicken and picked a recipe. """
+    attributes = ask('cook', 'SearchForRecipe', SEARCH_CHICKEN)['sessionAttributes']
+    attributes = ask('cook', 'PickRecipeNumber', PICK_RECIPE_1, attributes)['sessionAttributes']
+
+    def cook(intent_name, slots=None):
+        return ask('cook', intent_name, slots, attributes)
+    return cook
+
+
+@pytest.mark.parametrize('slots', [SEARCH_CHICKEN, SEARCH_MISHEARD], ids=['search', 'misheard search'])
+def test_search_from_the_index(benchmark, indexed_skill, ask, slots):
+    ask('cook', 'SearchForRecipe', slots)
+    response = benchmark(ask, 'cook', 'SearchForRecipe', slots)
+    assert response['sessionAttributes']['search_results']
+    assert indexed_skill.search_cache_stats['index_hits'] > 0
+
+
+def test_search_by_ingredients(benchmark, indexed_skill, ask):
+    response = benchmark(ask, 'cook', 'SearchByIngredients', SEARCH_INGREDIENTS)
+    assert response['sessionAttributes']['search_results']
+
+
+def test_pick_cached_recipe(benchmark, cook):
+    benchmark(cook, 'PickRecipeNumber', PICK_RECIPE_1)
+
+
+@pytest.mark.parametrize('intent_name', ['NextStep', 'PreviousStep', 'RepeatStep'])
+def test_step_navigation(benchmark, cook, intent_name):
+    benchmark(cook, intent_name)
+
+
+def test_timed_block(benchmark, skill):
+    def timed_block():
+        with skill.timed('Benchmark'):
+            pass
+    benchmark(timed_block)
+
+
+def test_invocation_metrics_not_sampled(benchmark, skill, cook):
+    response = cook('RepeatStep')
+    event = fixtures.make_event({'new': False, 'sessionId': 'test-cook', 'application': {'applicationId': 'test'},
+                                 'user': {'userId': 'cook'}, 'attributes': {}}, 'IntentRequest', 'RepeatStep')
+
+    def invocation_hooks():
+        skill.start_invocation_metrics()
+        skill.emit_invocation_metrics(event, response)
+    benchmark(invocation_hooks)
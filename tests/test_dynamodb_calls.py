@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+
+""" DynamoDB calls made by each intent: at most one read and one write of the
+user's progress item per request, and the recipe itself only written when
+it's picked. Also the read and write capacity units they're charged: which
+reads are strongly consistent, and that writes stay small whatever the size
+of the recipe.
+"""
+
+import pytest
+
+import benchmark as fixtures
+from conftest import speech_of
+
+
+def calls_made(skill, request):
+    """ Run request() and return the DynamoDB calls it made, as
+    {(operation, table name): count}.
+    """
+    table_call_counts = skill.dynamodb_client.table_call_counts
+    counts_before = dict(table_call_counts)
+    request()
+    return dict(
+        (table_call, count - counts_before.get(table_call, 0))
+        for table_call, count in table_call_counts.items()
+        if count != counts_before.get(table_call, 0)
+    )
+
+
+def units_used(skill, request):
+    """ Run request() and return the capacity units it used, as
+    {table name: (read units, write units)}.
+    """
+    table_units = skill.dynamodb_client.table_units
+    units_before = dict((table_name, tuple(units)) for table_name, units in table_units.items())
+    request()
+    units_used = {}
+    for table_name, (read_units, write_units) in table_units.items():
+        read_units_before, write_units_before = units_before.get(table_name, (0.0, 0))
+        if (read_units, write_units) != (read_units_before, write_units_before):
+            units_used[table_name] = (read_units - read_units_before, write_units - write_units_before)
+    return units_used
+
+
+@pytest.fixture
+def cook(skill, ask, fixture_server, monkeypatch):
+    """ ask() for a user who has searched, with the prefetch after searches
+    turned off so its calls don't mix with the ones being counted.
+    """
+    monkeypatch.setattr(skill, 'PREFETCH_COUNT', 0)
+    search_results = [['Recipe {0}'.format(recipe_id), '{0}/recipe-{1}/'.format(fixture_server.base_url, recipe_id)]
+                      for recipe_id in (2, 3, 4)]
+
+    def cook(intent_name, slots=None, user_id='cook'):
+        return ask(user_id, intent_name, slots, {'search_results': search_results})
+    return cook
+
+
+PROGRESS = 'skinnytaste'
+RECIPES = 'skinnytaste_recipes'
+CACHE = 'skinnytaste_cache'
+PICK_RECIPE_1 = {'RecipeNumber': {'name': 'RecipeNumber', 'value': '1'}}
+
+
+def test_launch_and_help_make_no_calls(skill, cook):
+    assert calls_made(skill, lambda: cook('AMAZON.HelpIntent')) == {}
+    assert calls_made(skill, lambda: cook('AMAZON.StopIntent')) == {}
+
+
+def test_search_only_uses_the_cache_table(skill, cook):
+    slots = {'RecipeSearchString': {'name': 'RecipeSearchString', 'value': 'chicken'}}
+    assert calls_made(skill, lambda: cook('SearchForRecipe', slots)) == {
+        ('get_item', CACHE): 1,
+        ('put_item', CACHE): 1
+    }
+    assert calls_made(skill, lambda: cook('SearchForRecipe', slots)) == {}
+
+
+def test_pick_reads_progress_once_and_writes_recipe_and_progress_once(skill, cook):
+    assert calls_made(skill, lambda: cook('PickRecipeNumber', PICK_RECIPE_1)) == {
+        ('get_item', CACHE): 1,
+        ('put_item', CACHE): 1,
+        ('put_item', RECIPES): 1,
+        ('get_item', PROGRESS): 1,
+        ('put_item', PROGRESS): 1
+    }
+
+    # Another user picking the same recipe in this container reuses the
+    # scraped and the stored recipe
+    assert calls_made(skill, lambda: cook('PickRecipeNumber', PICK_RECIPE_1, user_id='other cook')) == {
+        ('get_item', PROGRESS): 1,
+        ('put_item', PROGRESS): 1
+    }
+
+
+@pytest.mark.parametrize('intent_name', ['NextStep', 'PreviousStep'])
+def test_navigation_reads_and_updates_progress_once(skill, cook, intent_name):
+    cook('PickRecipeNumber', PICK_RECIPE_1)
+    cook('NextStep')
+
+    assert calls_made(skill, lambda: cook(intent_name)) == {
+        ('get_item', PROGRESS): 1,
+        ('update_item', PROGRESS): 1
+    }
+
+
+def test_repeat_and_resume_only_read_progress(skill, cook):
+    cook('PickRecipeNumber', PICK_RECIPE_1)
+
+    assert calls_made(skill, lambda: cook('RepeatStep')) == {('get_item', PROGRESS): 1}
+    assert calls_made(skill, lambda: cook('ResumeRecipe')) == {('get_item', PROGRESS): 1}
+
+
+def test_new_container_reads_the_stored_recipe_once(skill, cook):
+    cook('PickRecipeNumber', PICK_RECIPE_1)
+    skill.stored_recipe_cache.clear()
+
+    assert calls_made(skill, lambda: cook('NextStep')) == {
+        ('get_item', PROGRESS): 1,
+        ('get_item', RECIPES): 1,
+        ('update_item', PROGRESS): 1
+    }
+    assert calls_made(skill, lambda: cook('NextStep')) == {
+        ('get_item', PROGRESS): 1,
+        ('update_item', PROGRESS): 1
+    }
+
+
+def test_user_without_a_recipe_reads_progress_once(skill, cook):
+    calls = {}
+
+    def next_step():
+        calls['speech'] = speech_of(cook('NextStep', user_id='new user'))
+
+    assert calls_made(skill, next_step) == {('get_item', PROGRESS): 1}
+    assert 'picked a recipe yet' in calls['speech']
+
+
+# Capacity units per intent. Eventually consistent reads cost half a unit per
+# 4 KB, strongly consistent ones a whole unit; writes a unit per KB.
+
+def test_search_is_charged_for_the_cache_entry_only(skill, cook):
+    slots = {'RecipeSearchString': {'name': 'RecipeSearchString', 'value': 'chicken'}}
+    assert units_used(skill, lambda: cook('SearchForRecipe', slots)) == {CACHE: (0.5, 1)}
+    assert units_used(skill, lambda: cook('SearchForRecipe', slots)) == {}
+
+
+def test_pick_reads_eventually_consistent_and_writes_a_unit_per_table(skill, cook):
+    assert units_used(skill, lambda: cook('PickRecipeNumber', PICK_RECIPE_1)) == {
+        CACHE: (0.5, 1),
+        RECIPES: (0.0, 1),
+        PROGRESS: (0.5, 1)
+    }
+
+
+@pytest.mark.parametrize('intent_name', ['NextStep', 'PreviousStep'])
+def test_navigation_reads_eventually_consistent(skill, cook, intent_name):
+    cook('PickRecipeNumber', PICK_RECIPE_1)
+    cook('NextStep')
+
+    # The step read is checked by the write's condition, so it needn't be
+    # strongly consistent
+    assert units_used(skill, lambda: cook(intent_name)) == {PROGRESS: (0.5, 1)}
+
+
+@pytest.mark.parametrize('intent_name', ['RepeatStep', 'ResumeRecipe'])
+def test_repeat_and_resume_read_strongly_consistent(skill, cook, intent_name):
+    cook('PickRecipeNumber', PICK_RECIPE_1)
+
+    # They read back the step the previous request wrote
+    assert units_used(skill, lambda: cook(intent_name)) == {PROGRESS: (1.0, 0)}
+
+
+def test_stored_recipe_is_read_eventually_consistent(skill, cook):
+    cook('PickRecipeNumber', PICK_RECIPE_1)
+    skill.stored_recipe_cache.clear()
+
+    assert units_used(skill, lambda: cook('NextStep')) == {PROGRESS: (0.5, 1), RECIPES: (0.5, 0)}
+
+
+def test_step_writes_do_not_grow_with_the_recipe(skill, ask, fixture_server, monkeypatch):
+    monkeypatch.setattr(skill, 'PREFETCH_COUNT', 0)
+    search_results = [['Recipe 2', '{0}/recipe-2-steps-300/'.format(fixture_server.base_url)]]
+    dynamodb = skill.dynamodb_client
+
+    units = units_used(skill, lambda: ask('cook', 'PickRecipeNumber', PICK_RECIPE_1, {'search_results': search_results}))
+    recipe_size = fixtures.item_size(dynamodb.tables[RECIPES].values()[0])
+    assert recipe_size > 2048
+    assert units[RECIPES] == (0.0, -(-recipe_size // 1024))
+
+    # The progress item doesn't hold the recipe, so writing and reading it
+    # costs the least there is
+    assert units[PROGRESS] == (0.5, 1)
+    assert units_used(skill, lambda: ask('cook', 'NextStep')) == {PROGRESS: (0.5, 1)}
+    assert units_used(skill, lambda: ask('cook', 'RepeatStep')) == {PROGRESS: (1.0, 0)}
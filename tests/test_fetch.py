@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+
+""" The fetch layer against the fixture server: connection reuse, timeouts
+and the overall time budget, retries, and the circuit breaker opening and
+closing.
+"""
+
+import logging
+import time
+
+import pytest
+
+from conftest import speech_of
+
+
+@pytest.fixture
+def fetch(skill, fixture_server, monkeypatch):
+    """ fetch(path) GETs a fixture page with fetch_url, without waiting long
+    between retries.
+    """
+    monkeypatch.setattr(skill, 'FETCH_RETRY_BACKOFF', 0.01)
+
+    def fetch(path='/?s=chicken'):
+        response = skill.fetch_url(fixture_server.base_url + path)
+        return response.text
+    return fetch
+
+
+def test_sequential_fetches_reuse_one_connection(skill, fetch, fixture_server, monkeypatch):
+    monkeypatch.setattr(skill, 'http_session', None)
+    connections_before = fixture_server.connection_count
+
+    for query in ('chicken', 'soup', 'salad', 'tacos', 'chili'):
+        fetch('/?s=' + query)
+
+    assert fixture_server.connection_count - connections_before == 1
+
+
+@pytest.mark.parametrize('max_workers', [None, 12], ids=['default workers', 'more workers'])
+def test_batch_workers_keep_their_connections(skill, fixture_server, monkeypatch, caplog, max_workers):
+    # Streamed recipe pages close their connection when they're cut short, so
+    # read them whole; search pages always are
+    monkeypatch.setattr(skill, 'STREAM_RECIPE_PAGES', False)
+    monkeypatch.setattr(skill, 'http_session', None)
+    max_workers = max_workers or skill.BATCH_MAX_WORKERS
+    recipe_urls = ['{0}/recipe-{1}/'.format(fixture_server.base_url, recipe_id) for recipe_id in range(24)]
+    search_queries = ['chicken', 'soup', 'salad', 'tacos', 'chili', 'shrimp', 'pasta', 'turkey', 'pork', 'beef',
+                      'quinoa', 'lentils', 'zucchini', 'salmon', 'eggs', 'oatmeal']
+    connections_before = fixture_server.connection_count
+
+    with caplog.at_level(logging.WARNING, logger='urllib3.connectionpool'):
+        recipes = skill.fetch_recipes_batch(recipe_urls, max_workers=max_workers, requests_per_second=1000,
+                                            progress=None)
+        searches = skill.search_queries_batch(search_queries, max_workers=max_workers, requests_per_second=1000,
+                                              progress=None)
+
+    assert not [result for result in recipes.values() + searches.values() if isinstance(result, Exception)]
+    assert 'Connection pool is full' not in caplog.text
+    assert fixture_server.connection_count - connections_before <= max_workers
+
+
+def test_slow_site_is_given_up_on_within_the_budget(skill, fetch, fixture_server, monkeypatch):
+    import benchmark
+
+    monkeypatch.setattr(benchmark, 'FAULT_DELAY', 2.0)
+    monkeypatch.setattr(skill, 'FETCH_TIME_BUDGET', 0.5)
+    fixture_server.fault = 'slow'
+
+    started_at = time.time()
+    with pytest.raises(skill.OriginUnavailableError):
+        fetch()
+    assert time.time() - started_at < 1.0
+
+
+def test_request_deadline_bounds_the_fetches_of_a_request(skill, ask, fixture_server, monkeypatch):
+    import benchmark
+
+    monkeypatch.setattr(benchmark, 'FAULT_DELAY', 3.0)
+    monkeypatch.setattr(skill, 'ALEXA_RESPONSE_TIMEOUT', 1.5)
+    fixture_server.fault = 'slow'
+
+    started_at = time.time()
+    response = ask('cook', 'SearchForRecipe', {'RecipeSearchString': {'name': 'RecipeSearchString', 'value': 'chicken'}})
+    assert time.time() - started_at < 1.5
+    assert skill.ORIGIN_UNAVAILABLE_SPEECH in speech_of(response)
+
+
+def test_server_errors_are_retried(skill, fetch, fixture_server):
+    fixture_server.fault = 503
+    fixture_server.faults_left = skill.FETCH_MAX_RETRIES
+    attempts_before = fixture_server.attempts
+
+    assert 'recipe-' in fetch()
+    assert fixture_server.attempts - attempts_before == skill.FETCH_MAX_RETRIES + 1
+    assert skill.circuit_breaker['failures'] == 0
+
+
+def test_throttling_is_retried_and_never_cached(skill, fetch, fixture_server):
+    fixture_server.fault = 429
+    attempts_before = fixture_server.attempts
+
+    with pytest.raises(skill.OriginUnavailableError):
+        skill.search_for_recipe('chicken')
+    assert fixture_server.attempts - attempts_before == skill.FETCH_MAX_RETRIES + 1
+    assert skill.circuit_breaker['failures'] == 1
+    assert len(skill.search_cache) == 0
+    assert skill.dynamodb_client.tables.get('skinnytaste_cache', {}) == {}
+
+
+def test_client_errors_are_not_retried(skill, fetch, fixture_server):
+    attempts_before = fixture_server.attempts
+
+    with pytest.raises(skill.OriginUnavailableError):
+        fetch('/no-such-page/')
+    assert fixture_server.attempts - attempts_before == 1
+
+
+def test_circuit_breaker_opens_and_closes(skill, fetch, fixture_server, monkeypatch):
+    monkeypatch.setattr(skill, 'FETCH_MAX_RETRIES', 0)
+    fixture_server.fault = 'error'
+
+    for attempt in range(skill.CIRCUIT_FAILURE_THRESHOLD):
+        assert not skill.circuit_is_open()
+        with pytest.raises(skill.OriginUnavailableError):
+            fetch()
+    assert skill.circuit_is_open()
+
+    # While open, requests fail without reaching the site
+    attempts_before = fixture_server.attempts
+    with pytest.raises(skill.OriginUnavailableError):
+        fetch()
+    assert fixture_server.attempts == attempts_before
+
+    # Once the reset timeout has passed one trial request is let through, and
+    # a success closes the breaker
+    skill.circuit_breaker['opened_at'] -= skill.CIRCUIT_RESET_TIMEOUT
+    fixture_server.fault = None
+    assert not skill.circuit_is_open()
+    fetch()
+    assert skill.circuit_breaker == {'failures': 0, 'opened_at': None, 'trial_fetch': False}
+
+
+def test_half_open_breaker_lets_one_trial_fetch_through(skill, fetch, fixture_server, monkeypatch):
+    monkeypatch.setattr(skill, 'FETCH_MAX_RETRIES', 0)
+    fixture_server.fault = 'error'
+    for attempt in range(skill.CIRCUIT_FAILURE_THRESHOLD):
+        with pytest.raises(skill.OriginUnavailableError):
+            fetch()
+    skill.circuit_breaker['opened_at'] -= skill.CIRCUIT_RESET_TIMEOUT
+
+    # While the trial fetch is out, everyone else still fails fast
+    assert skill.start_fetch()
+    assert skill.circuit_is_open()
+    attempts_before = fixture_server.attempts
+    with pytest.raises(skill.OriginUnavailableError):
+        fetch()
+    assert fixture_server.attempts == attempts_before
+
+    # A failed trial keeps the breaker open for another reset timeout
+    skill.record_fetch_result(False)
+    assert skill.circuit_is_open()
+    assert not skill.start_fetch()
+    assert time.time() - skill.circuit_breaker['opened_at'] < 1
+
+
+def test_client_errors_do_not_open_the_circuit_breaker(skill, fetch, fixture_server):
+    for attempt in range(skill.CIRCUIT_FAILURE_THRESHOLD * 2):
+        with pytest.raises(skill.OriginUnavailableError):
+            fetch('/no-such-page/')
+    assert skill.circuit_breaker == {'failures': 0, 'opened_at': None, 'trial_fetch': False}
+
+    # ...but a client error answering the trial fetch ends the trial
+    skill.circuit_breaker.update(failures=skill.CIRCUIT_FAILURE_THRESHOLD,
+                                 opened_at=time.time() - skill.CIRCUIT_RESET_TIMEOUT)
+    with pytest.raises(skill.OriginUnavailableError):
+        fetch('/no-such-page/')
+    assert not skill.circuit_is_open()
+    fetch()
+    assert skill.circuit_breaker['opened_at'] is None
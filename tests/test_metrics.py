@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+
+""" Phase timings end up in the record of the invocation they belong to. """
+
+import threading
+
+from conftest import speech_of
+
+
+SEARCH_CHICKEN = {'RecipeSearchString': {'name': 'RecipeSearchString', 'value': 'chicken'}}
+
+
+def test_thread_timings_go_to_the_invocation_that_started_it(skill):
+    skill.start_invocation_metrics()
+    first_timings = skill.invocation_metrics['timings']
+    finish = threading.Event()
+
+    def work():
+        finish.wait()
+        with skill.timed('HttpFetch'):
+            pass
+
+    thread = skill.start_thread(work)
+
+    # The next invocation starts while the thread is still running
+    skill.start_invocation_metrics()
+    finish.set()
+    thread.join()
+
+    assert 'HttpFetch' in first_timings
+    assert 'HttpFetch' not in skill.invocation_metrics['timings']
+
+
+def test_threads_started_by_threads_keep_the_invocation(skill):
+    skill.start_invocation_metrics()
+    first_timings = skill.invocation_metrics['timings']
+
+    def work():
+        with skill.timed('HtmlParse'):
+            pass
+
+    skill.start_thread(lambda: skill.start_thread(work).join()).join()
+    skill.start_invocation_metrics()
+
+    assert 'HtmlParse' in first_timings
+
+
+def test_response_build_covers_the_card_and_speechlet(skill, ask, monkeypatch):
+    monkeypatch.setattr(skill, 'PREFETCH_COUNT', 0)
+    response_build_blocks = []
+    real_timed = skill.timed
+
+    class spy_timed(real_timed):
+        __slots__ = ()
+
+        def __exit__(self, exc_type, exc_value, traceback):
+            if self.phase == 'ResponseBuild':
+                response_build_blocks.append(self.phase)
+            return real_timed.__exit__(self, exc_type, exc_value, traceback)
+
+    monkeypatch.setattr(skill, 'timed', spy_timed)
+    response = ask('cook', 'SearchForRecipe', SEARCH_CHICKEN)
+
+    assert 'Which recipe number' in speech_of(response)
+    # The card, the speechlet and the response envelope
+    assert len(response_build_blocks) == 3
+    assert skill.invocation_metrics['timings']['ResponseBuild'] > 0
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+
+""" overlapped_lambda_handler answers exactly as lambda_handler does, with
+the same DynamoDB calls, while overlapping the reads and writes it can.
+"""
+
+import time
+
+import botocore.exceptions
+import pytest
+
+from conftest import fail_writes_to, speech_of
+
+
+SEARCH_CHICKEN = {'RecipeSearchString': {'name': 'RecipeSearchString', 'value': 'chicken'}}
+PICK_RECIPE_1 = {'RecipeNumber': {'name': 'RecipeNumber', 'value': '1'}}
+PICK_RECIPE_2 = {'RecipeNumber': {'name': 'RecipeNumber', 'value': '2'}}
+
+
+def cook_session(skill, ask, handler, user_id):
+    """ Search, pick, and move through the recipe with handler. Returns the
+    responses.
+    """
+    responses = []
+    attributes = {}
+    for intent_name, slots in [('SearchForRecipe', SEARCH_CHICKEN), ('PickRecipeNumber', PICK_RECIPE_2),
+                               ('NextStep', None), ('NextStep', None), ('PreviousStep', None),
+                               ('RepeatStep', None), ('ResumeRecipe', None)]:
+        response = ask(user_id, intent_name, slots, attributes, handler=handler)
+        attributes = response.get('sessionAttributes', {})
+        responses.append(response)
+    return responses
+
+
+def reset_caches(skill):
+    for cache in (skill.recipe_cache, skill.search_cache, skill.stored_recipe_cache, skill.stored_recipe_versions,
+                  skill.user_item_cache, skill.user_recipe_cache):
+        cache.clear()
+
+
+def test_same_responses_and_calls_as_lambda_handler(skill, ask, monkeypatch):
+    monkeypatch.setattr(skill, 'PREFETCH_COUNT', 0)
+    expected_responses = cook_session(skill, ask, skill.lambda_handler, 'cook')
+    expected_calls = dict(skill.dynamodb_client.table_call_counts)
+
+    skill.dynamodb_client.tables.clear()
+    skill.dynamodb_client.table_call_counts.clear()
+    reset_caches(skill)
+    assert cook_session(skill, ask, skill.overlapped_lambda_handler, 'cook') == expected_responses
+    assert skill.dynamodb_client.table_call_counts == expected_calls
+
+
+def call_times(skill, operation, table_name):
+    """ (started at, finished at) of each operation call on table_name. """
+    return [(started_at, finished_at) for call_operation, call_table_name, started_at, finished_at
+            in skill.dynamodb_client.call_times if (call_operation, call_table_name) == (operation, table_name)]
+
+
+def overlap(first, second):
+    return first[0] < second[1] and second[0] < first[1]
+
+
+def test_pick_reads_progress_while_fetching_the_recipe(skill, ask, fixture_server, monkeypatch):
+    import benchmark
+
+    monkeypatch.setattr(skill, 'PREFETCH_COUNT', 0)
+    monkeypatch.setattr(benchmark, 'FAULT_DELAY', 0.1)
+    skill.dynamodb_client.latency = 0.05
+    attributes = {'search_results': [['Recipe 2', '{0}/recipe-2/'.format(fixture_server.base_url)]]}
+
+    fetch_times = []
+    fetch_url = skill.fetch_url
+
+    def timed_fetch_url(url, *args, **kwargs):
+        started_at = time.time()
+        try:
+            return fetch_url(url, *args, **kwargs)
+        finally:
+            fetch_times.append((started_at, time.time()))
+    monkeypatch.setattr(skill, 'fetch_url', timed_fetch_url)
+
+    overlapping = {}
+    for handler in (skill.lambda_handler, skill.overlapped_lambda_handler):
+        reset_caches(skill)
+        skill.dynamodb_client.tables.clear()
+        del skill.dynamodb_client.call_times[:]
+        del fetch_times[:]
+        fixture_server.fault = 'slow'
+        response = ask('cook', 'PickRecipeNumber', PICK_RECIPE_1, attributes, handler=handler)
+        assert 'Here are the instructions for Recipe 2' in speech_of(response)
+
+        cache_read, = call_times(skill, 'get_item', skill.CACHE_TABLE_NAME)
+        progress_read, = call_times(skill, 'get_item', skill.PROGRESS_TABLE_NAME)
+        recipe_write, = call_times(skill, 'put_item', skill.RECIPES_TABLE_NAME)
+        progress_write, = call_times(skill, 'put_item', skill.PROGRESS_TABLE_NAME)
+        cache_write, = call_times(skill, 'put_item', skill.CACHE_TABLE_NAME)
+        recipe_fetch, = fetch_times
+        getting_recipe = (cache_read[0], recipe_fetch[1])
+        saving_pick = (recipe_write[0], progress_write[1])
+        overlapping[handler] = (overlap(progress_read, getting_recipe), overlap(cache_write, saving_pick))
+
+    # The progress read is made while the recipe is looked up in the shared
+    # cache and fetched, and the shared cache write alongside the recipe and
+    # progress writes
+    assert overlapping[skill.lambda_handler] == (False, False)
+    assert overlapping[skill.overlapped_lambda_handler] == (True, True)
+
+
+@pytest.mark.parametrize('handler_name', ['lambda_handler', 'overlapped_lambda_handler'])
+def test_failed_write_fails_the_request(skill, ask, fixture_server, monkeypatch, handler_name):
+    monkeypatch.setattr(skill, 'PREFETCH_COUNT', 0)
+    attributes = {'search_results': [['Recipe 2', '{0}/recipe-2/'.format(fixture_server.base_url)]]}
+
+    fail_writes_to(skill.dynamodb_client, skill.PROGRESS_TABLE_NAME)
+    with pytest.raises(botocore.exceptions.ClientError):
+        ask('cook', 'PickRecipeNumber', PICK_RECIPE_1, attributes, handler=getattr(skill, handler_name))
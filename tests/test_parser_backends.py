@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+
+""" Every HTML parser backend reads the same from the fixture pages as
+html.parser. benchmark.py --parser-backends compares their speed and memory.
+"""
+
+import io
+import os
+
+import pytest
+
+import benchmark as fixtures
+
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'recipe_index')
+
+PAGES = {
+    'recipe card': lambda: fixtures.recipe_page(2),
+    'legacy': lambda: fixtures.recipe_page(3),
+    'search': lambda: fixtures.search_page('http://fixture-server', 'chicken')
+}
+
+
+def read_page(skill, backend_name, page_kind):
+    skill.html_parser_backend = skill.resolve_parser_backend(backend_name)
+    page = PAGES[page_kind]()
+    if page_kind == 'search':
+        return [[search_result.title, search_result.url] for search_result in skill.parse_search_results(page)]
+    return skill.parse_recipe_details(page)
+
+
+@pytest.mark.parametrize('page_kind', sorted(PAGES))
+@pytest.mark.parametrize('backend_name', ['lxml', 'strainer', 'lxml-strainer', 'lxml-xpath'])
+def test_backend_reads_the_same_as_html_parser(skill, monkeypatch, backend_name, page_kind):
+    monkeypatch.setattr(skill, 'html_parser_backend', None)
+    expected = read_page(skill, 'html.parser', page_kind)
+
+    assert expected
+    assert read_page(skill, backend_name, page_kind) == expected
+
+
+# The recipe index's saved pages: both recipe layouts, a post that isn't a
+# recipe, and a recipe only readable from its JSON-LD
+SAVED_PAGES = ['chicken-chili', 'turkey-chili', 'chicken-salad', 'weekly-meal-plan', 'black-bean-soup']
+
+
+@pytest.mark.parametrize('page_name', SAVED_PAGES)
+def test_xpath_backend_extracts_the_same_from_saved_pages(skill, monkeypatch, page_name):
+    with io.open(os.path.join(FIXTURES_DIR, page_name + '.html'), encoding='utf-8') as page_file:
+        page = page_file.read()
+
+    def extract(backend_name):
+        monkeypatch.setattr(skill, 'html_parser_backend', skill.resolve_parser_backend(backend_name))
+        try:
+            return skill.extract_recipe_details(page)
+        except skill.RecipeParseError:
+            return None
+
+    assert extract('lxml-xpath') == extract('html.parser')
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+
+""" Prefetch of the top search results: it doesn't hold up the search
+response, which results it prefetches is kept in the session, a pick waits
+for the prefetch of its recipe rather than fetching it again, and counts as
+served by the prefetch only if it picks one of them.
+"""
+
+SEARCH_CHICKEN = {'RecipeSearchString': {'name': 'RecipeSearchString', 'value': 'chicken'}}
+
+
+def pick(number):
+    return {'RecipeNumber': {'name': 'RecipeNumber', 'value': str(number)}}
+
+
+def test_pick_of_a_prefetched_result_is_served_by_the_prefetch(skill, ask):
+    attributes = ask('cook', 'SearchForRecipe', SEARCH_CHICKEN)['sessionAttributes']
+    assert attributes['prefetched_results'] == [1, 2, 3]
+
+    ask('cook', 'PickRecipeNumber', pick(2), attributes)
+    assert skill.prefetch_stats['picks'] == 1
+    assert skill.prefetch_stats['picks_served_by_prefetch'] == 1
+
+
+def test_recipes_already_cached_are_not_prefetched(skill, ask):
+    search_results = skill.search_for_recipe('chicken')
+    skill.get_recipe_details(search_results[1].title, search_results[1].url)
+
+    attributes = ask('cook', 'SearchForRecipe', SEARCH_CHICKEN)['sessionAttributes']
+    assert attributes['prefetched_results'] == [1, 3]
+    assert skill.prefetch_stats['started'] == 2
+
+    # Served from the cache, but not thanks to the prefetch
+    ask('cook', 'PickRecipeNumber', pick(2), attributes)
+    assert skill.recipe_cache_stats['hits'] == 1
+    assert skill.prefetch_stats['picks_served_by_prefetch'] == 0
+
+
+def test_search_does_not_wait_for_the_prefetch(skill, ask, fixture_server, monkeypatch):
+    import benchmark
+
+    skill.search_for_recipe('chicken')
+    monkeypatch.setattr(benchmark, 'FAULT_DELAY', 0.5)
+    fixture_server.fault = 'slow'
+
+    attributes = ask('cook', 'SearchForRecipe', SEARCH_CHICKEN)['sessionAttributes']
+    assert attributes['prefetched_results'] == [1, 2, 3]
+    assert skill.prefetch_stats == {'started': 3, 'completed': 0, 'picks': 0, 'picks_served_by_prefetch': 0}
+    assert all(thread.is_alive() for thread in skill.prefetches_in_flight.values())
+
+    # The pick waits for its recipe's prefetch instead of fetching it again
+    ask('cook', 'PickRecipeNumber', pick(2), attributes)
+    assert skill.prefetch_stats['picks_served_by_prefetch'] == 1
+    assert fixture_server.request_counts['recipe'] == 3
+
+
+def test_recipes_being_prefetched_are_not_prefetched_again(skill, ask, fixture_server, monkeypatch):
+    import benchmark
+
+    skill.search_for_recipe('chicken')
+    monkeypatch.setattr(benchmark, 'FAULT_DELAY', 0.3)
+    fixture_server.fault = 'slow'
+
+    ask('cook', 'SearchForRecipe', SEARCH_CHICKEN)
+    attributes = ask('other cook', 'SearchForRecipe', SEARCH_CHICKEN)['sessionAttributes']
+    assert 'prefetched_results' not in attributes
+    assert skill.prefetch_stats['started'] == 3
+
+
+def test_old_sessions_flag_is_dropped(skill, ask):
+    attributes = ask('cook', 'SearchForRecipe', SEARCH_CHICKEN, {'recipes_prefetched': True})['sessionAttributes']
+    assert 'recipes_prefetched' not in attributes
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+
+""" Writing progress and stored recipes: progress never points at a recipe
+that wasn't stored, stored recipes outlive the progress pointing at them, and
+moving through a recipe copes with the progress item changing under the
+request (e.g. the user moved on another device).
+"""
+
+import time
+
+import botocore.exceptions
+import pytest
+
+from conftest import fail_writes_to, speech_of
+
+
+PICK_RECIPE_1 = {'RecipeNumber': {'name': 'RecipeNumber', 'value': '1'}}
+
+
+@pytest.fixture
+def cook(skill, ask, fixture_server, monkeypatch):
+    """ A user who has picked recipe 2 (12 steps) and moved to step 3. Returns
+    their session.
+    """
+    monkeypatch.setattr(skill, 'PREFETCH_COUNT', 0)
+    search_results = [['Recipe 2', '{0}/recipe-2/'.format(fixture_server.base_url)]]
+    ask('cook', 'PickRecipeNumber', PICK_RECIPE_1, {'search_results': search_results})
+    ask('cook', 'NextStep')
+    ask('cook', 'NextStep')
+    skill.clear_user_item_cache()
+    return {'user': {'userId': 'cook'}, 'attributes': {}}
+
+
+def progress_item(skill):
+    dynamodb = skill.dynamodb_client
+    return dynamodb.tables['skinnytaste'].get(dynamodb.key_of({'user_id': {'S': 'cook'}}))
+
+
+def stored_recipe_item(skill):
+    dynamodb = skill.dynamodb_client
+    return dynamodb.tables['skinnytaste_recipes'].values()[0]
+
+
+def test_move_is_applied_to_the_step_the_user_is_on(skill, cook):
+    assert skill.get_current_recipe_step(cook) == 3
+
+    # Another device moves the user on after this request read the item
+    progress_item(skill)['CurrentStep'] = {'N': '7'}
+    skill.set_current_recipe_step(cook, 4)
+
+    assert skill.dynamodb_client.failed_conditions == 1
+    assert progress_item(skill)['CurrentStep'] == {'N': '8'}
+    assert cook['attributes']['current_step'] == 8
+
+
+def test_move_stays_within_the_recipe(skill, cook):
+    skill.get_current_recipe_step(cook)
+    skill.set_current_recipe_step(cook, 40)
+
+    assert skill.dynamodb_client.failed_conditions == 0
+    assert progress_item(skill)['CurrentStep'] == {'N': '12'}
+
+
+@pytest.mark.parametrize('handler_name', ['lambda_handler', 'overlapped_lambda_handler'])
+def test_progress_is_not_written_when_the_recipe_write_fails(skill, ask, fixture_server, monkeypatch, handler_name):
+    monkeypatch.setattr(skill, 'PREFETCH_COUNT', 0)
+    attributes = {'search_results': [['Recipe 2', '{0}/recipe-2/'.format(fixture_server.base_url)]]}
+    handler = getattr(skill, handler_name)
+
+    fail_writes_to(skill.dynamodb_client, 'skinnytaste_recipes')
+    with pytest.raises(botocore.exceptions.ClientError):
+        ask('cook', 'PickRecipeNumber', PICK_RECIPE_1, attributes, handler=handler)
+    assert progress_item(skill) is None
+    assert len(skill.stored_recipe_versions) == 0
+
+    # The next pick stores the recipe, rather than taking it for stored
+    del skill.dynamodb_client.put_item
+    ask('cook', 'PickRecipeNumber', PICK_RECIPE_1, attributes, handler=handler)
+    assert progress_item(skill)['RecipeKey']['S'] == stored_recipe_item(skill)['recipe_key']['S']
+
+
+def test_navigation_renews_a_stored_recipe_about_to_expire(skill, ask, cook):
+    # A new container, and the recipe was stored long ago
+    stored_recipe_item(skill)['ExpiresAt'] = {'N': str(int(time.time()) + 24 * 60 * 60)}
+    skill.stored_recipe_cache.clear()
+    skill.stored_recipe_versions.clear()
+
+    ask('cook', 'NextStep')
+    assert int(stored_recipe_item(skill)['ExpiresAt']['N']) >= time.time() + skill.STORED_RECIPE_RETENTION - 60
+    assert skill.dynamodb_client.table_call_counts[('update_item', 'skinnytaste_recipes')] == 1
+
+    ask('cook', 'NextStep')
+    assert skill.dynamodb_client.table_call_counts[('update_item', 'skinnytaste_recipes')] == 1
+
+
+def test_next_step_after_the_progress_item_was_deleted(skill, ask, cook):
+    dynamodb = skill.dynamodb_client
+    update_item = dynamodb.update_item
+
+    def delete_then_update(**kwargs):
+        dynamodb.tables['skinnytaste'].clear()
+        return update_item(**kwargs)
+    dynamodb.update_item = delete_then_update
+
+    assert 'picked a recipe yet' in speech_of(ask('cook', 'NextStep'))
+
+
+@pytest.mark.parametrize('intent_name', ['NextStep', 'PreviousStep'])
+def test_move_is_not_reported_when_the_retry_conflicts_too(skill, ask, cook, intent_name):
+    dynamodb = skill.dynamodb_client
+    update_item = dynamodb.update_item
+
+    # Another device moves the user on before every write of this request
+    def move_then_update(**kwargs):
+        progress_item(skill)['CurrentStep'] = {'N': str(int(progress_item(skill)['CurrentStep']['N']) + 2)}
+        return update_item(**kwargs)
+    dynamodb.update_item = move_then_update
+
+    response = ask('cook', intent_name)
+    assert dynamodb.failed_conditions == 2
+    assert progress_item(skill)['CurrentStep'] == {'N': '7'}
+    assert response['sessionAttributes']['current_step'] == 7
+    assert speech_of(response).startswith('<speak>' + skill.PROGRESS_CONFLICT_SPEECH + '<p>Step 7 of 12: ')
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+
+""" The two recipe cache tiers: a miss scrapes the page once, hits don't go
+to the site, and expired entries are revalidated with ETag/Last-Modified.
+"""
+
+import time
+
+import pytest
+
+
+CACHE = 'skinnytaste_cache'
+
+
+@pytest.fixture
+def recipe(skill, fixture_server):
+    """ recipe() gets recipe 2 with get_recipe_details; its cache key is
+    recipe.cache_key.
+    """
+    recipe_url = '{0}/recipe-2/'.format(fixture_server.base_url)
+
+    def recipe():
+        return skill.get_recipe_details('Recipe 2', recipe_url)
+    recipe.cache_key = 'recipe:' + skill.normalize_recipe_url(recipe_url)
+    return recipe
+
+
+def shared_item(skill, cache_key):
+    dynamodb = skill.dynamodb_client
+    return dynamodb.tables[CACHE][dynamodb.key_of({'cache_key': {'S': cache_key}})]
+
+
+def expire(skill, cache_key):
+    """ Make both tiers' entries for cache_key stale. """
+    skill.recipe_cache[cache_key]['fresh_until'] = time.time() - 1
+    shared_item(skill, cache_key)['FreshUntil'] = {'N': str(time.time() - 1)}
+
+
+def test_miss_scrapes_the_page_and_fills_both_tiers(skill, recipe, fixture_server):
+    recipe_details = recipe()
+
+    assert skill.recipe_cache_stats == {'hits': 0, 'misses': 1, 'refreshes': 0}
+    assert fixture_server.request_counts == {'recipe': 1}
+    assert skill.recipe_cache[recipe.cache_key]['value'] is recipe_details
+
+    item = shared_item(skill, recipe.cache_key)
+    assert item['ETag']['S'].startswith('"')
+    assert 'LastModified' in item
+
+
+def test_hit_does_not_go_to_the_site(skill, recipe, fixture_server):
+    recipe_details = recipe()
+
+    assert recipe() is recipe_details
+    assert skill.recipe_cache_stats == {'hits': 1, 'misses': 1, 'refreshes': 0}
+    assert fixture_server.request_counts == {'recipe': 1}
+
+
+def test_shared_tier_hit_in_a_new_container(skill, recipe, fixture_server):
+    recipe_details = recipe()
+    skill.recipe_cache.clear()
+
+    assert recipe().encode() == recipe_details.encode()
+    assert skill.recipe_cache_stats == {'hits': 1, 'misses': 1, 'refreshes': 0}
+    assert fixture_server.request_counts == {'recipe': 1}
+
+
+def test_expired_entry_is_revalidated_with_a_304(skill, recipe, fixture_server):
+    recipe_details = recipe()
+    expire(skill, recipe.cache_key)
+
+    assert recipe() is recipe_details
+    assert skill.recipe_cache_stats == {'hits': 0, 'misses': 1, 'refreshes': 1}
+    assert fixture_server.request_counts == {'recipe': 1, 'not_modified': 1}
+
+    # Both tiers are fresh again
+    assert skill.recipe_cache[recipe.cache_key]['fresh_until'] > time.time()
+    assert float(shared_item(skill, recipe.cache_key)['FreshUntil']['N']) > time.time()
+    recipe()
+    assert skill.recipe_cache_stats['hits'] == 1
+
+
+def test_expired_entry_of_a_changed_page_is_scraped_again(skill, recipe, fixture_server):
+    recipe()
+    expire(skill, recipe.cache_key)
+    skill.recipe_cache[recipe.cache_key]['etag'] = '"changed"'
+
+    recipe()
+    assert skill.recipe_cache_stats == {'hits': 0, 'misses': 1, 'refreshes': 1}
+    assert fixture_server.request_counts == {'recipe': 2}
+    assert shared_item(skill, recipe.cache_key)['ETag']['S'] != '"changed"'
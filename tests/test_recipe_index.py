@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+
+""" Building the recipe index from saved sitemaps and recipe pages, rebuilding
+it with only the pages whose <lastmod> changed, and ranking its search
+results.
+"""
+
+import io
+import os
+
+import pytest
+
+import recipe_index
+from skinnytaste import OriginUnavailableError
+
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'recipe_index')
+SITE = 'https://www.skinnytaste.com/'
+
+# The saved pages that changed between the two crawls: the post sitemap has
+# a new recipe and a new <lastmod> for the turkey chili
+UPDATES = ['post-sitemap', 'turkey-chili']
+
+
+class SavedSite(object):
+    """ A fetch function serving the saved pages in FIXTURES_DIR by the last
+    part of their URL, and recording the URLs fetched. Pages named in
+    updated are served from their "-updated" copy, and those in failing
+    answer 503.
+    """
+
+    def __init__(self, updated=(), failing=()):
+        self.updated = set(updated)
+        self.failing = set(failing)
+        self.fetched = []
+
+    def __call__(self, url):
+        self.fetched.append(url)
+        name = url[len(SITE):].strip('/')
+        if name in self.failing:
+            raise OriginUnavailableError("Fetching " + url + " failed: HTTP 503")
+        name, extension = os.path.splitext(name) if name.endswith('.xml') else (name, '.html')
+        if name in self.updated:
+            name += '-updated'
+        with io.open(os.path.join(FIXTURES_DIR, name + extension), encoding='utf-8') as page:
+            return page.read()
+
+
+def build(site, previous_index=None):
+    pages = recipe_index.list_recipe_pages(fetch=site)
+    documents, skipped_pages = recipe_index.crawl(pages, previous_index, fetch=site)
+    return recipe_index.build_index(documents, skipped_pages)
+
+
+@pytest.fixture
+def index():
+    """ The index built from the saved site. """
+    return build(SavedSite())
+
+
+@pytest.fixture
+def updated_index():
+    """ The index built from scratch after the site added a recipe and
+    changed another.
+    """
+    return build(SavedSite(updated=UPDATES))
+
+
+def titles(results):
+    return [result.title for result in results]
+
+
+def test_only_post_sitemaps_are_listed():
+    site = SavedSite()
+    pages = recipe_index.list_recipe_pages(fetch=site)
+
+    assert site.fetched == [recipe_index.SITEMAP_INDEX_URL, SITE + 'post-sitemap.xml']
+    assert pages == [
+        (SITE + 'chicken-chili/', '2026-05-11T18:20:03+00:00'),
+        (SITE + 'turkey-chili/', '2026-06-02T07:45:51+00:00'),
+        (SITE + 'chicken-salad/', '2026-08-19T12:10:27+00:00'),
+        (SITE + 'weekly-meal-plan/', '2026-09-30T14:02:11+00:00')
+    ]
+
+
+def test_first_build_fetches_every_page_and_skips_non_recipes():
+    site = SavedSite()
+    index = build(site)
+
+    assert site.fetched[2:] == [SITE + 'chicken-chili/', SITE + 'turkey-chili/', SITE + 'chicken-salad/',
+                                SITE + 'weekly-meal-plan/']
+    assert [document['title'] for document in index['documents']] == [
+        'White Chicken Chili', 'Turkey Chili', 'Greek Yogurt Chicken Salad']
+    assert index['documents'][1] == {
+        'title': 'Turkey Chili',
+        'url': SITE + 'turkey-chili/',
+        'lastmod': '2026-06-02T07:45:51+00:00',
+        'ingredients': ['1 lb lean ground turkey', '1 can kidney beans, rinsed', '1 can crushed tomatoes',
+                        '2 tbsp chili powder']
+    }
+    assert index['skipped_pages'] == {SITE + 'weekly-meal-plan/': '2026-09-30T14:02:11+00:00'}
+
+
+def test_rebuild_fetches_only_changed_and_new_pages(index, tmpdir):
+    index_path = str(tmpdir.join('recipe_index.json.gz'))
+    recipe_index.save_index(index, index_path)
+    previous_index = recipe_index.load_index(index_path)
+
+    site = SavedSite(updated=UPDATES)
+    rebuilt_index = build(site, previous_index)
+
+    # The unchanged non-recipe post isn't fetched again either
+    assert site.fetched[2:] == [SITE + 'turkey-chili/', SITE + 'black-bean-soup/']
+    assert rebuilt_index['skipped_pages'] == previous_index['skipped_pages']
+    documents = rebuilt_index['documents']
+    assert [document['title'] for document in documents] == [
+        'White Chicken Chili', 'Turkey Chili', 'Greek Yogurt Chicken Salad', 'Black Bean Soup']
+    assert documents[0] == previous_index['documents'][0]
+    assert documents[2] == previous_index['documents'][2]
+    assert documents[1]['lastmod'] == '2026-10-05T16:31:09+00:00'
+    assert '1 cup frozen corn' in documents[1]['ingredients']
+    assert titles(recipe_index.search_index(rebuilt_index, 'corn')) == ['Turkey Chili']
+
+
+def test_pages_without_lastmod_are_fetched_again(index):
+    site = SavedSite()
+    pages = [(document['url'], None) for document in index['documents']]
+    recipe_index.crawl(pages, index, fetch=site)
+
+    assert site.fetched == [url for url, _ in pages]
+
+
+def test_changed_non_recipe_page_is_fetched_again(index):
+    site = SavedSite()
+    pages = [(SITE + 'weekly-meal-plan/', '2026-10-07T08:00:00+00:00')]
+    documents, skipped_pages = recipe_index.crawl(pages, index, fetch=site)
+
+    assert site.fetched == [SITE + 'weekly-meal-plan/']
+    assert documents == []
+    assert skipped_pages == {SITE + 'weekly-meal-plan/': '2026-10-07T08:00:00+00:00'}
+
+
+def test_pages_that_fail_keep_their_previous_document(index):
+    site = SavedSite(updated=UPDATES, failing=['turkey-chili', 'black-bean-soup'])
+    rebuilt_index = build(site, index)
+
+    # Both are tried, and the rest of the crawl carries on
+    assert site.fetched[2:] == [SITE + 'turkey-chili/', SITE + 'black-bean-soup/']
+    assert rebuilt_index['documents'] == index['documents']
+
+    # The next build tries them again
+    site = SavedSite(updated=UPDATES)
+    build(site, rebuilt_index)
+    assert site.fetched[2:] == [SITE + 'turkey-chili/', SITE + 'black-bean-soup/']
+
+
+def test_incremental_rebuild_matches_full_rebuild(index, updated_index):
+    assert build(SavedSite(updated=UPDATES), index) == updated_index
+
+
+def test_title_matches_rank_above_ingredient_matches(updated_index):
+    # Beans are in all three ingredient lists, but only in one title
+    assert titles(recipe_index.search_index(updated_index, 'beans')) == [
+        'Black Bean Soup', 'White Chicken Chili', 'Turkey Chili']
+    assert titles(recipe_index.search_index(updated_index, 'chili')) == ['Turkey Chili', 'White Chicken Chili']
+
+
+def test_shorter_recipes_rank_higher_for_the_same_match(updated_index):
+    assert updated_index['doc_lengths'][3] < updated_index['doc_lengths'][0]
+    assert titles(recipe_index.search_index(updated_index, 'broth')) == ['Black Bean Soup', 'White Chicken Chili']
+
+
+def test_more_matching_words_rank_higher(updated_index):
+    assert titles(recipe_index.search_index(updated_index, 'turkey chili')) == ['Turkey Chili', 'White Chicken Chili']
+    assert titles(recipe_index.search_index(updated_index, 'chicken chili')) == [
+        'White Chicken Chili', 'Turkey Chili', 'Greek Yogurt Chicken Salad']
+    assert titles(recipe_index.search_index(updated_index, 'chicken salad with grapes')) == [
+        'Greek Yogurt Chicken Salad', 'White Chicken Chili']
+
+
+def test_stopwords_and_unknown_words_match_nothing(updated_index):
+    assert recipe_index.search_index(updated_index, 'the recipe') == []
+    assert recipe_index.search_index(updated_index, 'lasagna') == []
+    assert titles(recipe_index.search_index(updated_index, 'tomatoes')) == ['Turkey Chili']
+
+
+def test_results_are_limited_and_link_to_the_page(updated_index):
+    results = recipe_index.search_index(updated_index, 'chicken chili', max_results=2)
+
+    assert titles(results) == ['White Chicken Chili', 'Turkey Chili']
+    assert results[0].url == SITE + 'chicken-chili/'
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+
+""" normalize_recipe_details and split_long_step on recipes scraped from the
+fixture pages: the current recipe card, legacy "Directions:" posts, and the
+redesigned layout read from its JSON-LD.
+"""
+
+import pytest
+
+import benchmark as fixtures
+
+
+# Fixture recipe id and page for each layout: even ids get the recipe card,
+# odd ones the legacy layout
+LAYOUTS = {
+    'recipe card': (2, fixtures.recipe_page),
+    'legacy': (3, fixtures.recipe_page),
+    'json-ld': (4, fixtures.redesigned_recipe_page)
+}
+
+LONG_STEP = ('Heat the oil in a large skillet over medium-high heat. Add the onion and garlic and cook, stirring '
+             'often, until soft and golden, about 5 minutes. Stir in the spices and cook until fragrant, about 30 '
+             'seconds more. Add the chicken in a single layer and sear without moving it for 3 minutes, then turn '
+             'the pieces over. Pour in the broth and the tomatoes, scrape up the browned bits from the bottom of the '
+             'pan, and bring everything to a simmer. Cover and cook until the chicken is cooked through, about 12 '
+             'minutes. Season with salt and pepper to taste!')
+
+
+def scrape(skill, layout, number_of_steps=12, long_step=None):
+    """ Normalize the recipe scraped from a fixture page in layout, with its
+    second step replaced by long_step if given.
+    """
+    recipe_id, recipe_page = LAYOUTS[layout]
+    page = recipe_page(recipe_id, number_of_steps)
+    if long_step is not None:
+        _, steps = fixtures.recipe_contents(recipe_id, number_of_steps)
+        page = page.replace(steps[1], long_step)
+    return skill.normalize_recipe_details(skill.extract_recipe_details(page))
+
+
+@pytest.mark.parametrize('layout', sorted(LAYOUTS))
+def test_normalized_recipe_matches_the_page(skill, layout):
+    recipe = scrape(skill, layout)
+    ingredients, steps = fixtures.recipe_contents(LAYOUTS[layout][0], 12)
+
+    assert recipe.ingredients == ['1 cup ' + ingredient for ingredient in ingredients]
+    # Whitespace collapsed, and the links in some steps left out
+    assert recipe.instructions == [' '.join(step.split()) for step in steps]
+
+
+@pytest.mark.parametrize('layout', sorted(LAYOUTS))
+def test_steps_speech_and_card_are_rendered(skill, layout):
+    recipe = scrape(skill, layout)
+
+    assert len(recipe.steps_ssml) == 12
+    assert recipe.steps_ssml[0].startswith('<p>Step 1 of 12: ' + recipe.instructions[0].replace(' . ', ''))
+    assert 'next step' in recipe.steps_ssml[0]
+    assert recipe.steps_ssml[-1].endswith('<p>This was the final step! Happy cooking!</p>')
+    assert recipe.card_text.splitlines() == [
+        'Step {0}: {1}'.format(step_number, instruction)
+        for step_number, instruction in enumerate(recipe.instructions, 1)
+    ]
+
+
+@pytest.mark.parametrize('layout', sorted(LAYOUTS))
+def test_long_steps_are_split_and_numbered(skill, layout):
+    recipe = scrape(skill, layout, long_step=LONG_STEP)
+    parts = skill.split_long_step(LONG_STEP)
+
+    assert len(parts) > 1
+    assert recipe.instructions[1:1 + len(parts)] == parts
+    assert len(recipe.instructions) == 12 + len(parts) - 1
+    total_steps = len(recipe.instructions)
+    assert recipe.steps_ssml[2].startswith('<p>Step 3 of {0}: '.format(total_steps))
+
+
+def test_short_steps_are_kept_whole(skill):
+    instruction = 'Preheat the oven to 400 degrees. Line a baking sheet with foil.'
+    assert skill.split_long_step(instruction) == [instruction]
+
+
+def test_long_steps_split_at_sentence_boundaries(skill):
+    parts = skill.split_long_step(LONG_STEP)
+
+    assert ' '.join(parts) == LONG_STEP
+    for part in parts:
+        assert len(part) <= skill.MAX_STEP_LENGTH
+        assert part[-1] in '.!?'
+
+
+def test_an_overlong_sentence_is_not_cut(skill):
+    sentence = 'Stir ' + 'and stir ' * 60 + 'until thick.'
+    assert skill.split_long_step(sentence) == [sentence]
+    assert skill.split_long_step(sentence + ' Serve warm.') == [sentence, 'Serve warm.']
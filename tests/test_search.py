@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+
+""" Search queries are normalized and rewritten once, whichever search
+answers them.
+"""
+
+
+def count_rewrites(skill, monkeypatch):
+    """ Record the queries rewrite_search_query is given. """
+    rewritten = []
+    rewrite_search_query = skill.rewrite_search_query
+
+    def counted_rewrite_search_query(query):
+        rewritten.append(query)
+        return rewrite_search_query(query)
+    monkeypatch.setattr(skill, 'rewrite_search_query', counted_rewrite_search_query)
+    return rewritten
+
+
+def test_search_rewrites_the_query_once(skill, monkeypatch, fixture_server):
+    rewritten = count_rewrites(skill, monkeypatch)
+
+    assert len(skill.search_for_recipe('prawns')) > 0
+    assert rewritten == ['prawns']
+    assert skill.search_cache_stats['rewrites'] == 1
+    assert 'search:shrimp' in skill.search_cache
+
+
+def test_ingredient_search_falling_back_to_the_live_search_rewrites_the_query_once(skill, monkeypatch,
+                                                                                  fixture_server):
+    rewritten = count_rewrites(skill, monkeypatch)
+
+    assert len(skill.search_by_ingredients('prawns and lime')) > 0
+    assert rewritten == ['prawns and lime']
+    assert skill.search_cache_stats['rewrites'] == 1
+    assert fixture_server.request_counts == {'search': 1}
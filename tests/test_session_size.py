@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+
+""" sessionAttributes stay small however big the recipe is: the session
+keeps the three search results, the recipe's key and the step, and the steps
+themselves are read from DynamoDB.
+"""
+
+import json
+
+import pytest
+
+
+SEARCH_CHICKEN = {'RecipeSearchString': {'name': 'RecipeSearchString', 'value': 'chicken'}}
+PICK_RECIPE_1 = {'RecipeNumber': {'name': 'RecipeNumber', 'value': '1'}}
+
+# Alexa allows sessionAttributes in the 24 KB response; ours stay far below
+SESSION_ATTRIBUTES_LIMIT = 1024
+
+
+def session_sizes(skill, ask, number_of_steps):
+    """ Search, pick a recipe with number_of_steps steps, and move through it.
+    Returns the size of the serialized sessionAttributes after every turn.
+    """
+    sizes = []
+    attributes = ask('cook', 'SearchForRecipe', SEARCH_CHICKEN)['sessionAttributes']
+    sizes.append(len(json.dumps(attributes)))
+
+    # Swap in the same recipes with more steps (and longer pages)
+    attributes['search_results'] = [
+        [recipe_title, recipe_url.rstrip('/') + '-steps-{0}/'.format(number_of_steps)]
+        for recipe_title, recipe_url in attributes['search_results']
+    ]
+    for intent_name, slots in [('PickRecipeNumber', PICK_RECIPE_1), ('NextStep', None), ('NextStep', None),
+                               ('PreviousStep', None), ('RepeatStep', None), ('ResumeRecipe', None)]:
+        response = ask('cook', intent_name, slots, attributes)
+        assert 'Step text' in response['response']['outputSpeech']['ssml']
+        attributes = response['sessionAttributes']
+        serialized = json.dumps(attributes)
+        assert 'Step text' not in serialized
+        sizes.append(len(serialized))
+    return sizes
+
+
+@pytest.mark.parametrize('number_of_steps', [100, 400, 900])
+def test_session_attributes_stay_bounded(skill, ask, monkeypatch, number_of_steps):
+    monkeypatch.setattr(skill, 'PREFETCH_COUNT', 0)
+    sizes = session_sizes(skill, ask, number_of_steps)
+
+    assert max(sizes) < SESSION_ATTRIBUTES_LIMIT
+    # Nothing is carried over from turn to turn but the step
+    assert max(sizes[2:]) - min(sizes[2:]) <= 2
+
+
+def test_session_size_does_not_depend_on_the_recipe(skill, ask, monkeypatch):
+    monkeypatch.setattr(skill, 'PREFETCH_COUNT', 0)
+    sizes = session_sizes(skill, ask, 100)
+    for cache in (skill.recipe_cache, skill.stored_recipe_cache, skill.stored_recipe_versions,
+                  skill.user_item_cache, skill.user_recipe_cache):
+        cache.clear()
+
+    assert session_sizes(skill, ask, 900) == sizes